@@ -2,23 +2,25 @@ from pathlib import Path
 from typing import List, Optional
 import json
 import logging
+import os
 import shutil
 from urllib.parse import urlparse
 
-from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from favorites_api import router as collections_router
 import favorites_models  # ✅ 新增：让 SQLAlchemy 知道有这两张表
 from pydantic import BaseModel
 
-from database import SessionLocal, engine
+from database import SessionLocal, add_missing_columns, engine
 import models
 import schemas
 import crud
-from indexer import sync_from_fs, ensure_thumb_for_image
+from indexer import ensure_thumb_for_image
 from config import (
     MEDIA_ROOT,
     FRONTEND_DIR,
@@ -27,15 +29,62 @@ from config import (
     PROJECT_PAGE_SIZE,
     HOT_TAG_LIMIT,
     FIXED_HOT_TAGS,
+    INDEXER_SYNC_ON_STARTUP,
+    DISPLAY_LONG_EDGE,
 )
 
 from web_import import router as web_import_router  # “从网站导入”相关路由
+from fs_watcher import start_watcher, stop_watcher  # 文件监听
+from http_cache import (  # /thumbs、/media 的 HTTP 缓存
+    CachedStaticFiles,
+    cached_blob_response,
+    cached_file_response,
+)
+from thumb_inventory import (  # 缩略图清单 + 后台完整性检查
+    router as thumb_inventory_router,
+    stop_integrity_pass,
+)
+from thumb_ondemand import (  # 缩略图按需生成
+    find_known_thumbnails,
+    generate_rendition,
+    locate_images,
+    record_generated,
+    stop_ondemand_generation,
+)
+from thumb_batch import router as thumb_batch_router  # 缩略图批量获取
+from thumb_gc import (  # 孤立缩略图清理
+    router as thumb_gc_router,
+    stop_gc_pass,
+)
+from thumb_tiles import (  # 超大图的分块金字塔（Deep Zoom）
+    router as thumb_tiles_router,
+    stop_tile_generation,
+)
+from thumb_placeholders import stop_placeholder_pass  # 列表里的加载占位（后台补齐）
+from thumb_store import StoredThumb, close_thumb_store, get_thumb_store  # 缩略图存储后端
+from thumb_renditions import (  # 缩略图多尺寸 / 新格式版本
+    negotiate_format,
+    snap_width,
+    variant_name,
+)
+from thumb_worker import (  # 缩略图后台预生成
+    router as thumb_worker_router,
+    start_thumb_worker,
+    stop_thumb_worker,
+)
+from sync_jobs import (  # 后台同步任务
+    router as sync_jobs_router,
+    request_folder_sync,
+    start_sync_job,
+)
 import requests
 
 logger = logging.getLogger(__name__)
 
 # ========== 数据库初始化 ==========
 models.Base.metadata.create_all(bind=engine)
+# 已有数据库补上模型里新增的列（例如 images.file_size）
+add_missing_columns(engine)
 
 # ========== FastAPI 应用 ==========
 app = FastAPI(title="CaseLib Backend")
@@ -52,6 +101,12 @@ app.add_middleware(
 # 挂载“从网站导入”相关 API
 app.include_router(web_import_router)
 app.include_router(collections_router)
+app.include_router(sync_jobs_router)
+app.include_router(thumb_worker_router)
+app.include_router(thumb_inventory_router)
+app.include_router(thumb_batch_router)
+app.include_router(thumb_gc_router)
+app.include_router(thumb_tiles_router)
 
 
 @app.get("/web-import", include_in_schema=False)
@@ -71,23 +126,64 @@ def get_db():
         db.close()
 
 
-# ========== 启动时自动同步一次 ==========
+# ========== 启动时自动同步一次（后台进行） ==========
 @app.on_event("startup")
 def on_startup():
     """
-    服务启动时执行一次全量 sync_from_fs。
+    服务启动时在后台线程里执行一次 sync_from_fs（增量模式，依赖目录清单跳过未变化的目录）。
+
+    - 不阻塞启动：服务立刻用数据库里已有的索引对外提供服务，同步完成后新内容自然可见；
+    - 作为一个普通的同步任务运行（见 sync_jobs），可以在 /api/admin/resync 查看进度，
+      期间手动刷新会直接加入这个任务；
+    - config.ini [indexer] sync_on_startup = false 时完全跳过启动同步
+      （由手动刷新 / 文件监听保持索引新鲜，开发时 reload 也不会每次都扫盘）。
     之后不再在每个请求里自动同步。
     """
-    db = SessionLocal()
-    try:
-        sync_from_fs(db)
-    finally:
-        db.close()
+    if not INDEXER_SYNC_ON_STARTUP:
+        logger.info("已配置跳过启动同步（[indexer] sync_on_startup = false）")
+        return
+
+    start_sync_job(full=False, source="startup")
+
+
+@app.on_event("startup")
+def start_fs_watcher():
+    """
+    按 config.ini [indexer] watch_mode 启动文件监听（默认 off）：
+    目录有变化时自动做单目录同步，新放进共享盘的图片几秒内可见。
+    """
+    start_watcher()
+
+
+@app.on_event("shutdown")
+def stop_fs_watcher():
+    stop_watcher()
+
+
+@app.on_event("startup")
+def start_thumb_pregeneration():
+    """
+    启动缩略图后台预生成（config.ini [thumbnails] pregenerate_workers = 0 时关闭）：
+    同步发现的新图片会按“封面优先、热度高的项目优先”在进程池里提前生成缩略图。
+    """
+    start_thumb_worker()
+
+
+@app.on_event("shutdown")
+def stop_thumb_pregeneration():
+    stop_thumb_worker()
+    stop_integrity_pass()
+    stop_placeholder_pass()
+    stop_gc_pass()
+    stop_ondemand_generation()
+    stop_tile_generation()
+    close_thumb_store()
 
 
 # ========== 挂载静态资源 ==========
 # 1) 媒体文件（原图）：/media/...
-app.mount("/media", StaticFiles(directory=str(MEDIA_ROOT)), name="media")
+#    带 ETag / Last-Modified，条件请求回 304；带 ?v=版本号 的地址长期缓存（见 http_cache）
+app.mount("/media", CachedStaticFiles(directory=str(MEDIA_ROOT)), name="media")
 
 # 2) 前端静态资源（css / js / 额外 html）：/static/...
 app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
@@ -116,58 +212,149 @@ def _guess_mime(path: Path) -> str:
         return "image/gif"
     if suffix == ".webp":
         return "image/webp"
+    if suffix == ".avif":
+        return "image/avif"
     if suffix in {".tif", ".tiff"}:
         return "image/tiff"
     return "application/octet-stream"
 
 
-# ========== 缩略图路由：/thumbs/{path} ==========
+# ========== 缩略图路由：/thumbs/{path}、/display/{path} ==========
+def _thumb_response(request: Request, thumb: StoredThumb, versioned: bool) -> Response:
+    """从缩略图存储发送一张缩略图（条件请求命中时回 304，不读内容）。"""
+    return cached_blob_response(
+        request.headers,
+        lambda: get_thumb_store().read(thumb),
+        thumb.size,
+        thumb.mtime_ns,
+        media_type=_guess_mime(thumb.key),
+        headers={"Vary": "Accept"},
+        versioned=versioned,
+    )
+
+
+def _serve_known_thumbnail(
+    db: Session,
+    request: Request,
+    path: str,
+    variant: str,
+    versioned: bool,
+) -> Optional[Response]:
+    """
+    热路径：内存路径缓存（命中时不查数据库）或缩略图清单里有该版本 → 到缩略图存储 stat 一次直接发送。
+    都没有（或文件已被删掉）时返回 None。
+    """
+    known = find_known_thumbnails(db, [path], variant).get(path)
+    if known is None:
+        return None
+    try:
+        return _thumb_response(request, known, versioned)
+    except OSError:
+        # stat 之后刚被删掉 / 被 packed 存储淘汰：走按需生成
+        return None
+
+
+def _locate_image(db: Session, path: str) -> tuple[Path, Path]:
+    """(项目目录, 原图绝对路径)，见 thumb_ondemand.locate_images；索引里没有时 404。"""
+    location = locate_images(db, [path]).get(path)
+    if location is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return location
+
+
+def _serve_generated_thumbnail(
+    db: Session,
+    request: Request,
+    path: str,
+    variant: str,
+    versioned: bool,
+    thumb_path: Optional[Path],
+    abs_image_path: Path,
+) -> Response:
+    """发送刚生成的缩略图并记入清单；生成失败时回退原图（回退的原图不长期缓存：下次还要再试着生成）。"""
+    written = record_generated(db, [(path, variant, thumb_path)]).get(path)
+    if written is not None:
+        try:
+            return _thumb_response(request, written, versioned)
+        except OSError:
+            pass
+    if not abs_image_path.is_file():
+        raise HTTPException(status_code=404, detail="Image file not found on disk")
+
+    return cached_file_response(
+        request.headers,
+        abs_image_path,
+        media_type=_guess_mime(abs_image_path),
+        headers={"Vary": "Accept"},
+        versioned=False,
+    )
+
+
+async def _serve_rendition(
+    db: Session,
+    request: Request,
+    path: str,
+    width: int,
+    versioned: bool,
+) -> Response:
+    """/thumbs 与 /display 共用：发送现成的版本，没有时按需生成（见 get_thumbnail 的说明）。"""
+    fmt = negotiate_format(request.headers.get("accept", ""))
+    variant = variant_name(width, fmt)
+
+    response = await run_in_threadpool(
+        _serve_known_thumbnail, db, request, path, variant, versioned
+    )
+    if response is not None:
+        return response
+
+    project_dir, abs_image_path = await run_in_threadpool(_locate_image, db, path)
+    thumb_path = await generate_rendition(abs_image_path, project_dir, width, fmt)
+    return await run_in_threadpool(
+        _serve_generated_thumbnail,
+        db, request, path, variant, versioned, thumb_path, abs_image_path,
+    )
+
+
 @app.get("/thumbs/{path:path}")
-def get_thumbnail(
+async def get_thumbnail(
     path: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, description="期望的长边像素，取不小于它的最小档位"),
+    v: Optional[str] = Query(None, description="缩略图版本号（列表接口给出），带上时长期缓存"),
     db: Session = Depends(get_db),
 ):
     """
     缩略图获取：
     - path 为 Image.file_rel_path（相对 MEDIA_ROOT）
-    - 内部会：
-      1）从 DB 找到对应 Image + Project
-      2）按项目目录生成/读取 _thumbs 下的缩略图
+    - ?w= 选择尺寸档位（见 thumb_renditions），不传为默认档位；
+      格式按 Accept 协商（AVIF / WebP，不支持时 JPEG），响应带 Vary: Accept
+    - 响应带 ETag / Last-Modified，条件请求命中时回 304；
+      带 ?v=版本号 时 Cache-Control: immutable 缓存一年（原图变了版本号就变，见 http_cache）
+    - 热路径：内存路径缓存（见 thumb_path_cache，命中时不查数据库）或缩略图清单（thumbnails 表）
+      里有该版本 → 到缩略图存储（_thumbs 目录或服务器本地的 packed 存储，见 thumb_store）stat 一次直接发送，
+      不再校验文件（完整性检查在后台进行，见 thumb_inventory）
+    - 都没有时：
+      1）从路径缓存 / DB 找到对应 Image 所在的项目目录
+      2）在专用线程池里生成该版本缩略图（同一版本的并发请求只生成一次，见 thumb_ondemand），
+         等待期间不占公共线程池；生成好后记入清单
       3）如果缩略图失败，则回退到原图
     """
-    # 找到这张图
-    image = (
-        db.query(models.Image)
-        .filter(models.Image.file_rel_path == path)
-        .first()
-    )
-    if image is None:
-        raise HTTPException(status_code=404, detail="Image not found")
-
-    project = image.project
-    if project is None:
-        raise HTTPException(status_code=404, detail="Project not found for image")
-
-    project_dir = (MEDIA_ROOT / project.folder_path).resolve()
-    abs_image_path = (MEDIA_ROOT / image.file_rel_path).resolve()
-
-    # 尝试生成/获取缩略图
-    thumb_path = ensure_thumb_for_image(abs_image_path, project_dir)
+    return await _serve_rendition(db, request, path, snap_width(w), bool(v))
 
-    # 优先返回缩略图，失败则回退原图
-    target_path: Optional[Path] = None
-    if thumb_path is not None and thumb_path.is_file():
-        target_path = thumb_path
-    elif abs_image_path.is_file():
-        target_path = abs_image_path
 
-    if target_path is None:
-        raise HTTPException(status_code=404, detail="Image file not found on disk")
-
-    return FileResponse(
-        str(target_path),
-        media_type=_guess_mime(target_path),
-    )
+@app.get("/display/{path:path}")
+async def get_display_image(
+    path: str,
+    request: Request,
+    v: Optional[str] = Query(None, description="缩略图版本号（列表接口给出），带上时长期缓存"),
+    db: Session = Depends(get_db),
+):
+    """
+    大图查看用的显示尺寸版本（长边 display_long_edge，默认 2048，见 config.ini [thumbnails]）：
+    与 /thumbs 走同一套流程（格式按 Accept 协商、清单 / 存储 / 按需生成 / 304），只是尺寸固定。
+    地址由列表接口的 display_url 给出；原图仍在 /media 下，可以下载。
+    """
+    return await _serve_rendition(db, request, path, DISPLAY_LONG_EDGE, bool(v))
 
 
 # ========== 工具：项目目录 & 保存图片到项目 ==========
@@ -344,11 +531,14 @@ async def drop_upload_images_to_project(
             "message": "没有成功保存的图片（可能拖入的不是图片，或下载失败）",
         }
 
-    # 不修改封面 / 不立即更新 Image 表，只是纯粹写入磁盘并生成缩略图
+    # 只同步这个项目目录，让新图片立刻出现在 Image 表里（整库同步在跑时会排队，结束后自动处理）
+    sync_result = await run_in_threadpool(request_folder_sync, project.folder_path)
+
     return {
         "ok": True,
         "count": len(saved_rel_paths),
         "files": saved_rel_paths,
+        "sync_status": sync_result.status,
     }
 
 
@@ -431,8 +621,7 @@ def update_project(
 
     updated = crud.update_project(db, project, payload)
 
-    # 计算 cover_url（和列表逻辑保持一致：优先使用 cover_rel_path + /thumbs）
-    cover_url: Optional[str] = None
+    # 预先生成封面缩略图（cover_url 和列表逻辑保持一致，见 crud.cover_image_fields）
     if getattr(updated, "cover_rel_path", None):
         project_dir = (MEDIA_ROOT / updated.folder_path).resolve()
         abs_image_path = (MEDIA_ROOT / updated.cover_rel_path).resolve()
@@ -441,7 +630,6 @@ def update_project(
         except Exception:
             # 失败不影响 API 返回
             pass
-        cover_url = f"/thumbs/{updated.cover_rel_path}"
 
     # 复制用 UNC 路径
     fs_path = crud._build_fs_path(updated.folder_path)
@@ -456,7 +644,6 @@ def update_project(
         id=updated.id,
         name=updated.name,
         folder_path=updated.folder_path,
-        cover_url=cover_url,
         architect=updated.architect,
         description=updated.description,
         location=updated.location,
@@ -465,6 +652,7 @@ def update_project(
         display_order=updated.display_order,
         tags=tags,
         fs_path=fs_path,
+        **crud.cover_image_fields(db, updated),
     )
 
 
@@ -504,10 +692,6 @@ def set_project_cover_api(
     if project is None:
         raise HTTPException(status_code=404, detail="Project or image not found")
 
-    cover_url: Optional[str] = None
-    if getattr(project, "cover_rel_path", None):
-        cover_url = f"/thumbs/{project.cover_rel_path}"
-
     fs_path = crud._build_fs_path(project.folder_path)
 
     try:
@@ -519,7 +703,6 @@ def set_project_cover_api(
         id=project.id,
         name=project.name,
         folder_path=project.folder_path,
-        cover_url=cover_url,
         architect=project.architect,
         description=project.description,
         location=project.location,
@@ -528,6 +711,7 @@ def set_project_cover_api(
         display_order=project.display_order,
         tags=tags,
         fs_path=fs_path,
+        **crud.cover_image_fields(db, project),
     )
 
 
@@ -575,10 +759,6 @@ def merge_projects_api(
     merged_target, removed_ids = crud.merge_projects(db, target, sources)
 
     # 组装 ProjectOut（和其它接口保持一致）
-    cover_url: Optional[str] = None
-    if getattr(merged_target, "cover_rel_path", None):
-        cover_url = f"/thumbs/{merged_target.cover_rel_path}"
-
     fs_path = crud._build_fs_path(merged_target.folder_path)
 
     try:
@@ -590,7 +770,6 @@ def merge_projects_api(
         id=merged_target.id,
         name=merged_target.name,
         folder_path=merged_target.folder_path,
-        cover_url=cover_url,
         architect=merged_target.architect,
         description=merged_target.description,
         location=merged_target.location,
@@ -599,6 +778,7 @@ def merge_projects_api(
         display_order=merged_target.display_order,
         tags=tags,
         fs_path=fs_path,
+        **crud.cover_image_fields(db, merged_target),
     )
 
     return ProjectMergeResponse(target=target_out, removed_ids=removed_ids)
@@ -640,22 +820,8 @@ def list_images(
     return images
 
 
-# ========== API：手动刷新案例库（管理员按钮调用） ==========
-@app.post("/api/admin/resync")
-def admin_resync(
-    db: Session = Depends(get_db),
-):
-    """
-    手动触发一次 sync_from_fs。
-    建议前端“刷新案例库”按钮调用这个接口。
-    """
-    sync_from_fs(db)
-    return {"status": "ok"}
-
-
 # ========== 本地开发启动 ==========
 if __name__ == "__main__":
-    import os
     import uvicorn
 
     uvicorn.run(
@@ -0,0 +1,233 @@
+"""
+扫盘性能对比脚本：旧版 iter_project_dirs + 逐项目 iter_image_files  vs  单次遍历 scan_projects
+（单线程 / 多线程探测目录）。
+
+在 backend 目录下运行：
+
+    python bench_scan.py
+    python bench_scan.py --categories 20 --projects 50 --images 30 --latency-ms 0.5
+    python bench_scan.py --latency-ms 2 --workers 1 4 8 16 --skip-legacy
+
+- 在临时目录里生成一棵合成的案例库目录树（图片是空文件，扫盘只看文件名）；
+- 统计各实现的文件系统调用次数（scandir / stat / lstat 等）和耗时；
+- --latency-ms 给每次文件系统调用额外加一点延迟，用来模拟 SMB 共享盘的往返时间；
+- --workers 列出要对比的扫描线程数；
+- 最后校验各实现得到的项目 / 图片结果完全一致。
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable
+
+from indexer import IMAGE_EXTS, THUMB_DIR_NAME, collect_dir_info, scan_projects
+
+# 需要计数的文件系统调用（pathlib / os.walk / os.path.realpath 最终都走这些）
+_COUNTED_FS_CALLS = ("scandir", "stat", "lstat", "listdir", "readlink")
+
+
+# ========== 旧版实现（仅用于对比，逻辑与改造前的 indexer 保持一致） ==========
+
+def legacy_iter_image_files(project_dir: Path, project_roots: Iterable[Path]) -> Iterable[Path]:
+    project_dir = project_dir.resolve()
+    project_roots_set = {p.resolve() for p in project_roots}
+
+    subproject_roots = {
+        p for p in project_roots_set
+        if p != project_dir and project_dir in p.parents
+    }
+
+    for dirpath, dirnames, filenames in os.walk(project_dir):
+        current = Path(dirpath)
+
+        if current in subproject_roots:
+            dirnames[:] = []
+            continue
+
+        dirnames[:] = [d for d in dirnames if d != THUMB_DIR_NAME]
+
+        for name in filenames:
+            ext = Path(name).suffix.lower()
+            if ext in IMAGE_EXTS:
+                yield Path(dirpath) / name
+
+
+def legacy_iter_project_dirs(root: Path) -> Iterable[Path]:
+    root = root.resolve()
+
+    dir_info: dict[Path, dict] = {}
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        path = Path(dirpath)
+        dirnames[:] = [d for d in dirnames if d != THUMB_DIR_NAME]
+
+        dir_info[path] = {
+            "has_project_json": (path / "project.json").is_file(),
+            "has_image_here": any(
+                Path(name).suffix.lower() in IMAGE_EXTS for name in filenames
+            ),
+            "children": [path / d for d in dirnames],
+        }
+
+    if not dir_info:
+        return
+
+    def depth(p: Path) -> int:
+        try:
+            return len(p.relative_to(root).parts)
+        except ValueError:
+            return 0
+
+    sorted_paths = sorted(dir_info.keys(), key=depth, reverse=True)
+
+    is_project: dict[Path, bool] = {}
+    has_project_subtree: dict[Path, bool] = {}
+
+    for path in sorted_paths:
+        info = dir_info[path]
+        has_project_below = any(
+            has_project_subtree.get(child, False) for child in info["children"]
+        )
+        if info["has_project_json"]:
+            is_project[path] = True
+        elif info["has_image_here"] and not has_project_below:
+            is_project[path] = True
+        else:
+            is_project[path] = False
+        has_project_subtree[path] = is_project[path] or has_project_below
+
+    for path in sorted(sorted_paths):
+        if is_project.get(path):
+            yield path
+
+
+def legacy_scan(root: Path) -> list[tuple[Path, list[Path]]]:
+    project_dirs = list(legacy_iter_project_dirs(root))
+    result = []
+    for project_dir in project_dirs:
+        if not project_dir.is_dir():
+            continue
+        result.append((project_dir, list(legacy_iter_image_files(project_dir, project_dirs))))
+    return result
+
+
+# ========== 合成目录树 ==========
+
+def build_tree(root: Path, categories: int, projects: int, images: int) -> None:
+    """
+    每个分类下 projects 个项目，每个项目：
+    - 根目录 images 张图片 + 一个 `_thumbs` 目录；
+    - 一个“图纸”子目录放几张图；
+    - 每 5 个项目带一个 project.json，并嵌套一个带 project.json 的子项目。
+    """
+    for c in range(categories):
+        for p in range(projects):
+            project_dir = root / f"分类{c:02d}" / f"项目{p:03d}"
+            (project_dir / THUMB_DIR_NAME).mkdir(parents=True)
+            (project_dir / "图纸").mkdir()
+
+            for i in range(images):
+                (project_dir / f"{i:03d}.jpg").touch()
+                (project_dir / THUMB_DIR_NAME / f"{i:03d}.jpg").touch()
+            for i in range(3):
+                (project_dir / "图纸" / f"plan{i}.png").touch()
+            (project_dir / "说明.txt").touch()
+
+            if p % 5 == 0:
+                (project_dir / "project.json").write_text(
+                    json.dumps({"meta": {"name": f"项目{p}"}}, ensure_ascii=False),
+                    encoding="utf-8",
+                )
+                sub = project_dir / "分期二"
+                sub.mkdir()
+                (sub / "project.json").write_text("{}", encoding="utf-8")
+                for i in range(max(1, images // 3)):
+                    (sub / f"{i:03d}.jpg").touch()
+
+
+# ========== 计数 / 计时 ==========
+
+@contextmanager
+def count_fs_calls(latency_s: float):
+    counter: Counter = Counter()
+    lock = threading.Lock()
+    originals = {name: getattr(os, name) for name in _COUNTED_FS_CALLS}
+
+    def wrap(name, fn):
+        def wrapper(*args, **kwargs):
+            with lock:
+                counter[name] += 1
+            if latency_s:
+                time.sleep(latency_s)
+            return fn(*args, **kwargs)
+        return wrapper
+
+    for name, fn in originals.items():
+        setattr(os, name, wrap(name, fn))
+    try:
+        yield counter
+    finally:
+        for name, fn in originals.items():
+            setattr(os, name, fn)
+
+
+def run(label: str, fn, root: Path, latency_s: float):
+    with count_fs_calls(latency_s) as counter:
+        t0 = time.perf_counter()
+        result = fn(root)
+        elapsed = time.perf_counter() - t0
+
+    total = sum(counter.values())
+    detail = ", ".join(f"{k}={v}" for k, v in sorted(counter.items()))
+    print(f"{label:<18} {elapsed * 1000:10.1f} ms   fs 调用 {total:8d}   ({detail})")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CaseLib 扫盘性能对比")
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--projects", type=int, default=40, help="每个分类下的项目数")
+    parser.add_argument("--images", type=int, default=20, help="每个项目根目录下的图片数")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="给每次文件系统调用附加的模拟延迟（毫秒）")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8],
+                        help="scan_projects 使用的扫描线程数（可给多个依次对比）")
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="不跑旧版实现（延迟较大时旧版会非常慢）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="caselib_bench_") as tmp:
+        root = Path(tmp).resolve()
+        build_tree(root, args.categories, args.projects, args.images)
+
+        n_projects = args.categories * args.projects
+        print(
+            f"合成目录树：{args.categories} 个分类 × {args.projects} 个项目"
+            f"（共 {n_projects} 个顶层项目），模拟延迟 {args.latency_ms} ms/调用"
+        )
+
+        latency_s = args.latency_ms / 1000.0
+        results = []
+        if not args.skip_legacy:
+            results.append(run("旧版(两遍)", legacy_scan, root, latency_s))
+
+        for workers in args.workers:
+            def scan(r: Path, workers: int = workers):
+                return scan_projects(r, collect_dir_info(r, workers=workers))
+            results.append(run(f"scan_projects x{workers}", scan, root, latency_s))
+
+        baseline = results[0]
+        for other in results[1:]:
+            assert other == baseline, "各实现的扫描结果不一致"
+        n_images = sum(len(imgs) for _, imgs in baseline)
+        print(f"结果一致：{len(baseline)} 个项目，{n_images} 张图片")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+同步内存基准：流式 sync_from_fs 的峰值内存 vs 库的大小。
+
+在 backend 目录下运行：
+
+    python bench_sync.py
+    python bench_sync.py --categories 4 16 64 --projects 50 --images 40
+    python bench_sync.py --skip-legacy
+
+- 在临时目录里生成几棵规模递增的合成目录树（单个项目大小固定，只增加项目数），
+  每棵树用一个临时 SQLite 库，依次跑：首次同步（全部插入）、无变化的增量同步；
+- 用 tracemalloc 记录每次同步期间 Python 分配的峰值内存；
+- 对照组“整库载入”：整棵目录树的 dir_info + 全部 Project / Image ORM 对象
+  （改造前 sync_from_fs 的内存模型），同样记录峰值；
+- 流式同步的峰值应基本不随项目数增长（取决于最大的单个项目和写库批大小），
+  对照组则与库的大小成正比。
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import indexer
+import models
+from bench_scan import build_tree
+
+
+def measure(fn):
+    """执行 fn，返回 (结果, 耗时秒, tracemalloc 峰值字节)。"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def legacy_load(db, root: Path) -> int:
+    """对照组：整棵树的 dir_info + 全部 ORM 对象同时驻留内存（不写库）。"""
+    dir_info = indexer.collect_dir_info(root)
+    scanned = indexer.scan_projects(root, dir_info)
+    projects = {p.folder_path: p for p in db.query(models.Project).all()}
+    images = {i.file_rel_path: i for i in db.query(models.Image).all()}
+    n = len(dir_info) + len(scanned) + len(projects) + len(images)
+    db.expunge_all()
+    return n
+
+
+def run_size(tmp: Path, categories: int, projects: int, images: int, skip_legacy: bool) -> None:
+    root = tmp / f"lib_{categories}"
+    root.mkdir()
+    build_tree(root, categories, projects, images)
+    root = root.resolve()
+
+    # 让 indexer 以这棵临时树为案例库根目录
+    indexer.MEDIA_ROOT = indexer.PROJECTS_ROOT = root
+
+    engine = create_engine(f"sqlite:///{tmp / f'bench_{categories}.sqlite'}")
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    n_projects = categories * projects
+    rows = []
+
+    with Session() as db:
+        _, elapsed, peak = measure(lambda: indexer.sync_from_fs(db))
+        n_images = db.query(models.Image).count()
+        rows.append(("首次同步", elapsed, peak))
+
+    with Session() as db:
+        _, elapsed, peak = measure(lambda: indexer.sync_from_fs(db))
+        rows.append(("增量(无变化)", elapsed, peak))
+
+    if not skip_legacy:
+        with Session() as db:
+            _, elapsed, peak = measure(lambda: legacy_load(db, root))
+            rows.append(("对照:整库载入", elapsed, peak))
+
+    engine.dispose()
+
+    print(f"\n{n_projects} 个顶层项目，{n_images} 张图片")
+    for label, elapsed, peak in rows:
+        print(f"  {label:<14} {elapsed * 1000:9.0f} ms   峰值 {peak / 1024 / 1024:8.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CaseLib 同步内存基准")
+    parser.add_argument("--categories", type=int, nargs="+", default=[2, 8, 32],
+                        help="分类数（可给多个，依次增大库的规模）")
+    parser.add_argument("--projects", type=int, default=25, help="每个分类下的项目数")
+    parser.add_argument("--images", type=int, default=40, help="每个项目根目录下的图片数")
+    parser.add_argument("--skip-legacy", action="store_true", help="不跑“整库载入”对照组")
+    args = parser.parse_args()
+
+    # 合成目录树里的图片都是空文件，读不出尺寸，不要让每张图的警告刷屏（也会拖慢计时）
+    logging.getLogger("indexer").setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory(prefix="caselib_bench_sync_") as tmp:
+        for categories in args.categories:
+            run_size(Path(tmp), categories, args.projects, args.images, args.skip_legacy)
+
+
+if __name__ == "__main__":
+    main()
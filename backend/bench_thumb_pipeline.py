@@ -0,0 +1,482 @@
+"""
+缩略图流水线基准：升级 Pillow / 改缩略图设置之后，用它比较前后的生成速度和内存。
+
+在 backend 目录下运行：
+
+    python bench_thumb_pipeline.py
+    python bench_thumb_pipeline.py --megapixels 8 24 --count 3 --workers 4
+    python bench_thumb_pipeline.py --skip-e2e --json before.json
+    python bench_thumb_pipeline.py --huge 20000x10000 --megapixels --skip-e2e
+
+- 在临时目录里用固定的随机种子生成一组合成“照片”（JPEG / PNG / TIFF / WebP，每种格式每档像素数 count 张），
+  同样的参数每次生成同样的图片，不联网；
+- 单线程：一个子进程里逐张跑后台预生成的完整流程（thumb_worker.pregenerate_thumbnail：
+  按配置的档位 / 格式生成全部版本 + 加载占位，只编码不写盘）；
+- 进程池：同样的流程交给 workers 个进程并行（和后台预生成一样用 spawn），进程先预热，启动时间不计入；
+- 两者都报告吞吐（张/秒）、各格式每张耗时的 p50 / p90 / p99，以及进程的内存峰值
+  （ru_maxrss，含解释器和导入的模块；进程池取各进程中最大的）；
+- 端到端：子进程里把临时目录当作案例库（临时 SQLite 库 + 临时缩略图存储，不碰 config.ini 里的库），
+  同步一遍后通过 ASGI 在进程内请求 /thumbs：冷（缩略图还不存在，按需生成）、
+  热（命中内存路径缓存）、热（清空路径缓存，查缩略图清单），各格式分别统计延迟；
+- --huge WxH：另外生成一张这么大的灰度 PNG（超过 Pillow 默认约 1.79 亿像素的“解压炸弹”限制），
+  在子进程里检查读尺寸、生成缩略图、生成 Deep Zoom 最高层和中间一层分块都能成功，报告耗时和内存峰值；
+  任何一步失败时以退出码 1 结束（可以当作大图回归检查）；
+- Windows 上没有 resource 模块，内存一栏显示为 "-"。
+
+子进程要在导入任何后端模块之前改好案例库路径和数据库，所以本文件不在模块顶层导入后端模块。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image as PILImage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# 合成图片的格式：(扩展名, Pillow 格式名, 保存参数)；扩展名要在 indexer.IMAGE_EXTS 里
+_FORMATS = {
+    "JPEG": (".jpg", "JPEG", {"quality": 90}),
+    "PNG": (".png", "PNG", {}),
+    "TIFF": (".tif", "TIFF", {"compression": "tiff_lzw"}),
+    "WebP": (".webp", "WEBP", {"quality": 90}),
+}
+_FORMAT_BY_SUFFIX = {suffix: name for name, (suffix, _, _) in _FORMATS.items()}
+
+# 合成图片放在临时案例库的这个项目目录里（--huge 的大图单独放一个项目）
+_PROJECT_NAME = "bench"
+_HUGE_PROJECT_NAME = "bench_huge"
+
+
+# ========== 合成图片 ==========
+
+def _synthetic_photo(size: tuple[int, int], rng: random.Random):
+    """低频随机色块放大到目标尺寸：比纯色更接近照片的压缩率和解码量。"""
+    w, h = size
+    small = (max(1, w // 64), max(1, h // 64))
+    noise = PILImage.frombytes("RGB", small, rng.randbytes(small[0] * small[1] * 3))
+    return noise.resize(size, PILImage.Resampling.BICUBIC)
+
+
+def build_fixtures(project_dir: Path, megapixels: list[float], count: int, seed: int) -> list[Path]:
+    rng = random.Random(seed)
+    (project_dir / "project.json").write_text(
+        json.dumps({"meta": {"name": "缩略图基准"}}, ensure_ascii=False), encoding="utf-8"
+    )
+    paths = []
+    for mp in megapixels:
+        w = int((mp * 1_000_000 * 3 / 2) ** 0.5)
+        size = (w, w * 2 // 3)
+        for name, (suffix, fmt, options) in _FORMATS.items():
+            for i in range(count):
+                p = project_dir / f"{name.lower()}_{mp:g}mp_{i}{suffix}"
+                _synthetic_photo(size, rng).save(p, fmt, **options)
+                paths.append(p)
+    return paths
+
+
+def build_huge_fixture(project_dir: Path, size: tuple[int, int]) -> Path:
+    """一张 size 大小的灰度渐变 PNG（灰度省内存，生成也快；解码量仍按像素数走）。"""
+    project_dir.mkdir(parents=True, exist_ok=True)
+    path = project_dir / f"huge_{size[0]}x{size[1]}.png"
+    PILImage.linear_gradient("L").resize(size).save(path, "PNG", compress_level=1)
+    return path
+
+
+# ========== 计时 / 内存 ==========
+
+def _maxrss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KiB，macOS 上是字节
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _percentiles(values: list[float]) -> tuple[float, float, float]:
+    """(p50, p90, p99)；只有一个值时三者相同。"""
+    if len(values) < 2:
+        return (values[0],) * 3 if values else (0.0, 0.0, 0.0)
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return q[49], q[89], q[98]
+
+
+def _by_format(samples: list[tuple[str, float]]) -> dict[str, dict]:
+    """[(格式, 秒), ...] -> {格式: {"count", "p50_ms", "p90_ms", "p99_ms"}}，格式按 _FORMATS 的顺序。"""
+    result = {}
+    for name in _FORMATS:
+        values = [s for fmt, s in samples if fmt == name]
+        if values:
+            p50, p90, p99 = _percentiles(values)
+            result[name] = {
+                "count": len(values),
+                "p50_ms": p50 * 1000,
+                "p90_ms": p90 * 1000,
+                "p99_ms": p99 * 1000,
+            }
+    return result
+
+
+def _format_of(path: str) -> str:
+    return _FORMAT_BY_SUFFIX.get(Path(path).suffix.lower(), "?")
+
+
+# ========== 生成：单线程 / 进程池 ==========
+
+def _pregenerate_timed(image_path: str, project_dir: str, widths: list[int], fmt: Optional[str]):
+    """在子进程里跑一张，返回 (格式, 耗时秒, 是否成功, 本进程内存峰值)。"""
+    from thumb_worker import pregenerate_thumbnail
+
+    t0 = time.perf_counter()
+    # stored={}：当作 packed 存储，只编码、不写盘，量的是解码 + 缩放 + 编码本身
+    outcome, _, _ = pregenerate_thumbnail(image_path, project_dir, widths, fmt, {})
+    elapsed = time.perf_counter() - t0
+    return _format_of(image_path), elapsed, outcome != "failed", _maxrss_bytes()
+
+
+def _warm_up(_: object = None) -> Optional[int]:
+    """预热：导入后端模块（以及 Pillow 的各格式插件），不计入耗时。"""
+    import thumb_worker  # noqa: F401
+
+    return _maxrss_bytes()
+
+
+def _summary(samples, failed: int, wall: float, rss: Optional[int]) -> dict:
+    return {
+        "images": len(samples),
+        "failed": failed,
+        "images_per_second": len(samples) / wall if wall else 0.0,
+        "peak_rss_bytes": rss,
+        "formats": _by_format(samples),
+    }
+
+
+def _run_single(fixtures: list[str], project_dir: str, widths, fmt, repeat: int, queue) -> None:
+    """子进程入口：逐张生成 repeat 遍。"""
+    _warm_up()
+    samples, failed = [], 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for path in fixtures:
+            name, elapsed, ok, _ = _pregenerate_timed(path, project_dir, widths, fmt)
+            samples.append((name, elapsed))
+            failed += not ok
+    wall = time.perf_counter() - t0
+    queue.put(_summary(samples, failed, wall, _maxrss_bytes()))
+
+
+def run_single(fixtures: list[Path], project_dir: Path, widths, fmt, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(
+        target=_run_single,
+        args=([str(p) for p in fixtures], str(project_dir), widths, fmt, repeat, queue),
+    )
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def run_pool(fixtures: list[Path], project_dir: Path, widths, fmt, repeat: int, workers: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # 每个进程都先导入一遍（提交数量多于进程数，保证都被拉起来）
+        list(pool.map(_warm_up, range(workers * 2)))
+        t0 = time.perf_counter()
+        futures = [
+            pool.submit(_pregenerate_timed, str(p), str(project_dir), widths, fmt)
+            for _ in range(repeat)
+            for p in fixtures
+        ]
+        results = [f.result() for f in futures]
+        wall = time.perf_counter() - t0
+
+    samples = [(name, elapsed) for name, elapsed, _, _ in results]
+    failed = sum(not ok for _, _, ok, _ in results)
+    peaks = [rss for _, _, _, rss in results if rss is not None]
+    return _summary(samples, failed, wall, max(peaks) if peaks else None)
+
+
+# ========== 端到端：/thumbs ==========
+
+def _run_e2e(media_root: str, db_path: str, store_name: str, width: Optional[int],
+             concurrency: int, queue) -> None:
+    """子进程入口：临时案例库 + 临时数据库，通过 ASGI 请求 /thumbs。"""
+    # 先改案例库路径和数据库，再导入其他后端模块（它们在导入时读取这些设置）
+    import config
+
+    config.MEDIA_ROOT = config.PROJECTS_ROOT = Path(media_root).resolve()
+
+    from sqlalchemy import create_engine
+
+    import database
+
+    database.engine = create_engine(
+        f"sqlite:///{db_path}", connect_args={"check_same_thread": False}
+    )
+    database.SessionLocal.configure(bind=database.engine)
+
+    import httpx
+
+    import app
+    import indexer
+    import models
+    from thumb_path_cache import thumb_paths
+    from thumb_store import FolderThumbStore, PackedThumbStore, set_thumb_store
+
+    if store_name == "packed":
+        set_thumb_store(PackedThumbStore(
+            Path(db_path).parent / "packs", config.THUMB_STORE_MAX_BYTES, config.THUMB_STORE_PACK_BYTES
+        ))
+    else:
+        set_thumb_store(FolderThumbStore())
+
+    with database.SessionLocal() as db:
+        indexer.sync_from_fs(db)
+        rels = [rel for (rel,) in db.query(models.Image.file_rel_path).order_by(models.Image.id)]
+
+    params = {"w": width} if width else {}
+    # 和浏览器一样声明支持 WebP / AVIF，按配置协商格式
+    headers = {"accept": "image/avif,image/webp,image/*,*/*;q=0.8"}
+
+    async def run_phase(client, semaphore):
+        samples, failed = [], 0
+
+        async def one(rel):
+            nonlocal failed
+            async with semaphore:
+                t0 = time.perf_counter()
+                r = await client.get(f"/thumbs/{rel}", params=params, headers=headers)
+                samples.append((_format_of(rel), time.perf_counter() - t0))
+                failed += r.status_code != 200
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(rel) for rel in rels))
+        return _summary(samples, failed, time.perf_counter() - t0, None)
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            phases = {"冷（按需生成）": await run_phase(client, semaphore)}
+            phases["热（内存路径缓存）"] = await run_phase(client, semaphore)
+            thumb_paths.clear()
+            phases["热（查缩略图清单）"] = await run_phase(client, semaphore)
+        return phases
+
+    phases = asyncio.run(main())
+    app.stop_thumb_pregeneration()
+    queue.put(phases)
+
+
+def run_e2e(media_root: Path, db_path: Path, store_name: str, width: Optional[int], concurrency: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(
+        target=_run_e2e, args=(str(media_root), str(db_path), store_name, width, concurrency, queue)
+    )
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+# ========== 超大图 ==========
+
+def _run_huge(image_path: str, project_dir: str, widths, fmt, queue) -> None:
+    """子进程入口：读尺寸 → 生成缩略图 → 生成 Deep Zoom 最高层和中间一层（非 JPEG 每次生成整个金字塔）。"""
+    import indexer
+    import thumb_tiles
+    from thumb_store import FolderThumbStore, set_thumb_store
+
+    # 分块写进临时目录下项目的 _thumbs，不碰 config.ini 里的存储
+    set_thumb_store(FolderThumbStore())
+    result: dict = {"size": None, "thumbnails_ok": False, "thumbnail_seconds": None, "levels": []}
+
+    size = indexer.read_image_size(Path(image_path))
+    result["size"] = size
+    if size is not None:
+        _, elapsed, ok, _ = _pregenerate_timed(image_path, project_dir, widths, fmt)
+        result["thumbnails_ok"], result["thumbnail_seconds"] = ok, elapsed
+
+        top_w, top_h = thumb_tiles.pyramid_size(*size)
+        result["pyramid"] = (top_w, top_h)
+        source = thumb_tiles.TileSource(
+            Path(image_path),
+            indexer.thumb_path_for_image(Path(image_path), Path(project_dir)),
+            top_w,
+            top_h,
+            None,
+        )
+        top = thumb_tiles.max_level(top_w, top_h)
+        for level in (top, max(0, top - 3)):
+            t0 = time.perf_counter()
+            ok = thumb_tiles.render_level(source, level)
+            result["levels"].append({
+                "level": level,
+                "size": thumb_tiles.level_size(top_w, top_h, level),
+                "seconds": time.perf_counter() - t0,
+                "ok": ok,
+            })
+
+    result["peak_rss_bytes"] = _maxrss_bytes()
+    queue.put(result)
+
+
+def run_huge(image_path: Path, project_dir: Path, widths, fmt) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_huge, args=(str(image_path), str(project_dir), widths, fmt, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    result["passed"] = bool(
+        result["size"] and result["thumbnails_ok"] and all(level["ok"] for level in result["levels"])
+    )
+    return result
+
+
+def _parse_size(text: str) -> tuple[int, int]:
+    w, _, h = text.lower().partition("x")
+    try:
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"尺寸格式应为 宽x高，例如 20000x10000: {text}")
+
+
+# ========== 输出 ==========
+
+def _print_huge(result: dict) -> None:
+    rss = result["peak_rss_bytes"]
+    rss_text = "" if rss is None else f"   内存峰值 {rss / 1024 / 1024:.1f} MiB"
+    print(f"\n超大图: {'通过' if result['passed'] else '失败'}{rss_text}")
+    print(f"  读尺寸: {result['size']}")
+    if result["thumbnail_seconds"] is not None:
+        print(f"  缩略图: {'成功' if result['thumbnails_ok'] else '失败'}   {result['thumbnail_seconds'] * 1000:.0f} ms")
+    if result.get("pyramid"):
+        print(f"  金字塔最高层: {result['pyramid'][0]}x{result['pyramid'][1]}")
+    for level in result["levels"]:
+        w, h = level["size"]
+        print(f"  第 {level['level']} 层 {w}x{h}: {'成功' if level['ok'] else '失败'}   {level['seconds'] * 1000:.0f} ms")
+
+
+def _print_result(title: str, result: dict) -> None:
+    rss = result["peak_rss_bytes"]
+    rss_text = "" if rss is None else f"   内存峰值 {rss / 1024 / 1024:.1f} MiB"
+    failed = f"   失败 {result['failed']}" if result["failed"] else ""
+    print(f"\n{title}: {result['images']} 张   {result['images_per_second']:.2f} 张/秒{rss_text}{failed}")
+    print(f"  {'格式':<6} {'张数':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}")
+    for name, row in result["formats"].items():
+        print(f"  {name:<6} {row['count']:>6} {row['p50_ms']:>10.1f} {row['p90_ms']:>10.1f} {row['p99_ms']:>10.1f}")
+
+
+def _settings() -> dict:
+    """这次运行的缩略图设置（写进结果，方便对比前后两次）。"""
+    import PIL
+
+    import config
+    from thumb_renditions import pregenerate_plan
+
+    widths, fmt = pregenerate_plan()
+    return {
+        "pillow": PIL.__version__,
+        "python": sys.version.split()[0],
+        "resample": config.THUMB_RESAMPLE,
+        "reducing_gap": config.THUMB_REDUCING_GAP,
+        "jpeg_quality": config.THUMB_JPEG_QUALITY,
+        "webp_quality": config.THUMB_WEBP_QUALITY,
+        "widths": widths,
+        "format": fmt,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CaseLib 缩略图流水线基准")
+    parser.add_argument("--megapixels", type=float, nargs="*", default=[8, 24],
+                        help="合成图片的像素数（百万，可给多个；不给值时跳过常规基准，只跑 --huge）")
+    parser.add_argument("--count", type=int, default=2, help="每种格式每档像素数生成几张")
+    parser.add_argument("--seed", type=int, default=20240601, help="合成图片的随机种子")
+    parser.add_argument("--repeat", type=int, default=2, help="单线程 / 进程池把整组图片跑几遍")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="进程池的进程数（默认取 config.ini 的 pregenerate_workers）")
+    parser.add_argument("--store", choices=["folder", "packed"], default="folder",
+                        help="端到端测试用的缩略图存储（都放在临时目录里）")
+    parser.add_argument("--width", type=int, default=None,
+                        help="端到端请求 /thumbs?w=（默认请求默认档位的缩略图）")
+    parser.add_argument("--concurrency", type=int, default=1, help="端到端同时发出的请求数")
+    parser.add_argument("--skip-e2e", action="store_true", help="不跑端到端 /thumbs 测试")
+    parser.add_argument("--huge", type=_parse_size, default=None, metavar="WxH",
+                        help="另外检查一张这么大的 PNG（例如 20000x10000，超过 Pillow 默认的像素数限制）")
+    parser.add_argument("--json", type=Path, default=None, help="把结果另存为 JSON（对比前后两次运行）")
+    args = parser.parse_args()
+
+    import config
+
+    settings = _settings()
+    widths, fmt = settings["widths"], settings["format"]
+    workers = args.workers or max(1, config.THUMB_PREGENERATE_WORKERS)
+    report = {"settings": settings, "args": {k: str(v) for k, v in vars(args).items()}}
+
+    print(f"Pillow {settings['pillow']}，滤镜 {settings['resample']}，reducing_gap {settings['reducing_gap']:g}，"
+          f"JPEG 质量 {settings['jpeg_quality']}，WebP 质量 {settings['webp_quality']}")
+    print(f"预生成：默认缩略图 + 档位 {widths}（{fmt or 'JPEG'}）")
+
+    with tempfile.TemporaryDirectory(prefix="caselib_bench_pipeline_") as tmp:
+        tmp = Path(tmp)
+        media_root = tmp / "media"
+        project_dir = media_root / _PROJECT_NAME
+        project_dir.mkdir(parents=True)
+
+        if args.huge is not None:
+            print(f"生成 {args.huge[0]}x{args.huge[1]} 的大图 ...")
+            huge_dir = media_root / _HUGE_PROJECT_NAME
+            huge = build_huge_fixture(huge_dir, args.huge)
+            report["huge"] = run_huge(huge, huge_dir, widths, fmt)
+            _print_huge(report["huge"])
+
+        if args.megapixels:
+            print("\n生成合成图片 ...")
+            fixtures = build_fixtures(project_dir, args.megapixels, args.count, args.seed)
+            total_mb = sum(p.stat().st_size for p in fixtures) / 1024 / 1024
+            print(f"{len(fixtures)} 张（{' / '.join(_FORMATS)} × {args.megapixels} 百万像素 × {args.count}），"
+                  f"共 {total_mb:.0f} MB")
+
+            report["single"] = run_single(fixtures, project_dir, widths, fmt, args.repeat)
+            _print_result(f"单线程 × {args.repeat} 遍", report["single"])
+
+            report["pool"] = run_pool(fixtures, project_dir, widths, fmt, args.repeat, workers)
+            _print_result(f"进程池（{workers} 个进程）× {args.repeat} 遍", report["pool"])
+
+        if not args.skip_e2e:
+            e2e_dir = tmp / "e2e"
+            e2e_dir.mkdir()
+            report["e2e"] = run_e2e(
+                media_root, e2e_dir / "bench.sqlite", args.store, args.width, args.concurrency
+            )
+            for phase, result in report["e2e"].items():
+                _print_result(f"/thumbs {phase}（{args.store} 存储，并发 {args.concurrency}）", result)
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n结果已写入 {args.json}")
+
+    if "huge" in report and not report["huge"]["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
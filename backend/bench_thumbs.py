@@ -0,0 +1,175 @@
+"""
+缩略图生成基准：按缩小比例解码（indexer._render_thumbnails）vs 改造前的整图解码。
+
+在 backend 目录下运行：
+
+    python bench_thumbs.py
+    python bench_thumbs.py --megapixels 12 24 40 --count 4
+    python bench_thumbs.py --widths 400 800 --repeat 3
+
+- 在临时目录里生成一组合成的“照片”（JPEG，外加一张 PNG 和一张带 EXIF 旋转的 JPEG）；
+- 两种实现各在一个独立的子进程里跑，统计每张耗时、吞吐（张/秒）和子进程内存峰值的增量
+  （ru_maxrss；Pillow 的像素缓冲区不经过 Python 分配器，tracemalloc 看不到）；
+- 对照组“整图解码”：转 RGB → 依次 thumbnail()（改造前 _render_thumbnails 的逻辑）。
+  注意 Pillow 的 thumbnail() 本身对 RGB 的 JPEG 也会用 draft，但要留 2 倍余量（多解码 4 倍像素），
+  CMYK / PNG 等还会先整图转换一遍；
+- Windows 上没有 resource 模块，内存一栏显示为 "-"。
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image as PILImage
+
+import indexer
+from thumb_store import FolderThumbStore, set_thumb_store
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# ========== 旧版实现（仅用于对比，逻辑与改造前的 indexer 保持一致） ==========
+
+def legacy_render_thumbnails(src: Path, targets: list[tuple[int, Path, Optional[str]]]) -> list[Path]:
+    written = []
+    with PILImage.open(src) as im:
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        for long_edge, dst, fmt in sorted(targets, key=lambda t: t[0], reverse=True):
+            im.thumbnail((long_edge, long_edge))
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if fmt is None:
+                im.save(dst)
+            else:
+                im.save(dst, format=fmt, quality=85)
+            written.append(dst)
+    return written
+
+
+_IMPLS = {
+    "对照:整图解码": legacy_render_thumbnails,
+    "缩小解码": indexer._render_thumbnails,
+}
+
+
+# ========== 合成图片 ==========
+
+def _synthetic_photo(size: tuple[int, int], mode: str = "RGB"):
+    """低频随机色块放大到目标尺寸：比纯色更接近照片的压缩率和解码量。"""
+    w, h = size
+    small = (max(1, w // 64), max(1, h // 64))
+    noise = PILImage.frombytes("RGB", small, os.urandom(small[0] * small[1] * 3))
+    im = noise.resize(size, PILImage.Resampling.BICUBIC)
+    return im.convert(mode) if mode != "RGB" else im
+
+
+def build_fixtures(root: Path, megapixels: list[float], count: int) -> list[Path]:
+    paths = []
+    for mp in megapixels:
+        w = int((mp * 1_000_000 * 3 / 2) ** 0.5)
+        size = (w, w * 2 // 3)
+        for i in range(count):
+            p = root / f"photo_{mp:g}mp_{i}.jpg"
+            _synthetic_photo(size).save(p, "JPEG", quality=90)
+            paths.append(p)
+
+    # 竖拍照片（EXIF 旋转 90°）、CMYK JPEG 和 PNG 各一张，尺寸取最小的那档
+    w = int((min(megapixels) * 1_000_000 * 3 / 2) ** 0.5)
+    size = (w, w * 2 // 3)
+    exif = PILImage.Exif()
+    exif[0x0112] = 6
+    p = root / "portrait.jpg"
+    _synthetic_photo(size).save(p, "JPEG", quality=90, exif=exif)
+    paths.append(p)
+    p = root / "print_cmyk.jpg"
+    _synthetic_photo(size, "CMYK").save(p, "JPEG", quality=90)
+    paths.append(p)
+    p = root / "render.png"
+    _synthetic_photo(size).save(p, "PNG", compress_level=1)
+    paths.append(p)
+    return paths
+
+
+# ========== 计时 / 内存 ==========
+
+def _maxrss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KiB，macOS 上是字节
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _run_impl(name: str, fixtures: list[Path], out_dir: str, widths: list[int],
+              repeat: int, queue) -> None:
+    """子进程入口：跑完一种实现，把 (每张耗时列表, 内存峰值增量) 放回队列。"""
+    render = _IMPLS[name]
+    out = Path(out_dir)
+    # 不管 config.ini 选的是哪种缩略图存储，都写成临时目录里的文件，和对照组一致
+    set_thumb_store(FolderThumbStore())
+    base_rss = _maxrss_bytes()
+    timings = []
+    for r in range(repeat):
+        for src in fixtures:
+            targets = [(w, out / f"{r}_{w}_{src.name}", None) for w in widths]
+            t0 = time.perf_counter()
+            render(src, targets)
+            timings.append(time.perf_counter() - t0)
+    peak = _maxrss_bytes()
+    queue.put((timings, None if base_rss is None else peak - base_rss))
+
+
+def measure(name: str, fixtures: list[Path], out_dir: Path, widths: list[int], repeat: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(
+        target=_run_impl, args=(name, fixtures, str(out_dir), widths, repeat, queue)
+    )
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CaseLib 缩略图生成基准")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 24, 40],
+                        help="合成 JPEG 的像素数（百万，可给多个）")
+    parser.add_argument("--count", type=int, default=3, help="每档像素数生成几张")
+    parser.add_argument("--widths", type=int, nargs="+", default=[indexer.THUMB_LONG_EDGE],
+                        help="每张原图生成哪些长边的缩略图")
+    parser.add_argument("--repeat", type=int, default=2, help="每种实现把整组图片跑几遍")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="caselib_bench_thumbs_") as tmp:
+        tmp = Path(tmp)
+        fixtures_dir = tmp / "src"
+        fixtures_dir.mkdir()
+        print("生成合成图片 ...")
+        # 在子进程里生成：ru_maxrss 会从父进程继承，父进程不能先把内存峰值撑大
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(1) as pool:
+            fixtures = pool.apply(build_fixtures, (fixtures_dir, args.megapixels, args.count))
+
+        print(f"\n{len(fixtures)} 张原图 × {args.repeat} 遍，缩略图长边 {args.widths}，"
+              f"滤镜 {indexer.THUMB_RESAMPLE}，reducing_gap {indexer.THUMB_REDUCING_GAP:g}")
+        for i, name in enumerate(_IMPLS):
+            out_dir = tmp / f"out_{i}"
+            out_dir.mkdir()
+            timings, rss = measure(name, fixtures, out_dir, args.widths, args.repeat)
+            total = sum(timings)
+            rss_text = "-" if rss is None else f"{rss / 1024 / 1024:.1f} MiB"
+            print(f"  {name:<12} {total / len(timings) * 1000:8.1f} ms/张   "
+                  f"{len(timings) / total:7.2f} 张/秒   内存峰值增量 {rss_text}")
+
+
+if __name__ == "__main__":
+    main()
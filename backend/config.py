@@ -4,6 +4,7 @@
 
 from pathlib import Path
 import configparser
+from typing import Optional
 
 # backend 目录: .../CaseLib/backend
 BACKEND_DIR = Path(__file__).resolve().parent
@@ -82,6 +83,353 @@ else:
     HOT_TAG_LIMIT = DEFAULT_HOT_TAG_LIMIT
     FIXED_HOT_TAGS = DEFAULT_FIXED_HOT_TAGS.copy()
 
+# ========== 索引器配置（从 [indexer] 读取，带默认值） ==========
+
+# 扫盘时并发探测目录（stat / listdir）的线程数。
+# 共享盘上列目录主要耗在网络往返上，多线程能把等待重叠起来；设为 1 即单线程顺序扫描。
+DEFAULT_INDEXER_SCAN_WORKERS = 8
+
+INDEXER_SCAN_WORKERS = max(
+    1,
+    config.getint("indexer", "scan_workers", fallback=DEFAULT_INDEXER_SCAN_WORKERS),
+)
+
+# 同步写库时每块多少行（executemany + 逐块提交，避免长时间占住 SQLite 写锁）。
+# 同时也是 DELETE ... WHERE id IN (...) 每次的 id 个数，不要超过 SQLite 变量上限（旧版本 999）。
+DEFAULT_INDEXER_WRITE_CHUNK_SIZE = 500
+
+INDEXER_WRITE_CHUNK_SIZE = max(
+    1,
+    config.getint("indexer", "write_chunk_size", fallback=DEFAULT_INDEXER_WRITE_CHUNK_SIZE),
+)
+
+# 增量同步时是否逐个 stat 已索引的图片（在扫盘线程池里并发进行）。
+# 原地覆盖同名文件不会改变目录 mtime，目录清单发现不了，只能靠比对文件自己的大小 / mtime；
+# 共享盘上图片极多、每次同步的 stat 开销不可接受时可以设为 false，
+# 这时只检查重新列出过的目录里的图片，原地覆盖要等完整重扫（full=True）才能发现。
+INDEXER_RESTAT_IMAGES = config.getboolean("indexer", "restat_images", fallback=True)
+
+# 服务启动时是否在后台做一次增量同步。
+# 启动同步在后台线程里跑，服务立刻用已有索引对外提供服务；
+# 如果有文件监听 / 定时增量同步保证索引新鲜，可以设为 false 跳过。
+INDEXER_SYNC_ON_STARTUP = config.getboolean("indexer", "sync_on_startup", fallback=True)
+
+# 文件监听（见 fs_watcher）：目录有变化时自动做单目录同步，不用手动刷新。
+# - off    ：关闭（默认）；
+# - auto   ：本地盘用系统通知（inotify 等，需要 watchfiles），共享盘 / 没装 watchfiles 时用轮询；
+# - native ：强制用系统通知；
+# - poll   ：强制轮询（定时 stat 目录 mtime，SMB 共享盘上收不到系统通知时用）。
+DEFAULT_INDEXER_WATCH_MODE = "off"
+DEFAULT_INDEXER_WATCH_DEBOUNCE_SECONDS = 2.0
+DEFAULT_INDEXER_WATCH_POLL_INTERVAL_SECONDS = 30.0
+
+INDEXER_WATCH_MODE = config.get(
+    "indexer", "watch_mode", fallback=DEFAULT_INDEXER_WATCH_MODE
+).strip().lower()
+if INDEXER_WATCH_MODE not in ("off", "auto", "native", "poll"):
+    INDEXER_WATCH_MODE = DEFAULT_INDEXER_WATCH_MODE
+
+# 最后一次变化之后安静多少秒才开始同步（拷贝整个文件夹时合并成一次同步）
+INDEXER_WATCH_DEBOUNCE_SECONDS = max(
+    0.0,
+    config.getfloat(
+        "indexer", "watch_debounce_seconds", fallback=DEFAULT_INDEXER_WATCH_DEBOUNCE_SECONDS
+    ),
+)
+
+# 轮询模式下每隔多少秒检查一遍目录
+INDEXER_WATCH_POLL_INTERVAL_SECONDS = max(
+    1.0,
+    config.getfloat(
+        "indexer",
+        "watch_poll_interval_seconds",
+        fallback=DEFAULT_INDEXER_WATCH_POLL_INTERVAL_SECONDS,
+    ),
+)
+
+# ========== 缩略图预生成（从 [thumbnails] 读取，带默认值） ==========
+
+# 同步发现新图片 / 原图变化后，在后台进程池里预先生成缩略图（见 thumb_worker）。
+# 进程数为 0 表示关闭预生成，只在 /thumbs 请求时按需生成。
+DEFAULT_THUMB_PREGENERATE_WORKERS = 2
+# 每秒最多提交多少张（0 表示不限速）
+DEFAULT_THUMB_MAX_PER_SECOND = 0.0
+# 工作时间段（例如 08:30-19:00，留空表示不区分），这段时间内按 busy_max_per_second 限速，
+# 避免预生成把共享盘带宽占满
+DEFAULT_THUMB_BUSY_HOURS = "08:30-19:00"
+DEFAULT_THUMB_BUSY_MAX_PER_SECOND = 2.0
+# 内存里最多排队多少张（超出后只接收封面，其余留给 /thumbs 按需生成）
+DEFAULT_THUMB_QUEUE_LIMIT = 50000
+
+THUMB_PREGENERATE_WORKERS = max(
+    0,
+    config.getint(
+        "thumbnails", "pregenerate_workers", fallback=DEFAULT_THUMB_PREGENERATE_WORKERS
+    ),
+)
+THUMB_MAX_PER_SECOND = max(
+    0.0,
+    config.getfloat("thumbnails", "max_per_second", fallback=DEFAULT_THUMB_MAX_PER_SECOND),
+)
+THUMB_BUSY_MAX_PER_SECOND = max(
+    0.0,
+    config.getfloat(
+        "thumbnails", "busy_max_per_second", fallback=DEFAULT_THUMB_BUSY_MAX_PER_SECOND
+    ),
+)
+THUMB_QUEUE_LIMIT = max(
+    1,
+    config.getint("thumbnails", "queue_limit", fallback=DEFAULT_THUMB_QUEUE_LIMIT),
+)
+
+# 缩略图尺寸档位（长边像素）：/thumbs/{path}?w= 会取不小于 w 的最小档位，
+# 列表接口按这些档位给出 srcset，浏览器按显示尺寸挑最小够用的一张
+DEFAULT_THUMB_WIDTHS = "200, 400, 800, 1600"
+# 浏览器 Accept 支持时优先使用的编码格式（按顺序），都不支持时用 JPEG；
+# avif 需要 Pillow 带 AVIF 编码器（或安装 pillow-avif-plugin），没有时自动跳过
+DEFAULT_THUMB_FORMATS = "avif, webp"
+# 预生成时生成哪些档位（用第一个可用的新格式），其余档位在请求时按需生成
+DEFAULT_THUMB_PREGENERATE_WIDTHS = "400, 800"
+
+
+def _parse_int_list(raw: str) -> list[int]:
+    """把 "200, 400, 800" 解析成 [200, 400, 800]，忽略无法解析的项。"""
+    values = []
+    for part in raw.split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            values.append(int(part))
+    return sorted(set(values))
+
+
+THUMB_WIDTHS = _parse_int_list(
+    config.get("thumbnails", "widths", fallback=DEFAULT_THUMB_WIDTHS)
+) or _parse_int_list(DEFAULT_THUMB_WIDTHS)
+
+THUMB_FORMATS = [
+    f.strip().lower()
+    for f in config.get("thumbnails", "formats", fallback=DEFAULT_THUMB_FORMATS).split(",")
+    if f.strip().lower() in ("avif", "webp")
+]
+
+THUMB_PREGENERATE_WIDTHS = _parse_int_list(
+    config.get("thumbnails", "pregenerate_widths", fallback=DEFAULT_THUMB_PREGENERATE_WIDTHS)
+)
+
+# 大图查看（lightbox）用的显示尺寸版本：长边像素，/display/{path} 按需生成（格式同样按 Accept 协商），
+# 不再直接加载共享盘上几十 MB 的原图（TIFF 浏览器也解不了）；原图仍可通过 /media 下载。
+# pregenerate_display = true 时后台预生成也一起生成（占用较多存储空间，默认只按需生成）
+DEFAULT_DISPLAY_LONG_EDGE = 2048
+DEFAULT_THUMB_PREGENERATE_DISPLAY = False
+
+DISPLAY_LONG_EDGE = max(
+    1, config.getint("thumbnails", "display_long_edge", fallback=DEFAULT_DISPLAY_LONG_EDGE)
+)
+THUMB_PREGENERATE_DISPLAY = config.getboolean(
+    "thumbnails", "pregenerate_display", fallback=DEFAULT_THUMB_PREGENERATE_DISPLAY
+)
+
+# 超大图（图纸 / 全景）的分块金字塔（Deep Zoom，见 thumb_tiles）：
+# 像素数不小于 deepzoom_min_megapixels 的图片在大图查看里放大后按需加载分块，
+# 分块在第一次请求某一层时整层生成（只解码一次原图）并放进缩略图存储；
+# tile_size 为分块边长，tile_workers 为生成分块的线程数（整层解码很吃内存，默认 1）；
+# deepzoom_max_level_megapixels 限制金字塔最高一层的像素数：原图更大时最高层为原图按 2 的幂缩小，
+# 0 表示最高层就是原图尺寸。JPEG 每一层都按 DCT 缩放解码，不整张解码原图；
+# 其他格式只整张解码一次原图，缩成最高层后由最高层逐层缩小生成整个金字塔，不再碰原图。
+# 每个分块线程最坏占用约：JPEG 为最高层像素数 × 3 字节 × 2（64 百万像素约 400 MB），
+# 其他格式另加整张原图（max_full_decode_megapixels × 4 字节，默认约 1 GB）
+DEFAULT_DEEPZOOM_MIN_MEGAPIXELS = 40.0
+DEFAULT_DEEPZOOM_TILE_SIZE = 256
+DEFAULT_DEEPZOOM_TILE_WORKERS = 1
+DEFAULT_DEEPZOOM_MAX_LEVEL_MEGAPIXELS = 64.0
+
+DEEPZOOM_MIN_PIXELS = int(
+    max(
+        0.0,
+        config.getfloat(
+            "thumbnails", "deepzoom_min_megapixels", fallback=DEFAULT_DEEPZOOM_MIN_MEGAPIXELS
+        ),
+    )
+    * 1_000_000
+)
+DEEPZOOM_TILE_SIZE = max(
+    64, config.getint("thumbnails", "tile_size", fallback=DEFAULT_DEEPZOOM_TILE_SIZE)
+)
+DEEPZOOM_TILE_WORKERS = max(
+    1, config.getint("thumbnails", "tile_workers", fallback=DEFAULT_DEEPZOOM_TILE_WORKERS)
+)
+DEEPZOOM_MAX_LEVEL_PIXELS = int(
+    max(
+        0.0,
+        config.getfloat(
+            "thumbnails",
+            "deepzoom_max_level_megapixels",
+            fallback=DEFAULT_DEEPZOOM_MAX_LEVEL_MEGAPIXELS,
+        ),
+    )
+    * 1_000_000
+)
+
+# 库里原图的像素数上限（百万像素）：Pillow 默认的“解压炸弹”保护约 1.79 亿像素就拒绝打开，
+# 对图纸 / 全景太小；库里的文件是可信的，改用这个上限（导入 indexer 时设置一次 Pillow 的全局上限）：
+# 超过的只记尺寸、不生成缩略图，超过两倍的 Pillow 拒绝打开、尺寸记为空；0 表示不限制
+DEFAULT_THUMB_MAX_IMAGE_MEGAPIXELS = 1000.0
+
+THUMB_MAX_IMAGE_PIXELS = int(
+    max(
+        0.0,
+        config.getfloat(
+            "thumbnails", "max_image_megapixels", fallback=DEFAULT_THUMB_MAX_IMAGE_MEGAPIXELS
+        ),
+    )
+    * 1_000_000
+)
+
+# 非 JPEG 原图（PNG / TIFF / WebP 等）的像素数上限（百万像素）：只有 JPEG 能按 DCT 缩放解码，
+# 其他格式生成缩略图 / 分块时要把整张原图按原尺寸解码，每个解码线程 / 进程最坏占用约
+# 像素数 × 4 字节（RGBA），默认 250 百万像素约 1 GB；超过的只记尺寸、不生成缩略图；0 表示不限制
+DEFAULT_THUMB_MAX_FULL_DECODE_MEGAPIXELS = 250.0
+
+THUMB_MAX_FULL_DECODE_PIXELS = int(
+    max(
+        0.0,
+        config.getfloat(
+            "thumbnails",
+            "max_full_decode_megapixels",
+            fallback=DEFAULT_THUMB_MAX_FULL_DECODE_MEGAPIXELS,
+        ),
+    )
+    * 1_000_000
+)
+
+# 缩略图缩放 / 编码参数。
+# 原图按缩小比例解码（JPEG 用 DCT 缩放，其他格式先整数倍 reduce），再做一次高质量缩放：
+# reducing_gap 表示 reduce 之后至少保留目标尺寸的几倍，越大越清晰、越慢（最小 1）
+DEFAULT_THUMB_RESAMPLE = "lanczos"
+DEFAULT_THUMB_REDUCING_GAP = 2.0
+DEFAULT_THUMB_JPEG_QUALITY = 85
+DEFAULT_THUMB_WEBP_QUALITY = 80
+DEFAULT_THUMB_AVIF_QUALITY = 60
+
+_RESAMPLE_NAMES = ("lanczos", "bicubic", "hamming", "bilinear", "box")
+
+THUMB_RESAMPLE = config.get(
+    "thumbnails", "resample", fallback=DEFAULT_THUMB_RESAMPLE
+).strip().lower()
+if THUMB_RESAMPLE not in _RESAMPLE_NAMES:
+    THUMB_RESAMPLE = DEFAULT_THUMB_RESAMPLE
+
+THUMB_REDUCING_GAP = max(
+    1.0,
+    config.getfloat("thumbnails", "reducing_gap", fallback=DEFAULT_THUMB_REDUCING_GAP),
+)
+
+
+def _quality(key: str, default: int) -> int:
+    return min(100, max(1, config.getint("thumbnails", key, fallback=default)))
+
+
+THUMB_JPEG_QUALITY = _quality("jpeg_quality", DEFAULT_THUMB_JPEG_QUALITY)
+THUMB_WEBP_QUALITY = _quality("webp_quality", DEFAULT_THUMB_WEBP_QUALITY)
+THUMB_AVIF_QUALITY = _quality("avif_quality", DEFAULT_THUMB_AVIF_QUALITY)
+
+# 缩略图完整性检查（Pillow verify）的周期：每张缩略图至多每隔这么多天检查一次。
+# 检查在每次整库同步之后于后台进行，不在 /thumbs 请求里做。
+DEFAULT_THUMB_VERIFY_INTERVAL_DAYS = 7.0
+
+THUMB_VERIFY_INTERVAL_DAYS = max(
+    0.0,
+    config.getfloat(
+        "thumbnails", "verify_interval_days", fallback=DEFAULT_THUMB_VERIFY_INTERVAL_DAYS
+    ),
+)
+
+# 孤立缩略图清理（见 thumb_gc）：整库同步之后，距上次清理超过 gc_interval_days 天时在后台清理一次
+# （要把索引里各项目的 _thumbs 目录走一遍；上次清理的时间记在数据库里，重启不重新计时，
+#  第一次只记下起点、过一个周期才清理）；0 表示不自动清理，只能手动触发
+DEFAULT_THUMB_GC_INTERVAL_DAYS = 1.0
+
+THUMB_GC_INTERVAL_DAYS = max(
+    0.0,
+    config.getfloat("thumbnails", "gc_interval_days", fallback=DEFAULT_THUMB_GC_INTERVAL_DAYS),
+)
+
+
+# /thumbs 按需生成缩略图的线程数（专用线程池，见 thumb_ondemand），不占 FastAPI 的公共线程池
+DEFAULT_THUMB_ONDEMAND_WORKERS = 4
+
+THUMB_ONDEMAND_WORKERS = max(
+    1,
+    config.getint("thumbnails", "ondemand_workers", fallback=DEFAULT_THUMB_ONDEMAND_WORKERS),
+)
+
+# /thumbs 的内存路径缓存（原图 → 项目目录 / 缩略图路径，见 thumb_path_cache）最多缓存多少张原图，
+# 命中时 /thumbs 不查数据库。每条约几百字节。
+DEFAULT_THUMB_PATH_CACHE_SIZE = 20000
+
+THUMB_PATH_CACHE_SIZE = max(
+    1,
+    config.getint("thumbnails", "path_cache_size", fallback=DEFAULT_THUMB_PATH_CACHE_SIZE),
+)
+
+# 批量缩略图接口（/api/thumbs/batch，见 thumb_batch）一次最多返回多少张
+DEFAULT_THUMB_BATCH_MAX_ITEMS = 200
+
+THUMB_BATCH_MAX_ITEMS = max(
+    1,
+    config.getint("thumbnails", "batch_max_items", fallback=DEFAULT_THUMB_BATCH_MAX_ITEMS),
+)
+
+# 缩略图存储后端（见 thumb_store）：
+# - folder：写在各项目目录的 _thumbs 下（原来的做法，和原图一起放在共享盘上）；
+# - packed：服务器本地的打包存储，放在 store_dir（相对项目根目录）下，
+#   总大小超过 store_max_mb 时按最近最少使用淘汰（后台整理稀疏的 pack，磁盘占用最坏约为 1.6 倍），
+#   单个 pack 文件写满 store_pack_mb 后换新文件。
+DEFAULT_THUMB_STORE = "folder"
+DEFAULT_THUMB_STORE_DIR = "thumb_store"
+DEFAULT_THUMB_STORE_MAX_MB = 4096
+DEFAULT_THUMB_STORE_PACK_MB = 64
+
+THUMB_STORE = config.get("thumbnails", "store", fallback=DEFAULT_THUMB_STORE).strip().lower()
+if THUMB_STORE not in ("folder", "packed"):
+    THUMB_STORE = DEFAULT_THUMB_STORE
+
+THUMB_STORE_DIR = BASE_DIR / config.get(
+    "thumbnails", "store_dir", fallback=DEFAULT_THUMB_STORE_DIR
+).strip()
+
+THUMB_STORE_MAX_BYTES = max(
+    1, config.getint("thumbnails", "store_max_mb", fallback=DEFAULT_THUMB_STORE_MAX_MB)
+) * 1024 * 1024
+
+THUMB_STORE_PACK_BYTES = max(
+    1, config.getint("thumbnails", "store_pack_mb", fallback=DEFAULT_THUMB_STORE_PACK_MB)
+) * 1024 * 1024
+
+# 加载占位（见 thumb_placeholders）：小预览的长边像素，列表接口里每张图多带几百字节
+DEFAULT_THUMB_PLACEHOLDER_SIZE = 16
+
+THUMB_PLACEHOLDER_SIZE = min(
+    64,
+    max(4, config.getint("thumbnails", "placeholder_size", fallback=DEFAULT_THUMB_PLACEHOLDER_SIZE)),
+)
+
+
+def _parse_hours(raw: str) -> Optional[tuple[int, int]]:
+    """把 "08:30-19:00" 解析成 (起始分钟, 结束分钟)；留空或格式不对时返回 None。"""
+    try:
+        start, end = [part.strip() for part in raw.split("-", 1)]
+        sh, sm = [int(x) for x in start.split(":", 1)]
+        eh, em = [int(x) for x in end.split(":", 1)]
+    except ValueError:
+        return None
+    return sh * 60 + sm, eh * 60 + em
+
+
+THUMB_BUSY_HOURS = _parse_hours(
+    config.get("thumbnails", "busy_hours", fallback=DEFAULT_THUMB_BUSY_HOURS)
+)
+
 # 前端静态资源路径：一般不需要动
 FRONTEND_DIR = BASE_DIR / "frontend"
 FRONTEND_INDEX = FRONTEND_DIR / "index.html"
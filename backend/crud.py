@@ -9,6 +9,10 @@ from sqlalchemy import or_
 
 import models
 import schemas
+from http_cache import media_version, thumb_version, versioned_url
+from thumb_path_cache import thumb_paths
+from thumb_renditions import display_url, rendition_srcset
+from thumb_tiles import dzi_url
 from favorites_models import Collection, CollectionItem  # ★ 新增：收藏夹模型
 
 # MEDIA_ROOT 用于文件系统路径；MEDIA_ROOT_RAW 用于拼 UNC 路径给前端复制
@@ -228,6 +232,79 @@ def set_project_tags_from_text(
     return [t.name for t in tags_for_project]
 
 
+# ========== 图片尺寸 ==========
+
+
+def _aspect_ratio(width: Optional[int], height: Optional[int]) -> Optional[float]:
+    if not width or not height:
+        return None
+    return round(width / height, 4)
+
+
+# 封面图片信息：(width, height, thumb_version, placeholder, dominant_color)
+CoverInfo = Tuple[Optional[int], Optional[int], Optional[str], Optional[str], Optional[str]]
+
+
+def get_cover_infos(
+    db: Session,
+    cover_rel_paths: List[str],
+) -> Dict[str, CoverInfo]:
+    """
+    一次查出一批封面图片的尺寸、缩略图版本号和加载占位：{file_rel_path: CoverInfo}。
+    不在 images 表里的封面（例如图片已被删除）不出现在结果中。
+    """
+    rel_paths = list({r for r in cover_rel_paths if r})
+    if not rel_paths:
+        return {}
+
+    rows = (
+        db.query(
+            models.Image.file_rel_path,
+            models.Image.width,
+            models.Image.height,
+            models.Image.file_size,
+            models.Image.file_mtime_ns,
+            models.Image.placeholder,
+            models.Image.dominant_color,
+        )
+        .filter(models.Image.file_rel_path.in_(rel_paths))
+        .all()
+    )
+    return {
+        rel: (w, h, thumb_version(size, mtime_ns), placeholder, color)
+        for rel, w, h, size, mtime_ns, placeholder, color in rows
+    }
+
+
+def cover_image_fields(
+    db: Session,
+    project: models.Project,
+    cover_infos: Optional[Dict[str, CoverInfo]] = None,
+) -> Dict[str, Any]:
+    """
+    ProjectOut 里封面图片相关的字段：
+    cover_url（带版本号的 /thumbs 地址）/ cover_width / cover_height / cover_aspect_ratio / cover_srcset /
+    cover_placeholder / cover_color。
+    列表接口传入 get_cover_infos 批量查好的结果；单个项目的接口不传，按需查一次。
+    """
+    rel = getattr(project, "cover_rel_path", None)
+    if not rel:
+        return {}
+
+    if cover_infos is None:
+        cover_infos = get_cover_infos(db, [rel])
+    width, height, version, placeholder, color = cover_infos.get(rel, (None,) * 5)
+    return {
+        "cover_url": versioned_url(f"/thumbs/{rel}", version),
+        "cover_width": width,
+        "cover_height": height,
+        "cover_aspect_ratio": _aspect_ratio(width, height),
+        "cover_srcset": rendition_srcset(rel, width, height, version),
+        "cover_placeholder": placeholder,
+        "cover_color": color,
+    }
+
+
 # ========== 项目 & 图片相关原有逻辑 ==========
 
 def get_projects(
@@ -242,7 +319,7 @@ def get_projects(
     - 支持按名称 / 建筑师模糊搜索
     - 支持多种排序方式（总热度 / 近期热度 / 加入时间 / 名称 / 地点 / 建筑师）
     - 每个项目带：
-      · 封面缩略图 URL cover_url（如果有封面的话，形如 /thumbs/...）
+      · 封面缩略图 URL cover_url（如果有封面的话，形如 /thumbs/...?v=版本号）
       · 复制用文件系统路径 fs_path（UNC）
       · 项目标签 tags（小写字符串列表）
     """
@@ -272,12 +349,11 @@ def get_projects(
 
     result: List[schemas.ProjectOut] = []
 
+    # 封面尺寸 / 版本号：整页一次查询
+    cover_infos = get_cover_infos(db, [p.cover_rel_path for p in projects])
+
     for p in projects:
-        # 1) 封面：只要有 cover_rel_path，就交给 /thumbs 路由处理
-        if getattr(p, "cover_rel_path", None):
-            cover_url: Optional[str] = f"/thumbs/{p.cover_rel_path}"
-        else:
-            cover_url = None
+        # 1) 封面：只要有 cover_rel_path，就交给 /thumbs 路由处理（cover_url 等见 cover_image_fields）
 
         # 2) 复制用 UNC 路径
         fs_path = _build_fs_path(p.folder_path)
@@ -294,7 +370,6 @@ def get_projects(
                 id=p.id,
                 name=p.name,
                 folder_path=p.folder_path,
-                cover_url=cover_url,
                 architect=p.architect,
                 description=p.description,
                 location=p.location,
@@ -303,6 +378,7 @@ def get_projects(
                 display_order=p.display_order,
                 tags=tags,
                 fs_path=fs_path,
+                **cover_image_fields(db, p, cover_infos),
             )
         )
 
@@ -322,7 +398,12 @@ def get_images(
     - 可按文件名 / 标签 / 项目名模糊搜索
     - 同时返回：
       · 原图 URL（/media/...）
-      · 缩略图 URL（/thumbs/...）
+      · 缩略图 URL（/thumbs/...）及各尺寸档位的 srcset
+      · 大图查看用的显示尺寸 URL（/display/...，原图本身够小时就是原图 URL），
+        超大图另有分块金字塔的 DZI 地址（/tiles/....dzi）
+        （都带 ?v=版本号，可以长期缓存；原图还没探测过大小 / mtime 时不带）
+      · 原图尺寸 width / height / aspect_ratio（未知时为 None）
+      · 加载占位 placeholder / dominant_color（还没算出来时为 None）
     """
     query = (
         db.query(
@@ -354,16 +435,30 @@ def get_images(
 
     images: List[schemas.ImageOut] = []
     for img, project_name in rows:
-        original_url = f"/media/{img.file_rel_path}"
-        thumb_url = f"/thumbs/{img.file_rel_path}"
+        original_url = versioned_url(
+            f"/media/{img.file_rel_path}", media_version(img.file_size, img.file_mtime_ns)
+        )
+        version = thumb_version(img.file_size, img.file_mtime_ns)
+        thumb_url = versioned_url(f"/thumbs/{img.file_rel_path}", version)
 
         images.append(
             schemas.ImageOut(
                 id=img.id,
                 project_id=img.project_id,
                 project_name=project_name,
+                file_rel_path=img.file_rel_path,
                 url=original_url,
                 thumb_url=thumb_url,
+                thumb_srcset=rendition_srcset(img.file_rel_path, img.width, img.height, version),
+                display_url=display_url(
+                    img.file_rel_path, img.width, img.height, original_url, version
+                ),
+                dzi_url=dzi_url(img.file_rel_path, img.width, img.height, version),
+                width=img.width,
+                height=img.height,
+                aspect_ratio=_aspect_ratio(img.width, img.height),
+                placeholder=img.placeholder,
+                dominant_color=img.dominant_color,
             )
         )
 
@@ -607,7 +702,8 @@ def merge_projects(
     - 标签（Tag）做并集合并到目标项目；
     - 全站热度 heat 相加；
     - 如果目标项目尚无封面，则尝试使用源项目的封面；
-    - 最后删除源项目记录。
+    - 最后删除源项目记录；
+    - 被合并图片的项目目录变了，/thumbs 路径缓存里的对应条目作废。
     """
     if not sources:
         return target, []
@@ -616,9 +712,11 @@ def merge_projects(
     source_ids = [p.id for p in sources]
 
     # 合并图片
+    moved_rel_paths: List[str] = []
     for src in sources:
         for img in list(src.images):
             img.project = target
+            moved_rel_paths.append(img.file_rel_path)
 
     # 合并点击记录
     for src in sources:
@@ -692,6 +790,7 @@ def merge_projects(
         db.rollback()
         raise
 
+    thumb_paths.invalidate(moved_rel_paths)
     db.refresh(target)
 
     # 更新一次 project.json（只针对目标项目）
@@ -1,7 +1,7 @@
 # database.py
 from pathlib import Path
 import configparser
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 # 读取 config.ini 获取数据库路径
@@ -28,3 +28,26 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # 所有模型继承的基类
 Base = declarative_base()
+
+
+def add_missing_columns(bind=engine) -> None:
+    """
+    轻量“迁移”：create_all 只建新表，不会给已有表加列。
+    这里对比模型与 SQLite 中实际的表结构，把模型里新增的列用 ALTER TABLE ADD COLUMN 补上
+    （新增列都应是可空的，旧数据保持 NULL，由索引器等按需回填）。
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                col_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(
+                    text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}')
+                )
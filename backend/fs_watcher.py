@@ -0,0 +1,379 @@
+# backend/fs_watcher.py
+"""
+案例库文件监听：目录有变化时自动做单目录同步（sync_jobs.request_folder_sync），
+设计师往共享盘里拖文件夹之后几秒内就能在案例库里看到，不用手动刷新，也从不整库重扫。
+
+两种监听方式（config.ini [indexer] watch_mode）：
+- native：系统文件通知（Linux inotify / Windows ReadDirectoryChangesW，通过 watchfiles），
+          只适合本地盘；
+- poll  ：轮询。SMB 共享盘上收不到可靠的系统通知，就定时把整棵目录树 stat 一遍，
+          只有 mtime 变了的目录才重新列出（目录探测复用 indexer._probe_dir）；
+          内存里每个目录只记 mtime、子目录名和图片文件名的摘要，不保存文件列表；
+- auto  ：本地盘且装了 watchfiles 时用 native，否则用 poll。
+
+两种方式得到的都是“哪些目录变了”，统一进入防抖队列：最后一次变化之后安静
+watch_debounce_seconds 秒（最长等 _MAX_BATCH_DELAY_S 秒）才批量同步，
+已经在队列里的上层目录会吸收它下面的目录，拷贝一个大文件夹只触发一次同步。
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+from config import (
+    INDEXER_WATCH_DEBOUNCE_SECONDS,
+    INDEXER_WATCH_MODE,
+    INDEXER_WATCH_POLL_INTERVAL_SECONDS,
+    MEDIA_ROOT,
+    PROJECTS_ROOT,
+)
+from indexer import (
+    _MTIME_RACY_WINDOW_NS,
+    IMAGE_EXTS,
+    PROJECT_META_NAME,
+    THUMB_DIR_NAME,
+    _probe_dir,
+)
+from sync_jobs import request_folder_sync
+
+try:
+    import watchfiles  # uvicorn[standard] 自带；没装时退回轮询
+except ImportError:  # pragma: no cover - 取决于部署环境
+    watchfiles = None
+
+logger = logging.getLogger(__name__)
+
+# 持续有变化时，距第一次变化最多等这么久就先同步一批（避免一直拷贝时迟迟不可见）
+_MAX_BATCH_DELAY_S = 15.0
+
+# 这些文件系统类型视为网络盘（收不到可靠的 inotify 通知）
+_NETWORK_FS_TYPES = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "afpfs", "fuse.sshfs", "davfs"}
+
+
+def _is_network_path(path: Path) -> bool:
+    """粗略判断路径是否在网络共享盘上（UNC 路径、Windows 网络驱动器、Linux 的 cifs / nfs 挂载）。"""
+    raw = str(path)
+    if raw.startswith("\\\\") or raw.startswith("//"):
+        return True
+
+    if os.name == "nt":
+        try:
+            import ctypes
+
+            drive = os.path.splitdrive(raw)[0]
+            # DRIVE_REMOTE = 4
+            return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == 4
+        except Exception:
+            return False
+
+    # Linux：找包含该路径的最长挂载点，看它的文件系统类型
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+
+    best_point, best_type = "", ""
+    for point, fs_type in mounts:
+        point = point.replace("\\040", " ")
+        if (raw == point or raw.startswith(point.rstrip("/") + "/")) and len(point) > len(best_point):
+            best_point, best_type = point, fs_type
+    return best_type in _NETWORK_FS_TYPES
+
+
+def _rel(path: Path) -> Optional[str]:
+    """绝对路径 → 相对 MEDIA_ROOT 的 posix 路径；不在库里或在 `_thumbs` 里时返回 None。"""
+    try:
+        rel = path.relative_to(MEDIA_ROOT)
+    except ValueError:
+        return None
+    if THUMB_DIR_NAME in rel.parts:
+        return None
+    return rel.as_posix()
+
+
+def _parent_rel(rel: str) -> str:
+    return rel.rpartition("/")[0] or "."
+
+
+class _DirState(NamedTuple):
+    """轮询模式里记住的一个目录（不保存图片文件名列表，整棵树的内存只与目录数有关）。"""
+    # 列目录时的 mtime；离列目录时刻太近的记 None，下次重新列出
+    mtime_ns: Optional[int]
+    # 子目录名（下次 mtime 没变时不用列目录就能继续往下走）
+    subdirs: tuple[str, ...]
+    # 图片文件名集合的摘要
+    images: int
+    has_project_json: bool
+    # project.json 的 (mtime, 大小)，原地改写时目录 mtime 不变，靠它发现
+    meta: tuple[Optional[int], Optional[int]]
+
+    def sig(self) -> tuple:
+        """影响索引的部分：(子目录, 图片, 有无 project.json, project.json 的签名)。"""
+        return frozenset(self.subdirs), self.images, self.has_project_json, self.meta
+
+
+class FsWatcher:
+    """
+    后台监听线程 + 防抖分发线程。start() / stop() 由 app 的 startup / shutdown 事件调用。
+    """
+
+    def __init__(
+        self,
+        root: Path = PROJECTS_ROOT,
+        mode: str = INDEXER_WATCH_MODE,
+        debounce_s: float = INDEXER_WATCH_DEBOUNCE_SECONDS,
+        poll_interval_s: float = INDEXER_WATCH_POLL_INTERVAL_SECONDS,
+    ) -> None:
+        self.root = root.resolve()
+        self.mode = mode
+        self.debounce_s = debounce_s
+        self.poll_interval_s = poll_interval_s
+
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        # 等待同步的目录（相对 MEDIA_ROOT），以及这一批的第一次 / 最近一次变化时间
+        self._pending: set[str] = set()
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        self._threads: list[threading.Thread] = []
+
+        # 轮询模式的内存目录状态：{目录（相对 MEDIA_ROOT）: _DirState}
+        self._snapshot: dict[str, _DirState] = {}
+
+    # ---------- 启停 ----------
+
+    def resolve_mode(self) -> str:
+        """把 auto 解析成实际使用的 native / poll。"""
+        if self.mode == "native":
+            if watchfiles is None:
+                logger.warning("watch_mode = native 但没有安装 watchfiles，改用轮询")
+                return "poll"
+            return "native"
+        if self.mode == "poll":
+            return "poll"
+        if watchfiles is None or _is_network_path(self.root):
+            return "poll"
+        return "native"
+
+    def start(self) -> None:
+        mode = self.resolve_mode()
+        source = self._watch_native if mode == "native" else self._watch_poll
+        for target, name in (
+            (source, f"caselib-watch-{mode}"),
+            (self._dispatch_loop, "caselib-watch-sync"),
+        ):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("文件监听已启动（%s）: %s", mode, self.root)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+
+    # ---------- 防抖队列 ----------
+
+    def add_folders(self, folders: Iterable[str]) -> None:
+        # 根目录本身的变化（例如直接丢在根目录下的图片）不同步，否则就成了整库重扫
+        folders = [f for f in folders if f is not None and f != "."]
+        if not folders:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                self._first_event_at = now
+            self._pending.update(folders)
+            self._last_event_at = now
+        self._wakeup.set()
+
+    def _take_batch(self) -> Optional[list[str]]:
+        """到时间了就取出这一批目录（上层目录吸收下层目录），否则返回 None。"""
+        with self._lock:
+            if not self._pending or time.monotonic() < self._due_at():
+                return None
+            pending = sorted(self._pending)
+            self._pending.clear()
+
+        batch: list[str] = []
+        for rel in pending:
+            # 排序后上层目录一定排在它的子目录前面
+            if any(rel == top or rel.startswith(top + "/") for top in batch):
+                continue
+            batch.append(rel)
+        return batch
+
+    def _due_at(self) -> float:
+        # 调用方持有 self._lock
+        return min(
+            self._last_event_at + self.debounce_s,
+            self._first_event_at + _MAX_BATCH_DELAY_S,
+        )
+
+    def _next_timeout(self) -> Optional[float]:
+        with self._lock:
+            if not self._pending:
+                return None
+            return max(0.0, self._due_at() - time.monotonic())
+
+    def _dispatch_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self._next_timeout())
+            self._wakeup.clear()
+            if self._stop.is_set():
+                return
+
+            batch = self._take_batch()
+            if not batch:
+                continue
+
+            for rel in batch:
+                try:
+                    result = request_folder_sync(rel)
+                    logger.info("文件监听触发目录同步 %s: %s %s", rel, result.status, result.message)
+                except Exception:
+                    logger.exception("文件监听触发的目录同步失败: %s", rel)
+
+    # ---------- native：系统文件通知 ----------
+
+    def _folder_for_event(self, change, path_str: str) -> Optional[str]:
+        """把一条文件变化映射成需要同步的目录。"""
+        path = Path(path_str)
+        rel = _rel(path)
+        if rel is None:
+            return None
+
+        if path.name == PROJECT_META_NAME or path.suffix.lower() in IMAGE_EXTS:
+            # 图片 / project.json 的增删改 → 同步所在目录
+            return _parent_rel(rel)
+        if change == watchfiles.Change.deleted or path.is_dir():
+            # 目录新建 / 删除 / 改名 → 同步该目录本身（sync_folder 会按需向上扩大范围）
+            return rel
+        # 其他文件（说明文档等）不影响索引
+        return None
+
+    def _watch_native(self) -> None:
+        try:
+            for changes in watchfiles.watch(
+                self.root,
+                watch_filter=None,
+                debounce=500,
+                stop_event=self._stop,
+                raise_interrupt=False,
+                recursive=True,
+            ):
+                self.add_folders(self._folder_for_event(c, p) for c, p in changes)
+        except Exception:
+            if self._stop.is_set():
+                return
+            # 例如 inotify 监听数超过系统上限
+            logger.exception("系统文件通知不可用，改用轮询: %s", self.root)
+            self._watch_poll()
+
+    # ---------- poll：定时比较目录 mtime ----------
+
+    def poll_once(self) -> list[str]:
+        """
+        把目录树扫一遍（mtime 没变的目录不重新列出），返回内容变化过的目录。
+        第一次调用只记下各目录的状态，不报告变化。
+        """
+        first = not self._snapshot
+        snapshot: dict[str, _DirState] = {}
+        changed: list[str] = []
+
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            rel = path.relative_to(MEDIA_ROOT).as_posix()
+            old = self._snapshot.get(rel)
+            result = _probe_dir(
+                path,
+                True,
+                old.mtime_ns if old is not None else None,
+                old.has_project_json if old is not None else False,
+            )
+            if result["error"] is not None:
+                logger.warning("无法访问目录，跳过 (%s): %s", path, result["error"])
+                continue
+
+            listing = result["listing"]
+            if listing is None:
+                # 目录 mtime 没变：沿用上次的子目录和图片摘要
+                mtime_ns, subdirs, images, has_project_json = (
+                    old.mtime_ns, old.subdirs, old.images, old.has_project_json
+                )
+            else:
+                names, image_names, has_project_json, _ = listing
+                mtime_ns = result["mtime_ns"]
+                if result["listed_at_ns"] - mtime_ns < _MTIME_RACY_WINDOW_NS:
+                    mtime_ns = None
+                subdirs, images = tuple(names), hash(frozenset(image_names))
+            meta = result["meta_sig"]
+            if meta is None:
+                # 记着有 project.json，但已经读不到了
+                has_project_json, meta = False, (None, None)
+
+            state = _DirState(mtime_ns, subdirs, images, has_project_json, meta)
+            snapshot[rel] = state
+            # 逆序压栈，保持自顶向下、按列表顺序的遍历次序
+            stack.extend(reversed([path / name for name in subdirs]))
+
+            if first or old is None:
+                # 新目录：父目录的子目录列表也会变，由父目录负责
+                # （目录没了同理，它不会出现在新的状态里）
+                continue
+            new_sig, old_sig = state.sig(), old.sig()
+            if new_sig == old_sig:
+                continue
+
+            if new_sig[1:] == old_sig[1:] or rel == ".":
+                # 只是子目录增删 / 改名：只同步这些子目录，不用把整个分类目录重扫一遍
+                # （根目录永远这样处理，避免一次变化触发整库重扫）
+                changed.extend(
+                    f"{rel}/{name}" if rel != "." else name
+                    for name in sorted(new_sig[0] ^ old_sig[0])
+                )
+            else:
+                changed.append(rel)
+
+        self._snapshot = snapshot
+        return changed
+
+    def _watch_poll(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.add_folders(self.poll_once())
+            except Exception:
+                logger.exception("轮询目录失败: %s", self.root)
+            self._stop.wait(self.poll_interval_s)
+
+
+# ========== 全局实例（由 app 启停） ==========
+
+_watcher: Optional[FsWatcher] = None
+
+
+def start_watcher() -> Optional[FsWatcher]:
+    """按 config.ini [indexer] watch_mode 启动文件监听；off 时什么都不做。"""
+    global _watcher
+    if INDEXER_WATCH_MODE == "off" or _watcher is not None:
+        return _watcher
+    if not PROJECTS_ROOT.exists():
+        logger.warning("PROJECTS_ROOT 不存在，不启动文件监听: %s", PROJECTS_ROOT)
+        return None
+    _watcher = FsWatcher()
+    _watcher.start()
+    return _watcher
+
+
+def stop_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
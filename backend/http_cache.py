@@ -0,0 +1,173 @@
+# backend/http_cache.py
+"""
+/thumbs 与 /media 的 HTTP 缓存：
+
+- 响应都带 ETag（由文件 mtime + 大小算出）和 Last-Modified；
+  请求带 If-None-Match / If-Modified-Since 且文件没变时直接回 304，不再发送文件内容；
+- 列表接口给出的 URL 带版本号 ?v=...：原图大小 + mtime 的短哈希（缩略图再加上缩放 / 编码参数），
+  原图一变 URL 就跟着变，所以带版本号的响应可以 Cache-Control: immutable 缓存一年，
+  浏览器翻页时连 304 的往返都省掉；
+- 不带版本号的请求（旧页面、手输的地址、收藏夹里直接拼的封面地址）用 no-cache：
+  每次回来验证一下，没变时只回 304。
+"""
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from config import (
+    THUMB_AVIF_QUALITY,
+    THUMB_JPEG_QUALITY,
+    THUMB_REDUCING_GAP,
+    THUMB_RESAMPLE,
+    THUMB_WEBP_QUALITY,
+)
+
+VERSION_PARAM = "v"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 缩略图的内容还取决于缩放 / 编码参数：改了 config.ini 之后旧 URL 要失效
+_THUMB_SETTINGS = (
+    f"{THUMB_RESAMPLE}-{THUMB_REDUCING_GAP:g}-"
+    f"{THUMB_JPEG_QUALITY}-{THUMB_WEBP_QUALITY}-{THUMB_AVIF_QUALITY}"
+)
+
+
+# ========== 版本号 ==========
+
+def _short_hash(text: str) -> str:
+    return hashlib.blake2s(text.encode(), digest_size=6).hexdigest()
+
+
+def media_version(file_size: Optional[int], file_mtime_ns: Optional[int]) -> Optional[str]:
+    """原图的版本号；大小 / mtime 还没记录（同步还没探测过这张图）时返回 None。"""
+    if file_size is None or file_mtime_ns is None:
+        return None
+    return _short_hash(f"{file_size}-{file_mtime_ns}")
+
+
+def thumb_version(file_size: Optional[int], file_mtime_ns: Optional[int]) -> Optional[str]:
+    """缩略图的版本号：原图版本 + 缩放 / 编码参数。"""
+    if file_size is None or file_mtime_ns is None:
+        return None
+    return _short_hash(f"{file_size}-{file_mtime_ns}-{_THUMB_SETTINGS}")
+
+
+def versioned_url(url: str, version: Optional[str]) -> str:
+    """给 URL 加上 v=版本号（已有查询参数时用 & 连接）；没有版本号时原样返回。"""
+    if not version:
+        return url
+    sep = "&" if "?" in url else "?"
+    return f"{url}{sep}{VERSION_PARAM}={version}"
+
+
+def cache_control(versioned: bool) -> str:
+    return IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL
+
+
+# ========== 条件请求 ==========
+
+def is_not_modified(response_headers: Headers, request_headers: Headers) -> bool:
+    """
+    按 RFC 9110 判断能否回 304：有 If-None-Match 时只比较 ETag（忽略 W/ 前缀），
+    否则比较 If-Modified-Since 与 Last-Modified。
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response_headers.get("etag")
+        if if_none_match.strip() == "*":
+            return etag is not None
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag is not None and etag in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("last-modified")
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def cached_file_response(
+    request_headers: Headers,
+    path: Path,
+    media_type: Optional[str] = None,
+    headers: Optional[dict] = None,
+    stat_result: Optional[os.stat_result] = None,
+    versioned: bool = False,
+    status_code: int = 200,
+) -> Response:
+    """
+    发送文件的 FileResponse，带 ETag / Last-Modified / Cache-Control；
+    条件请求命中时改回 304（只保留缓存相关的头，例如 Vary）。
+    media_type 不传时按扩展名猜；stat_result 不传时现场 stat 一次。
+    """
+    if stat_result is None:
+        stat_result = os.stat(path)
+
+    response = FileResponse(
+        str(path),
+        status_code=status_code,
+        media_type=media_type,
+        headers={**(headers or {}), "Cache-Control": cache_control(versioned)},
+        stat_result=stat_result,
+    )
+    if is_not_modified(response.headers, request_headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
+def cached_blob_response(
+    request_headers: Headers,
+    read: Callable[[], bytes],
+    size: int,
+    mtime_ns: int,
+    media_type: str,
+    headers: Optional[dict] = None,
+    versioned: bool = False,
+) -> Response:
+    """
+    发送一段内容（缩略图存储里的一张缩略图，见 thumb_store），ETag / Last-Modified 由大小和写入时间算出；
+    条件请求命中时回 304，不读取内容（read 只在真正要发送时调用）。
+    """
+    mtime = mtime_ns / 1_000_000_000
+    response_headers = Headers({
+        **(headers or {}),
+        "cache-control": cache_control(versioned),
+        "etag": f'"{_short_hash(f"{mtime_ns}-{size}")}"',
+        "last-modified": formatdate(mtime, usegmt=True),
+    })
+    if is_not_modified(response_headers, request_headers):
+        return NotModifiedResponse(response_headers)
+    return Response(content=read(), media_type=media_type, headers=dict(response_headers))
+
+
+class CachedStaticFiles(StaticFiles):
+    """/media 挂载点：在 StaticFiles 的 ETag / 304 基础上按有没有版本号加 Cache-Control。"""
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        return cached_file_response(
+            Headers(scope=scope),
+            Path(full_path),
+            stat_result=stat_result,
+            versioned=bool(query.get(VERSION_PARAM)),
+            status_code=status_code,
+        )
@@ -1,15 +1,35 @@
 import os
 import json
+import io
+import math
+import time
 import logging
+import threading
 
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime
-from typing import Iterable, Optional
+from typing import Callable, Iterator, Optional
 
+from sqlalchemy import bindparam, delete, exists, insert, select, update
 from sqlalchemy.orm import Session
 
 import models
-from config import MEDIA_ROOT, PROJECTS_ROOT
+from config import (
+    MEDIA_ROOT,
+    PROJECTS_ROOT,
+    INDEXER_RESTAT_IMAGES,
+    INDEXER_SCAN_WORKERS,
+    INDEXER_WRITE_CHUNK_SIZE,
+    THUMB_AVIF_QUALITY,
+    THUMB_JPEG_QUALITY,
+    THUMB_MAX_FULL_DECODE_PIXELS,
+    THUMB_MAX_IMAGE_PIXELS,
+    THUMB_REDUCING_GAP,
+    THUMB_RESAMPLE,
+    THUMB_WEBP_QUALITY,
+)
+from thumb_store import ThumbStore, get_thumb_store
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +39,26 @@ IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".tif"}
 THUMB_DIR_NAME = "_thumbs"
 THUMB_LONG_EDGE = 800
 
+PROJECT_META_NAME = "project.json"
+
+# 目录 mtime 离“列目录时刻”太近时不写入清单：
+# 共享盘 mtime 精度有限，同一时间片内紧接着的改动可能不会让 mtime 变化，下次宁可重新列一遍
+_MTIME_RACY_WINDOW_NS = 2_000_000_000
+
+# 同步写库时块与块之间让出写锁的时间（秒）
+_WRITE_CHUNK_PAUSE_S = 0.01
+
+# 可以由 project.json 覆盖的 Project 字段（与 parse_project_meta 返回的键一致）
+_PROJECT_META_FIELDS = (
+    "name",
+    "architect",
+    "location",
+    "category",
+    "year",
+    "description",
+    "display_order",
+)
+
 
 def load_project_meta(folder_abs_path: str) -> dict:
     """
@@ -27,7 +67,7 @@ def load_project_meta(folder_abs_path: str) -> dict:
     兼容两种结构（旧版平铺 / 新版带 meta、display 等），这里只负责把 JSON 读成 dict，
     上层再去拆字段。
     """
-    meta_path = Path(folder_abs_path) / "project.json"
+    meta_path = Path(folder_abs_path) / PROJECT_META_NAME
     if not meta_path.is_file():
         return {}
 
@@ -51,47 +91,502 @@ def load_project_meta(folder_abs_path: str) -> dict:
         return {}
 
 
-def iter_image_files(project_dir: Path, project_roots: Iterable[Path]) -> Iterable[Path]:
+def parse_project_meta(meta: dict, default_name: str) -> dict:
     """
-    遍历某个项目目录下所有图片文件（递归）。
+    把 load_project_meta 读出的 dict 拆成 Project 上的各个 meta 字段。
 
-    规则：
-    - 递归扫描 project_dir
-    - 始终跳过名为 `_thumbs` 的目录及其子目录
-    - 如果该项目目录下面还有“子项目”（也被识别为项目目录），
-      则不会把子项目目录及其子树中的图片算到当前项目里，避免重复计入。
+    优先使用 meta 节点，没有则退回旧版平铺结构；display.order 对应 display_order。
+    返回的 dict 键与 Project 列名一致：
+    name / architect / location / category / year / description / display_order。
     """
-    project_dir = project_dir.resolve()
-    project_roots_set = {p.resolve() for p in project_roots}
+    fields: dict = {
+        "name": default_name,
+        "architect": None,
+        "location": None,
+        "category": None,
+        "year": None,
+        "description": None,
+        "display_order": None,
+    }
+
+    if not isinstance(meta, dict):
+        return fields
+
+    # 优先使用 meta 节点，没有则退回旧版平铺结构
+    src = meta.get("meta")
+    if not isinstance(src, dict):
+        src = meta
+
+    for key in ("name", "architect", "location", "category", "description"):
+        val = src.get(key)
+        if isinstance(val, str) and val.strip():
+            fields[key] = val.strip()
+
+    year_val = src.get("year")
+    if year_val is not None:
+        try:
+            fields["year"] = int(year_val)
+        except (TypeError, ValueError):
+            fields["year"] = None
+
+    display = meta.get("display")
+    if isinstance(display, dict):
+        order_val = display.get("order")
+        if isinstance(order_val, int):
+            fields["display_order"] = order_val
+
+    return fields
+
+
+# ========== 同步进度 / 取消 ==========
+
+class SyncCancelled(Exception):
+    """同步被取消（在目录之间、写库块之间检查取消标记时抛出）。"""
+
+
+class SyncProgress:
+    """
+    sync_from_fs 的进度计数与取消标记，由后台同步任务和状态接口共享。
+
+    - phase        ：当前阶段（scanning 扫盘并分批写库 / writing / cleanup 清理已删除的项目图片 / done）；
+    - dirs_scanned ：已处理的目录数（含复用清单的目录）；
+    - images_seen  ：扫描到的图片数；
+    - rows_written ：已提交的数据库行数（插入 + 更新 + 删除）。
+    计数只在同步线程里累加，其他线程只读，不需要额外加锁。
+    """
+
+    def __init__(self) -> None:
+        self.phase = "pending"
+        self.dirs_scanned = 0
+        self.images_seen = 0
+        self.rows_written = 0
+        self._cancel_event = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel_event.is_set():
+            raise SyncCancelled()
+
+
+# ========== 批量写库工具（分块 executemany + 逐块提交） ==========
+
+def _iter_chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bulk_execute(
+    db: Session,
+    stmt,
+    rows: list[dict],
+    progress: Optional[SyncProgress] = None,
+) -> int:
+    """
+    把 rows 按 [indexer] write_chunk_size 分块，用 executemany 执行 stmt，每块单独提交。
+
+    SQLite 整库只有一把写锁：逐块提交能让点击 / 收藏等请求在块与块之间拿到锁，
+    不必等整个同步结束；块之间再稍微让出一下，给正在重试的写请求留出空档。
+    传入 progress 时每块提交后累加 rows_written，并在块之间响应取消。
+    """
+    for i, chunk in enumerate(_iter_chunks(rows, INDEXER_WRITE_CHUNK_SIZE)):
+        if i:
+            time.sleep(_WRITE_CHUNK_PAUSE_S)
+        if progress is not None:
+            progress.check_cancelled()
+        db.execute(stmt, chunk)
+        db.commit()
+        if progress is not None:
+            progress.rows_written += len(chunk)
+    return len(rows)
+
+
+def _bulk_delete_in(
+    db: Session,
+    table,
+    column,
+    values: list,
+    progress: Optional[SyncProgress] = None,
+) -> int:
+    """
+    按块执行 DELETE FROM table WHERE column IN (...)，每块单独提交（progress 同 _bulk_execute）。
+    返回实际删除的行数。
+    """
+    deleted = 0
+    for i, chunk in enumerate(_iter_chunks(values, INDEXER_WRITE_CHUNK_SIZE)):
+        if i:
+            time.sleep(_WRITE_CHUNK_PAUSE_S)
+        if progress is not None:
+            progress.check_cancelled()
+        result = db.execute(delete(table).where(column.in_(chunk)))
+        db.commit()
+        deleted += result.rowcount
+        if progress is not None:
+            progress.rows_written += result.rowcount
+    return deleted
+
+
+def _list_dir(path: Path) -> tuple[list[str], list[str], bool, int]:
+    """
+    用 os.scandir 列一次目录（每个目录只有这一次 listdir，类型信息直接来自目录项，不再逐个 stat）。
+
+    返回 (子目录名列表, 图片文件名列表, 是否有 project.json, 目录条目总数)，
+    子目录已排除 `_thumbs` 与符号链接目录（与 os.walk 默认行为一致），顺序保持系统返回顺序。
+    """
+    subdirs: list[str] = []
+    image_names: list[str] = []
+    has_project_json = False
+    entry_count = 0
+
+    with os.scandir(path) as it:
+        for entry in it:
+            entry_count += 1
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
 
-    # 找出当前项目目录下的“子项目根目录”
-    subproject_roots = {
-        p for p in project_roots_set
-        if p != project_dir and project_dir in p.parents
+            if is_dir:
+                if name != THUMB_DIR_NAME and not entry.is_symlink():
+                    subdirs.append(name)
+                continue
+
+            if name == PROJECT_META_NAME:
+                has_project_json = True
+            elif os.path.splitext(name)[1].lower() in IMAGE_EXTS:
+                image_names.append(name)
+
+    return subdirs, image_names, has_project_json, entry_count
+
+
+def _probe_dir(
+    path: Path,
+    use_manifest: bool,
+    known_mtime_ns: Optional[int],
+    known_has_project_json: bool,
+) -> dict:
+    """
+    对单个目录做一次文件系统探测（只做 IO，不碰数据库会话，可以放在线程池里并发执行）：
+
+    - use_manifest=False：直接 listdir；
+    - use_manifest=True ：先 stat 目录，mtime 等于 known_mtime_ns 时不再 listdir（listing=None），
+      有 project.json 的目录再 stat 一次 project.json。
+
+    出错时返回的 dict 里带 error，由调用方记录日志并跳过该目录。
+    """
+    result: dict = {
+        "path": path,
+        "mtime_ns": None,
+        "listing": None,
+        "listed_at_ns": None,
+        "meta_sig": (None, None),
+        "error": None,
     }
 
-    for dirpath, dirnames, filenames in os.walk(project_dir):
-        current = Path(dirpath)
+    try:
+        if use_manifest:
+            result["mtime_ns"] = path.stat().st_mtime_ns
+
+        if not use_manifest or known_mtime_ns is None or result["mtime_ns"] != known_mtime_ns:
+            result["listing"] = _list_dir(path)
+            result["listed_at_ns"] = time.time_ns()
+    except OSError as e:
+        result["error"] = e
+        return result
+
+    if use_manifest:
+        has_project_json = (
+            result["listing"][2] if result["listing"] is not None else known_has_project_json
+        )
+        if has_project_json:
+            try:
+                meta_st = (path / PROJECT_META_NAME).stat()
+                result["meta_sig"] = (meta_st.st_mtime_ns, meta_st.st_size)
+            except OSError:
+                # 缓存里说有 project.json，但已经读不到了：按没有处理
+                result["meta_sig"] = None
+
+    return result
+
+
+def _new_manifest_row(rel: str) -> dict:
+    """清单里还没有的目录：先建一行空记录，由 _merge_probe 填充。"""
+    return {"id": None, "rel_path": rel, "meta_mtime_ns": None, "meta_size": None}
+
+
+def _merge_probe(
+    result: dict,
+    row: Optional[dict],
+    full: bool,
+    now: datetime,
+    stats: dict,
+) -> tuple[list[str], list[str], bool, bool]:
+    """
+    把一次 _probe_dir 的结果与该目录的清单行合并，
+    返回 (子目录名列表, 图片文件名列表, 是否有 project.json, meta_changed)。
+
+    row 为 None 表示不用目录清单（meta_changed 恒为 True）；
+    否则就地更新 row：重新列出的目录写入新的列表，project.json 的 mtime / 大小变了时写入新签名，
+    有改动的行标记 _dirty，由调用方决定何时落库。
+    """
+    listing = result["listing"]
+    if listing is None:
+        # 目录 mtime 与清单一致：直接复用缓存的列表
+        subdirs = json.loads(row["subdirs"] or "[]")
+        image_names = json.loads(row["image_files"] or "[]")
+        has_project_json = bool(row["has_project_json"])
+        stats["dirs_cached"] += 1
+    else:
+        subdirs, image_names, has_project_json, entry_count = listing
+        stats["dirs_listed"] += 1
+
+        if row is not None:
+            mtime_ns = result["mtime_ns"]
+            racy = result["listed_at_ns"] - mtime_ns < _MTIME_RACY_WINDOW_NS
+            row.update(
+                dir_mtime_ns=None if racy else mtime_ns,
+                entry_count=entry_count,
+                subdirs=json.dumps(subdirs, ensure_ascii=False),
+                image_files=json.dumps(image_names, ensure_ascii=False),
+                has_project_json=has_project_json,
+                scanned_at=now,
+                _dirty=True,
+                _listed=True,
+            )
+
+    if row is None:
+        return subdirs, image_names, has_project_json, True
+
+    # project.json 是原地改写的话目录 mtime 不会变，所以要单独比较它自己的 mtime / 大小
+    meta_sig = result["meta_sig"]
+    if meta_sig is None:
+        has_project_json = False
+        meta_sig = (None, None)
+
+    meta_changed = full or (row["meta_mtime_ns"], row["meta_size"]) != meta_sig
+    if meta_changed:
+        row["meta_mtime_ns"], row["meta_size"] = meta_sig
+        row["scanned_at"] = now
+        row["_dirty"] = True
+
+    return subdirs, image_names, has_project_json, meta_changed
+
+
+def collect_dir_info(
+    root: Path,
+    manifest: Optional[dict[str, dict]] = None,
+    full: bool = False,
+    stats: Optional[dict] = None,
+    workers: Optional[int] = None,
+    progress: Optional[SyncProgress] = None,
+) -> dict[Path, dict]:
+    """
+    单次遍历 root，收集每个目录的信息：
+    - has_project_json / has_image_here：项目识别用；
+    - image_names ：该目录下直接存放的图片文件名；
+    - children    ：子目录路径（已排除 `_thumbs`）；
+    - meta_changed：该目录 project.json 的 mtime / 大小是否与上次不同（需要重新解析）。
+
+    传入 manifest（load_manifest 的结果）时借助 fs_dir_manifest 目录清单做增量扫描：
+    - 每个目录先 stat 一次；mtime 与清单一致则直接复用缓存的子目录 / 图片列表，不再 listdir。
+      （目录 mtime 只反映直接子项的增删改名，所以子目录仍需各自 stat 一次，
+       但对共享盘来说一次 stat 远比列出整个目录便宜。）
+    - mtime 变了或清单里没有该目录 → 用 os.scandir 重新列出并更新清单；
+    - 有 project.json 的目录额外 stat 一次 project.json，与清单中的 mtime / 大小比较；
+    - full=True 时忽略清单，全部重新列出并重写清单（用于修复）；
+    - 本次没再访问到的目录，其清单行会被删除。
+    这里只修改 manifest 这个内存副本（标记 _dirty / _seen），由调用方决定是否落库
+    （fs_watcher 的轮询就只把它放在内存里）。
+
+    不传 manifest 时就是一次纯粹的 os.scandir 遍历（每个目录一次 listdir，没有额外 stat）。
+
+    并发：
+    - 共享盘上列目录主要耗在网络往返上，workers > 1 时目录探测（stat / listdir）
+      会分发到有界线程池里并发执行，一个目录列完立刻把它的子目录继续派发出去；
+    - 目录清单的读写和结果合并只在调用线程里进行；
+    - 结果按路径合并进 dir_info，子目录顺序来自各自的目录列表，
+      所以 scan_projects 得到的项目 / 图片顺序与完成先后无关，和单线程完全一致。
+    workers 不传则取 config.ini [indexer] scan_workers；为 1 时退化为单线程顺序遍历。
+
+    传入 progress 时每合并一个目录累加 dirs_scanned，并在目录之间响应取消（抛 SyncCancelled）。
+    """
+    root = root.resolve()
+    use_manifest = manifest is not None
+
+    if workers is None:
+        workers = INDEXER_SCAN_WORKERS
+    workers = max(1, int(workers))
+
+    if stats is None:
+        stats = {}
+    stats.setdefault("dirs_listed", 0)
+    stats.setdefault("dirs_cached", 0)
+
+    dir_info: dict[Path, dict] = {}
+    now = datetime.utcnow()
+
+    def probe_args(path: Path) -> tuple:
+        """在调用线程里从清单取出探测需要的已知值（纯数据，交给工作线程）。"""
+        if not use_manifest:
+            return (path, False, None, False)
+        row = manifest.get(path.relative_to(MEDIA_ROOT).as_posix())
+        if full or row is None:
+            return (path, True, None, False)
+        return (path, True, row["dir_mtime_ns"], bool(row["has_project_json"]))
+
+    def apply_probe(result: dict) -> list[Path]:
+        """把一次探测结果合并进 dir_info / 目录清单，返回需要继续探测的子目录。"""
+        path = result["path"]
+
+        if progress is not None:
+            progress.check_cancelled()
+            progress.dirs_scanned += 1
+
+        if result["error"] is not None:
+            logger.warning("无法访问目录，跳过 (%s): %s", path, result["error"])
+            return []
+
+        row = None
+        if use_manifest:
+            rel = path.relative_to(MEDIA_ROOT).as_posix()
+            row = manifest.get(rel)
+            if row is None:
+                row = _new_manifest_row(rel)
+                manifest[rel] = row
+            row["_seen"] = True
+
+        subdirs, image_names, has_project_json, meta_changed = _merge_probe(
+            result, row, full, now, stats
+        )
+
+        children = [path / d for d in subdirs]
+        dir_info[path] = {
+            "has_project_json": has_project_json,
+            "has_image_here": bool(image_names),
+            "image_names": image_names,
+            "children": children,
+            "meta_changed": meta_changed,
+        }
+        return children
+
+    if workers == 1:
+        stack = [root]
+        while stack:
+            children = apply_probe(_probe_dir(*probe_args(stack.pop())))
+            # 逆序压栈，保持自顶向下、按列表顺序的遍历次序
+            stack.extend(reversed(children))
+    else:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="caselib-scan"
+        ) as pool:
+            pending = {pool.submit(_probe_dir, *probe_args(root))}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for child in apply_probe(future.result()):
+                            pending.add(pool.submit(_probe_dir, *probe_args(child)))
+            except BaseException:
+                # 取消 / 出错时丢掉还没开始的探测，别让线程池退出时把剩下的目录都列完
+                for future in pending:
+                    future.cancel()
+                raise
+
+    return dir_info
+
+
+class _DirFrame:
+    """_walk_projects 栈上的一个目录。"""
+
+    __slots__ = ("path", "info", "next_child", "under_json", "has_project_below", "unclaimed")
+
+    def __init__(self, path: Path, info: dict, under_json: bool) -> None:
+        self.path = path
+        self.info = info
+        self.next_child = 0
+        # 上层是否有带 project.json 的目录（只有这时，子树里没被认领的图片才可能有归属）
+        self.under_json = under_json
+        self.has_project_below = False
+        # 子树里还没被项目认领的图片（先序）
+        self.unclaimed: list[Path] = []
+
+
+def _walk_projects(
+    root: Path,
+    open_dir: Callable[[Path], Optional[dict]],
+    close_dir: Optional[Callable[[Path], None]] = None,
+) -> Iterator[tuple[Path, list[Path], bool]]:
+    """
+    深度优先遍历 root，一个目录的子树处理完就能判定它是不是项目，是的话立刻产出
+    (项目目录, [图片路径, ...], meta_changed)。识别 / 归属规则见 scan_projects。
+
+    - open_dir(path)：返回目录信息（格式同 collect_dir_info 的值），None 表示跳过该目录；
+    - close_dir(path)：可选，目录子树处理完（其上的项目已产出）之后调用。
+
+    一个目录处理完时：
+    - 是项目 → 产出，图片为它自己的图片 + 子树里还没被认领的图片；
+    - 不是项目 → 它和子树里没被认领的图片交给父目录，等上层带 project.json 的项目认领；
+      上面没有带 project.json 的目录时，这些图片不属于任何项目，直接丢弃。
+    所以内存里只有当前路径上的目录和正在拼装的项目图片列表，与整个库的大小无关。
+    子项目先于上层项目产出；同一项目内的图片仍是自顶向下的先序（第一张即默认封面）。
+    """
+    root_info = open_dir(root)
+    if root_info is None:
+        return
+
+    stack = [_DirFrame(root, root_info, under_json=False)]
+    while stack:
+        frame = stack[-1]
+        info = frame.info
 
-        # 如果进入了某个子项目目录，则整棵子树交给子项目自身处理，这里直接跳过
-        if current in subproject_roots:
-            dirnames[:] = []
+        children = info["children"]
+        if frame.next_child < len(children):
+            child = children[frame.next_child]
+            frame.next_child += 1
+            child_info = open_dir(child)
+            if child_info is not None:
+                under_json = frame.under_json or info["has_project_json"]
+                stack.append(_DirFrame(child, child_info, under_json))
             continue
 
-        # 跳过 _thumbs 目录及其子目录
-        dirnames[:] = [d for d in dirnames if d != THUMB_DIR_NAME]
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        images = [frame.path / name for name in info["image_names"]]
+        images.extend(frame.unclaimed)
 
-        for name in filenames:
-            ext = Path(name).suffix.lower()
-            if ext in IMAGE_EXTS:
-                yield Path(dirpath) / name
+        # 规则 1：有 project.json 的目录必然是项目
+        # 规则 2：叶子图片目录（自身有图片、子树里没有项目）才是项目
+        if info["has_project_json"] or (info["image_names"] and not frame.has_project_below):
+            yield frame.path, images, info["meta_changed"]
+            if parent is not None:
+                parent.has_project_below = True
+        elif parent is not None:
+            if frame.has_project_below:
+                parent.has_project_below = True
+            if frame.under_json:
+                parent.unclaimed.extend(images)
 
+        if close_dir is not None:
+            close_dir(frame.path)
 
-def iter_project_dirs(root: Path) -> Iterable[Path]:
+
+def scan_projects(
+    root: Path,
+    dir_info: Optional[dict[Path, dict]] = None,
+) -> list[tuple[Path, list[Path]]]:
     """
-    递归遍历 root，寻找“项目目录”。
+    单次遍历识别 root 下的“项目目录”，并同时收集每个项目的图片文件。
+
+    返回 [(项目目录, [图片路径, ...]), ...]，按项目目录路径排序，保证结果稳定。
 
-    新规则：
+    项目识别规则：
 
     1）任何目录中只要有 project.json → 必然是一个项目目录
         · 即使它下面还有子项目，也允许并行存在
@@ -102,96 +597,227 @@ def iter_project_dirs(root: Path) -> Iterable[Path]:
 
     3）名为 `_thumbs` 的目录及其子目录一律跳过：
         · 不参与项目识别，也不会被视为分类目录或项目目录。
+
+    图片归属规则：
+    - 每个目录里的图片归属于离它最近的项目目录（含自身）；
+    - 因此“子项目”目录及其子树中的图片只算子项目的，不会重复计入上层项目；
+    - 不在任何项目目录之下的图片不计入；
+    - 同一项目内图片按自顶向下的遍历顺序排列（与 os.walk 一致，第一张即默认封面）。
+
+    dir_info 可传入 collect_dir_info 的结果（例如带目录清单的增量扫描）；
+    不传则现场用 os.scandir 遍历一遍。整个过程只访问文件系统这一遍，后续全在内存里完成。
+    整库同步不走这里，而是用 _walk_projects 边扫边产出（见 sync_from_fs）。
     """
     root = root.resolve()
 
-    # -------- 第一遍：收集目录信息 --------
-    dir_info: dict[Path, dict] = {}
+    if dir_info is None:
+        dir_info = collect_dir_info(root)
 
-    for dirpath, dirnames, filenames in os.walk(root):
-        path = Path(dirpath)
+    return sorted(
+        (project_dir, image_paths)
+        for project_dir, image_paths, _ in _walk_projects(root, dir_info.get)
+    )
 
-        # 跳过 _thumbs 目录及其子目录
-        dirnames[:] = [d for d in dirnames if d != THUMB_DIR_NAME]
 
-        has_project_json = (path / "project.json").is_file()
-        has_image_here = any(
-            Path(name).suffix.lower() in IMAGE_EXTS
-            for name in filenames
-        )
-        children = [path / d for d in dirnames]
+# ========== 缩略图工具函数（保留给 /thumbs 路由等按需调用） ==========
 
-        dir_info[path] = {
-            "has_project_json": has_project_json,
-            "has_image_here": has_image_here,
-            "children": children,
-        }
+# 各编码格式的保存参数（见 _render_thumbnails）
+_THUMB_SAVE_OPTIONS = {
+    "JPEG": {"quality": THUMB_JPEG_QUALITY, "optimize": True, "progressive": True},
+    "WEBP": {"quality": THUMB_WEBP_QUALITY, "method": 4},
+    "AVIF": {"quality": THUMB_AVIF_QUALITY},
+}
 
-    if not dir_info:
-        return
+# Image.reduce() / resize() 不支持这些模式，缩小之前先转成 RGB
+_THUMB_PRECONVERT_MODES = {"P", "PA", "1", "I;16", "I;16B", "I;16L", "I;16N"}
 
-    # -------- 第二遍：自底向上判定项目目录 --------
 
-    def depth(p: Path) -> int:
-        """计算相对 root 的深度，用于排序。"""
-        try:
-            rel = p.relative_to(root)
-        except ValueError:
-            return 0
-        return len(rel.parts)
+def _oriented_size(size: tuple[int, int], orientation: Optional[int]) -> tuple[int, int]:
+    if orientation in _ROTATED_ORIENTATIONS:
+        return size[1], size[0]
+    return size
 
-    # 按深度从深到浅排序，确保先处理子目录，再处理父目录
-    sorted_paths = sorted(dir_info.keys(), key=depth, reverse=True)
 
-    is_project: dict[Path, bool] = {}
-    has_project_subtree: dict[Path, bool] = {}
+def _fit_long_edge(size: tuple[int, int], long_edge: int) -> tuple[int, int]:
+    """长边缩放到 long_edge 后的宽高（不放大）；与 crud 里 srcset 的 w 描述符算法一致。"""
+    w, h = size
+    if max(w, h) <= long_edge:
+        return w, h
+    scale = long_edge / max(w, h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
 
-    for path in sorted_paths:
-        info = dir_info[path]
-        children = info["children"]
 
-        # 子树中是否已有项目（不含当前目录本身）
-        has_project_below = any(
-            has_project_subtree.get(child, False) for child in children
-        )
+def _configure_pillow() -> None:
+    """
+    导入时设置一次 Pillow 的“解压炸弹”上限（进程内全局，预生成的工作进程导入本模块时同样生效）。
+    Pillow 默认约 1.79 亿像素以上就告警、两倍以上拒绝打开，图纸 / 全景经常超过；
+    库里的文件是可信的，改用 max_image_megapixels / max_full_decode_megapixels 中较大的一个：
+    Pillow 自己的检查仍然有效（超过上限的两倍连文件头都不读，尺寸记为空），
+    解码像素前另按格式的上限检查（见 open_library_image）。
+    """
+    try:
+        from PIL import Image as PILImage
+    except ImportError:  # 没装 Pillow 时不生成缩略图，见 _encode_thumbnails
+        return
+    limits = (THUMB_MAX_IMAGE_PIXELS, THUMB_MAX_FULL_DECODE_PIXELS)
+    PILImage.MAX_IMAGE_PIXELS = max(limits) if all(limits) else None
+
+
+_configure_pillow()
 
-        if info["has_project_json"]:
-            # 规则 1：有 project.json 的目录必然是项目
-            is_project[path] = True
-        elif info["has_image_here"] and not has_project_below:
-            # 规则 2：叶子图片目录才是项目
-            is_project[path] = True
-        else:
-            is_project[path] = False
 
-        # 当前目录及其子树是否存在项目目录
-        has_project_subtree[path] = is_project[path] or has_project_below
+def open_library_image(path: Path, check_pixels: bool = True):
+    """
+    打开库里的原图（Pillow 的 Image.open，惰性：只解析文件头）。
+    check_pixels=True（要解码像素）时超过上限抛 ValueError，只读尺寸时不检查
+    （Pillow 自己的上限见 _configure_pillow）。上限按格式不同：JPEG 能按 DCT 缩放解码，
+    用 max_image_megapixels；其他格式要整张按原尺寸解码，用较低的 max_full_decode_megapixels。
+    """
+    from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
 
-    # 按路径排序输出项目目录，保证结果稳定
-    for path in sorted(sorted_paths):
-        if is_project.get(path):
-            yield path
+    im = PILImage.open(path)
+    if check_pixels:
+        limit = THUMB_MAX_IMAGE_PIXELS if is_scaled_decode(im) else THUMB_MAX_FULL_DECODE_PIXELS
+        if limit and im.width * im.height > limit:
+            im.close()
+            raise ValueError(
+                f"{im.format} 图片像素数 {im.width}x{im.height} 超过上限 {limit // 1_000_000} 百万"
+            )
+    return im
 
 
-# ========== 缩略图工具函数（保留给 /thumbs 路由等按需调用） ==========
+def is_scaled_decode(im) -> bool:
+    """能否按缩小比例解码（只有 JPEG 的 draft 有效，其他格式 load() 时总是整张解码）。"""
+    return im.format in _SCALED_DECODE_FORMATS
 
-def _generate_thumbnail(src: Path, dst: Path, long_edge: int = THUMB_LONG_EDGE) -> None:
+
+def _decode_for_thumbnails(im, long_edge: int):
+    """
+    按缩小比例解码原图，返回 (缩小后的图, 转正后的原图宽高)：
+    - JPEG 用 draft 让 libjpeg 直接按 1/2、1/4、1/8 做 DCT 缩放解码，不解码整张原图；
+      DCT 缩放本身就是正经的缩小滤波，只保证长边不小于 long_edge；
+    - 其他格式（以及 DCT 缩放后仍然太大的）再用 reduce() 做整数倍的快速缩小（方框滤波），
+      保证长边不小于 long_edge * THUMB_REDUCING_GAP；
+    最终的高质量缩放留给调用方做一次。
+    顺带按 EXIF 方向转正（在缩小之后做，代价很小），并转成 RGB / L。
     """
-    从 src 生成一张缩略图写到 dst，长边缩放到指定像素。
+    from PIL import Image as PILImage
+
+    orientation = None
+    if im.format in _HEADER_EXIF_FORMATS:
+        orientation = im.getexif().get(_EXIF_ORIENTATION_TAG)
+    full_size = _oriented_size(im.size, orientation)
+
+    w, h = im.size
+    if max(w, h) > long_edge:
+        k = long_edge / max(w, h)
+        im.draft(None, (math.ceil(w * k), math.ceil(h * k)))
+
+    base = im
+    keep = long_edge * THUMB_REDUCING_GAP
+    if base.mode in _THUMB_PRECONVERT_MODES:
+        base = base.convert("RGB")
+    factor = int(max(base.size) // keep)
+    if factor >= 2:
+        base = base.reduce(factor)
+
+    transpose = {
+        2: PILImage.Transpose.FLIP_LEFT_RIGHT,
+        3: PILImage.Transpose.ROTATE_180,
+        4: PILImage.Transpose.FLIP_TOP_BOTTOM,
+        5: PILImage.Transpose.TRANSPOSE,
+        6: PILImage.Transpose.ROTATE_270,
+        7: PILImage.Transpose.TRANSVERSE,
+        8: PILImage.Transpose.ROTATE_90,
+    }.get(orientation)
+    if transpose is not None:
+        base = base.transpose(transpose)
+
+    # 转成 RGB，避免 RGBA / CMYK 等模式保存出问题
+    if base.mode not in ("RGB", "L"):
+        base = base.convert("RGB")
+    return base, full_size
+
+
+def _encode_thumbnails(src: Path, targets: list[tuple[int, Path, Optional[str]]]) -> list[tuple[Path, bytes]]:
+    """
+    原图只解码一次（按最大的目标缩小解码，见 _decode_for_thumbnails），
+    按 targets 里的 (长边像素, 缩略图键, Pillow 格式名) 编码多张缩略图，每张只做一次缩放（THUMB_RESAMPLE 滤镜）。
+    格式名为 None 时按键的扩展名确定格式（沿用原来 _thumbs 下与原图同名的缩略图）。
+    返回编码成功的 [(键, 文件内容), ...]。
     需要安装 Pillow：pip install Pillow
     """
     from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
 
+    resample = getattr(PILImage.Resampling, THUMB_RESAMPLE.upper())
+    encoded: list[tuple[Path, bytes]] = []
     try:
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        with PILImage.open(src) as im:
-            # 转成 RGB，避免 RGBA / P 等模式保存出问题
-            if im.mode not in ("RGB", "L"):
-                im = im.convert("RGB")
-            im.thumbnail((long_edge, long_edge))
-            im.save(dst)
+        with open_library_image(src) as im:
+            base, full_size = _decode_for_thumbnails(im, max(t[0] for t in targets))
+            for long_edge, dst, fmt in sorted(targets, key=lambda t: t[0], reverse=True):
+                try:
+                    size = _fit_long_edge(full_size, long_edge)
+                    thumb = base if base.size == size else base.resize(size, resample)
+                    if fmt is None:
+                        fmt = PILImage.registered_extensions().get(dst.suffix.lower())
+                    buf = io.BytesIO()
+                    thumb.save(buf, format=fmt, **_THUMB_SAVE_OPTIONS.get(fmt, {}))
+                    encoded.append((dst, buf.getvalue()))
+                except Exception as e:
+                    logger.warning("生成缩略图失败 (%s -> %s): %s", src, dst, e)
     except Exception as e:
-        logger.warning("生成缩略图失败 (%s -> %s): %s", src, dst, e)
+        logger.warning("生成缩略图失败 (%s): %s", src, e)
+    return encoded
+
+
+def _render_thumbnails(
+    src: Path,
+    targets: list[tuple[int, Path, Optional[str]]],
+    store: Optional[ThumbStore] = None,
+) -> list[Path]:
+    """
+    编码 targets 里的缩略图（见 _encode_thumbnails）并写入缩略图存储（默认为 config.ini 选定的后端，见 thumb_store）。
+    返回成功写入的键。
+    """
+    store = store or get_thumb_store()
+    written: list[Path] = []
+    for dst, data in _encode_thumbnails(src, targets):
+        try:
+            store.put(dst, data)
+            written.append(dst)
+        except Exception as e:
+            logger.warning("写入缩略图失败 (%s -> %s): %s", src, dst, e)
+    return written
+
+
+def _generate_thumbnail(src: Path, dst: Path, long_edge: int = THUMB_LONG_EDGE) -> None:
+    """
+    从 src 生成一张缩略图写入存储（键为 dst），长边缩放到指定像素。
+    需要安装 Pillow：pip install Pillow
+    """
+    _render_thumbnails(src, [(long_edge, dst, None)])
+
+
+def thumb_path_for_image(abs_image_path: Path, project_dir: Path) -> Optional[Path]:
+    """
+    原图对应的缩略图路径：<project_dir>/_thumbs/<图片在项目内的相对路径>。
+    这也是缩略图在存储里的键（packed 存储并不真的写到这个位置，见 thumb_store）。
+    图片不在项目目录内时记录 warning 并返回 None。
+    """
+    project_dir = project_dir.resolve()
+    abs_image_path = abs_image_path.resolve()
+
+    try:
+        rel_to_project = abs_image_path.relative_to(project_dir)
+    except ValueError:
+        logger.warning(
+            "图片不在项目目录内，无法生成缩略图: %s (project_dir=%s)",
+            abs_image_path,
+            project_dir,
+        )
+        return None
+
+    return project_dir / THUMB_DIR_NAME / rel_to_project
 
 
 def ensure_thumb_for_image(
@@ -199,64 +825,773 @@ def ensure_thumb_for_image(
     project_dir: Path,
 ) -> Optional[Path]:
     """
-    确保给定原图有一张对应的缩略图，返回缩略图路径（可能为 None）。
+    确保给定原图有一张对应的缩略图，返回缩略图路径（即存储里的键，可能为 None）。
 
     规则：
-    - 缩略图统一放在项目目录下的 `_thumbs` 子树中，保持与项目内相对路径一致：
+    - 缩略图路径统一在项目目录下的 `_thumbs` 子树中，保持与项目内相对路径一致：
       原图：   <project_dir>/<子路径>/xxx.jpg
       缩略图： <project_dir>/_thumbs/<子路径>/xxx.jpg
-    - 若缩略图已存在则**先检查是否损坏**，损坏则删除并重建；
+      （folder 存储就写在这里，packed 存储以它为键，见 thumb_store）
+    - 若缩略图已存在且不比原图旧则直接用（只比对修改时间，不打开文件；
+      损坏的缩略图由后台完整性检查发现，原图被替换的由缩略图清单比对大小 / mtime 发现，见 thumb_inventory）；
     - 若原图不存在则记录 warning 后返回 None。
 
     注意：本函数现在**不再在 sync_from_fs 里被批量调用**，
           只给 /thumbs 路由或其他“按需生成”的场景用。
     """
-    project_dir = project_dir.resolve()
+    thumb_path = thumb_path_for_image(abs_image_path, project_dir)
+    if thumb_path is None:
+        return None
     abs_image_path = abs_image_path.resolve()
+    store = get_thumb_store()
 
     try:
-        rel_to_project = abs_image_path.relative_to(project_dir)
-    except ValueError:
-        logger.warning(
-            "图片不在项目目录内，无法生成缩略图: %s (project_dir=%s)",
-            abs_image_path,
-            project_dir,
-        )
+        src_mtime_ns = abs_image_path.stat().st_mtime_ns
+    except OSError:
+        logger.warning("原图不存在，无法生成缩略图: %s", abs_image_path)
         return None
 
-    thumb_path = project_dir / THUMB_DIR_NAME / rel_to_project
+    existing = store.stat(thumb_path)
+    if existing is not None and existing.mtime_ns >= src_mtime_ns:
+        return thumb_path
 
-    # 如果缩略图已经存在，先简单做一次“健康检查”
-    if thumb_path.is_file():
-        try:
-            from PIL import Image as PILImage
-            with PILImage.open(thumb_path) as im:
-                im.verify()  # 不解码整图，只校验文件结构
-            return thumb_path
-        except Exception as e:
-            logger.warning("检测到损坏的缩略图，准备重建 (%s): %s", thumb_path, e)
-            try:
-                thumb_path.unlink()
-            except OSError as del_err:
-                logger.warning("删除损坏缩略图失败: %s (%s)", thumb_path, del_err)
-            # 继续往下，用原图重建
+    written = _render_thumbnails(abs_image_path, [(THUMB_LONG_EDGE, thumb_path, None)], store)
+    return thumb_path if written else None
 
-    if not abs_image_path.is_file():
-        logger.warning("原图不存在，无法生成缩略图: %s", abs_image_path)
+
+def _in_scope(rel_path: str, scope: Optional[str]) -> bool:
+    """rel_path 是否等于 scope 或位于 scope 目录之下（scope 为 None 表示整个库）。"""
+    return scope is None or rel_path == scope or rel_path.startswith(scope + "/")
+
+
+# ========== 图片尺寸（只读文件头） ==========
+
+# EXIF Orientation 为这些值时图片需要旋转 90°，显示宽高与存储宽高互换
+_EXIF_ORIENTATION_TAG = 0x0112
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# 这些格式的 draft() 能按 1/2、1/4、1/8 缩小解码（见 _decode_for_thumbnails）
+_SCALED_DECODE_FORMATS = {"JPEG", "MPO"}
+
+# 这些格式的 EXIF 在文件头里，读 Orientation 不需要解码像素（PNG 的 eXIf 块可能在像素数据之后）
+_HEADER_EXIF_FORMATS = {"JPEG", "MPO", "TIFF", "WEBP"}
+
+
+def read_image_size(path: Path) -> Optional[tuple[int, int]]:
+    """
+    只读文件头得到图片的显示宽高（按 EXIF 方向转正），不解码像素。
+    Pillow 的 Image.open 是惰性的：只解析文件头，像素要到 load() 时才读
+    （所以超大图也能读出尺寸，只有超过像素数上限两倍的读不出，见 _configure_pillow）。
+    读不出来（损坏 / 不支持的格式等）时返回 None。
+    """
+    try:
+        with open_library_image(path, check_pixels=False) as im:
+            width, height = im.size
+            if im.format in _HEADER_EXIF_FORMATS:
+                orientation = im.getexif().get(_EXIF_ORIENTATION_TAG)
+                if orientation in _ROTATED_ORIENTATIONS:
+                    width, height = height, width
+            return width, height
+    except Exception as e:
+        logger.warning("读取图片尺寸失败 (%s): %s", path, e)
+        return None
+
+
+def _probe_image_file(path: Path, known: Optional[tuple]) -> Optional[dict]:
+    """
+    stat 一次原图；大小 / mtime 与 known（上次记录的 (file_size, file_mtime_ns)）一致时不读文件头。
+    返回 {"file_size", "file_mtime_ns", "width", "height"}；没变化或 stat 失败时返回 None。
+    （只做 IO，不碰数据库会话，可以放在线程池里并发执行。）
+    """
+    try:
+        st = path.stat()
+    except OSError as e:
+        logger.warning("无法读取图片文件信息 (%s): %s", path, e)
+        return None
+
+    if known == (st.st_size, st.st_mtime_ns):
         return None
 
-    _generate_thumbnail(abs_image_path, thumb_path)
-    return thumb_path if thumb_path.is_file() else None
+    size = read_image_size(path)
+    return {
+        "file_size": st.st_size,
+        "file_mtime_ns": st.st_mtime_ns,
+        "width": size[0] if size else None,
+        "height": size[1] if size else None,
+    }
+
+
+# ========== 分批写索引 ==========
+
+# [(file_rel_path, 项目 folder_path, 是否封面, 项目热度), ...]
+ImagesChangedCallback = Callable[[list[tuple[str, str, bool, int]]], None]
+
+
+class _IndexWriter:
+    """
+    把扫描到的项目分批（约 write_chunk_size 张图片或个项目一批）与数据库比对并写入。
+
+    每批只用 Core 查询取出本批项目 / 图片对应的行（紧凑的元组 / 小 dict），
+    不会把整个 Project / Image 表读进内存。跨批需要记住的只有：
+    - 本次见到的项目 id：最后据此找出“数据库里有，但磁盘上已不是项目”的项目；
+    - 本次没扫到的图片 id：它可能只是换到了后面某批的项目里
+      （例如子目录新增了 project.json），所以等全部批次写完再确认删除。
+
+    scope 为相对 MEDIA_ROOT 的目录时（单目录同步），最后清理项目也只在该目录之下进行。
+
+    图片尺寸：新图片、从没读过尺寸的图片，以及 dir_listed(目录) 为 True 的目录
+    （这次重新列出过，里面的文件可能被替换）里的图片，会在线程池里 stat 一次，
+    大小 / mtime 变了才读文件头（见 _probe_image_file）；目录清单判定没变的目录不碰文件。
+    dir_listed 不传表示所有目录都按重新列出处理（单目录同步，以及 restat_images=true 的整库同步：
+    原地覆盖同名文件不会改变目录 mtime，只能逐个 stat 已索引的图片才能发现）。
+
+    缩略图清单（thumbnails 表）随索引一起维护：最后清掉原图已不存在的行
+    （原图有变化的行靠比对大小 / mtime 判定过期，见 thumb_inventory）。
+
+    on_images_changed：每批写完后，用本批新增 / 原图有变化的图片调用一次，参数为
+    [(file_rel_path, 项目 folder_path, 是否封面, 项目热度), ...]（用于后台预生成缩略图）。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        now: datetime,
+        progress: SyncProgress,
+        scope: Optional[str] = None,
+        dir_listed: Optional[Callable[[Path], bool]] = None,
+        on_images_changed: Optional[ImagesChangedCallback] = None,
+    ) -> None:
+        self.db = db
+        self.now = now
+        self.progress = progress
+        self.scope = scope
+        self.dir_listed = dir_listed
+        self.on_images_changed = on_images_changed
+        self._probe_pool: Optional[ThreadPoolExecutor] = None
+
+        self._batch: list[tuple[Path, list[Path], bool]] = []
+        self._batch_images = 0
+        self._seen_project_ids: set[int] = set()
+        self._missing_images: set[int] = set()
+
+        self.counts = {
+            "created_projects": 0,
+            "updated_projects": 0,
+            "deleted_projects": 0,
+            "created_images": 0,
+            "deleted_images": 0,
+        }
+
+    def add(self, project_dir: Path, image_paths: list[Path], meta_changed: bool) -> None:
+        self._batch.append((project_dir, image_paths, meta_changed))
+        self._batch_images += len(image_paths)
+
+    @property
+    def batch_full(self) -> bool:
+        return (
+            self._batch_images >= INDEXER_WRITE_CHUNK_SIZE
+            or len(self._batch) >= INDEXER_WRITE_CHUNK_SIZE
+        )
+
+    def flush(self) -> None:
+        """比对并写入当前这一批项目（每个写库块单独提交）。"""
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_images = self._batch, [], 0
+
+        db = self.db
+        now = self.now
+        progress = self.progress
+        projects_table = models.Project.__table__
+        images_table = models.Image.__table__
+
+        progress.check_cancelled()
+
+        # ---------- 读出本批对应的已有项目 ----------
+        # 相对 MEDIA_ROOT 的文件夹路径，例如：
+        #   "Beal Blanckaert Architectes"
+        #   "体育建筑/某项目"
+        #   "文化建筑/子类/某项目"
+        folders = [project_dir.relative_to(MEDIA_ROOT).as_posix() for project_dir, _, _ in batch]
+
+        existing_projects: dict[str, dict] = {}
+        for chunk in _iter_chunks(folders, INDEXER_WRITE_CHUNK_SIZE):
+            for row in db.execute(
+                select(
+                    projects_table.c.id,
+                    projects_table.c.folder_path,
+                    projects_table.c.cover_rel_path,
+                    projects_table.c.is_meta_locked,
+                    projects_table.c.heat,
+                    *[projects_table.c[k] for k in _PROJECT_META_FIELDS],
+                ).where(projects_table.c.folder_path.in_(chunk))
+            ).mappings():
+                existing_projects[row["folder_path"]] = dict(row)
+
+        # ---------- 在内存里算出项目要写的差异 ----------
+        new_projects: list[dict] = []
+        meta_updates: list[dict] = []
+        cover_updates: list[dict] = []
+
+        # (rel_folder, [(rel_path, file_name), ...])
+        seen_projects: list[tuple[str, list[tuple[str, str]]]] = []
+        # 写完之后各项目的封面 / 热度（交给 on_images_changed 排优先级）
+        project_covers: dict[str, Optional[str]] = {}
+        project_heat: dict[str, int] = {}
+
+        for rel_folder, (project_dir, image_paths, meta_changed) in zip(folders, batch):
+            # 相对 MEDIA_ROOT 的图片路径，例如 "体育建筑/某项目/图1.png"
+            images = [
+                (file_path.relative_to(MEDIA_ROOT).as_posix(), file_path.name)
+                for file_path in image_paths
+            ]
+            seen_projects.append((rel_folder, images))
+
+            # 自动封面：扫描顺序的第一张图（若 None，则表示该项目目前没有图片）
+            first_image_rel_path: Optional[str] = images[0][0] if images else None
+
+            existing = existing_projects.get(rel_folder)
+            if existing is not None and existing["is_meta_locked"]:
+                project_covers[rel_folder] = existing["cover_rel_path"]
+            else:
+                project_covers[rel_folder] = first_image_rel_path
+            project_heat[rel_folder] = (existing["heat"] or 0) if existing is not None else 0
+
+            # project.json 没变过的已有项目：数据库里的 meta 已是最新，跳过解析与比对
+            apply_meta = existing is None or meta_changed
+            if not apply_meta:
+                fields = None
+            else:
+                fields = parse_project_meta(load_project_meta(str(project_dir)), project_dir.name)
+
+            if existing is None:
+                # 新项目：用 project.json 的信息初始化（没有 json 则用默认值）
+                new_projects.append(
+                    {
+                        **fields,
+                        "folder_path": rel_folder,
+                        "cover_rel_path": first_image_rel_path,
+                        "heat": 0,
+                        "is_meta_locked": False,
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                )
+                continue
+
+            # 已有项目：仅在 is_meta_locked=False 时允许被 JSON 覆盖 / 自动调整封面
+            if existing["is_meta_locked"]:
+                continue
+
+            if fields is not None and any(existing[k] != v for k, v in fields.items()):
+                meta_updates.append({**fields, "b_id": existing["id"], "updated_at": now})
+
+            if existing["cover_rel_path"] != first_image_rel_path:
+                cover_updates.append(
+                    {
+                        "b_id": existing["id"],
+                        "cover_rel_path": first_image_rel_path,
+                        "updated_at": now,
+                    }
+                )
+
+        # ---------- 写项目 ----------
+        self.counts["created_projects"] += _bulk_execute(
+            db, insert(projects_table), new_projects, progress
+        )
+
+        project_ids: dict[str, int] = {
+            folder: row["id"] for folder, row in existing_projects.items()
+        }
+        new_folders = [row["folder_path"] for row in new_projects]
+        for chunk in _iter_chunks(new_folders, INDEXER_WRITE_CHUNK_SIZE):
+            for project_id, folder in db.execute(
+                select(projects_table.c.id, projects_table.c.folder_path)
+                .where(projects_table.c.folder_path.in_(chunk))
+            ):
+                project_ids[folder] = project_id
+        self._seen_project_ids.update(project_ids.values())
+
+        self.counts["updated_projects"] += _bulk_execute(
+            db,
+            update(projects_table)
+            .where(projects_table.c.id == bindparam("b_id"))
+            .values({k: bindparam(k) for k in (*_PROJECT_META_FIELDS, "updated_at")}),
+            meta_updates,
+            progress,
+        )
+        _bulk_execute(
+            db,
+            update(projects_table)
+            .where(projects_table.c.id == bindparam("b_id"))
+            .values(
+                cover_rel_path=bindparam("cover_rel_path"),
+                updated_at=bindparam("updated_at"),
+            ),
+            cover_updates,
+            progress,
+        )
+
+        # ---------- 读出本批对应的已有图片 ----------
+        # Image 在全表范围内以 file_rel_path 唯一：
+        # rel_path -> (id, project_id, file_name, file_size, file_mtime_ns)
+        image_columns = (
+            images_table.c.id,
+            images_table.c.file_rel_path,
+            images_table.c.project_id,
+            images_table.c.file_name,
+            images_table.c.file_size,
+            images_table.c.file_mtime_ns,
+        )
+        seen_image_paths = [rel_path for _, images in seen_projects for rel_path, _ in images]
+        existing_images: dict[str, tuple] = {}
+        for chunk in _iter_chunks(seen_image_paths, INDEXER_WRITE_CHUNK_SIZE):
+            for image_id, rel_path, *rest in db.execute(
+                select(*image_columns).where(images_table.c.file_rel_path.in_(chunk))
+            ):
+                existing_images[rel_path] = (image_id, *rest)
+
+        # 本批已有项目名下、但这次没扫到的图片：先记下来，全部批次写完后再确认删除
+        seen_image_set = set(seen_image_paths)
+        old_project_ids = [row["id"] for row in existing_projects.values()]
+        for chunk in _iter_chunks(old_project_ids, INDEXER_WRITE_CHUNK_SIZE):
+            for image_id, rel_path in db.execute(
+                select(images_table.c.id, images_table.c.file_rel_path)
+                .where(images_table.c.project_id.in_(chunk))
+            ):
+                if rel_path not in seen_image_set:
+                    self._missing_images.add(image_id)
+
+        # ---------- 读图片尺寸（只处理新图片 / 可能变过的图片） ----------
+        probe_paths: list[Path] = []
+        probe_known: list[Optional[tuple]] = []
+        for (project_dir, image_paths, _), (_, images) in zip(batch, seen_projects):
+            for file_path, (rel_path, _) in zip(image_paths, images):
+                current = existing_images.get(rel_path)
+                if current is None or current[3] is None:
+                    probe_paths.append(file_path)
+                    probe_known.append(None)
+                elif self.dir_listed is None or self.dir_listed(file_path.parent):
+                    probe_paths.append(file_path)
+                    probe_known.append((current[3], current[4]))
+
+        probed: dict[str, dict] = {}
+        if probe_paths:
+            if self._probe_pool is None:
+                self._probe_pool = ThreadPoolExecutor(
+                    max_workers=max(1, INDEXER_SCAN_WORKERS), thread_name_prefix="caselib-imgsize"
+                )
+            for file_path, info in zip(
+                probe_paths, self._probe_pool.map(_probe_image_file, probe_paths, probe_known)
+            ):
+                if info is not None:
+                    probed[file_path.relative_to(MEDIA_ROOT).as_posix()] = info
+            progress.check_cancelled()
+
+        # ---------- 写图片 ----------
+        image_inserts: list[dict] = []
+        image_updates: list[dict] = []
+        size_updates: list[dict] = []
+        changed_images: list[tuple[str, str, bool, int]] = []
+
+        for rel_folder, images in seen_projects:
+            project_id = project_ids[rel_folder]
+            for rel_path, file_name in images:
+                current = existing_images.get(rel_path)
+                info = probed.get(rel_path)
+                if current is None or info is not None:
+                    changed_images.append(
+                        (
+                            rel_path,
+                            rel_folder,
+                            rel_path == project_covers[rel_folder],
+                            project_heat[rel_folder],
+                        )
+                    )
+                if current is None:
+                    # 这个 file_rel_path 之前从未出现过 → 新建一条 Image
+                    image_inserts.append(
+                        {
+                            "project_id": project_id,
+                            "file_name": file_name,
+                            "file_rel_path": rel_path,
+                            "width": info["width"] if info else None,
+                            "height": info["height"] if info else None,
+                            "file_size": info["file_size"] if info else None,
+                            "file_mtime_ns": info["file_mtime_ns"] if info else None,
+                            "created_at": now,
+                            "updated_at": now,
+                        }
+                    )
+                    continue
+
+                if info is not None:
+                    # 原图是新的或被替换过：记录新的尺寸与大小 / mtime
+                    size_updates.append({**info, "b_id": current[0], "updated_at": now})
+
+                # 之前记成“没扫到”的图片，在这批里被别的项目认领了
+                self._missing_images.discard(current[0])
+                if current[1] != project_id or current[2] != file_name:
+                    # 已经有这个路径的记录 → 更新归属项目、文件名与更新时间
+                    image_updates.append(
+                        {
+                            "b_id": current[0],
+                            "project_id": project_id,
+                            "file_name": file_name,
+                            "updated_at": now,
+                        }
+                    )
+
+        self.counts["created_images"] += _bulk_execute(
+            db, insert(images_table), image_inserts, progress
+        )
+        _bulk_execute(
+            db,
+            update(images_table)
+            .where(images_table.c.id == bindparam("b_id"))
+            .values(
+                project_id=bindparam("project_id"),
+                file_name=bindparam("file_name"),
+                updated_at=bindparam("updated_at"),
+            ),
+            image_updates,
+            progress,
+        )
+        _bulk_execute(
+            db,
+            update(images_table)
+            .where(images_table.c.id == bindparam("b_id"))
+            .values(
+                width=bindparam("width"),
+                height=bindparam("height"),
+                file_size=bindparam("file_size"),
+                file_mtime_ns=bindparam("file_mtime_ns"),
+                # 原图变了：加载占位跟着缩略图重新生成
+                placeholder=None,
+                dominant_color=None,
+                updated_at=bindparam("updated_at"),
+            ),
+            size_updates,
+            progress,
+        )
+
+        # 原图有变化时缩略图清单不用动：清单里记着生成时的原图大小 / mtime，
+        # 和上面刚写入的新值对不上，查清单时就当作过期（见 thumb_inventory.discard_stale_thumbnails）
+
+        if self.on_images_changed is not None and changed_images:
+            try:
+                self.on_images_changed(changed_images)
+            except Exception:
+                logger.exception("on_images_changed 回调失败")
+
+    def close(self) -> None:
+        if self._probe_pool is not None:
+            self._probe_pool.shutdown(wait=True)
+            self._probe_pool = None
+
+    def finish(self) -> dict:
+        """写完最后一批，清理这次没扫到的图片和已不存在的项目，返回各项计数。"""
+        self.flush()
+
+        db = self.db
+        progress = self.progress
+        progress.check_cancelled()
+        progress.phase = "cleanup"
+        projects_table = models.Project.__table__
+        images_table = models.Image.__table__
+
+        # === 清理“数据库里有，但这次扫盘没找到”的图片 ===
+        # 记下之后又被后面批次的项目认领的图片，已在 flush 里移出 _missing_images
+        self.counts["deleted_images"] += _bulk_delete_in(
+            db, images_table, images_table.c.id, sorted(self._missing_images), progress
+        )
+        self._missing_images.clear()
+
+        # === 清理“数据库里有，但磁盘没有目录或已不再被视为项目目录”的项目 ===
+        # 1）磁盘上目录已经不存在
+        # 2）目录还在，但这次扫描没有把它识别为项目目录（旧版本遗留的“幽灵项目”）
+        # 两种情况这次扫描都不会产出它，无需再逐个 stat
+        query = select(projects_table.c.id, projects_table.c.folder_path)
+        if self.scope is not None:
+            query = query.where(
+                (projects_table.c.folder_path == self.scope)
+                | projects_table.c.folder_path.startswith(self.scope + "/", autoescape=True)
+            )
+        stale_project_ids = [
+            project_id
+            for project_id, folder_path in db.execute(
+                query.execution_options(yield_per=INDEXER_WRITE_CHUNK_SIZE)
+            )
+            # SQLite 的 LIKE 不区分 ASCII 大小写，这里再按前缀精确过滤一遍
+            if project_id not in self._seen_project_ids and _in_scope(folder_path, self.scope)
+        ]
+
+        # 与 ORM 上 Project 的级联删除保持一致：图片、点击记录、标签关联一并删除
+        self.counts["deleted_images"] += _bulk_delete_in(
+            db, images_table, images_table.c.project_id, stale_project_ids, progress
+        )
+        _bulk_delete_in(
+            db,
+            models.ProjectClick.__table__,
+            models.ProjectClick.__table__.c.project_id,
+            stale_project_ids,
+            progress,
+        )
+        _bulk_delete_in(
+            db, models.project_tags, models.project_tags.c.project_id, stale_project_ids, progress
+        )
+        self.counts["deleted_projects"] += _bulk_delete_in(
+            db, projects_table, projects_table.c.id, stale_project_ids, progress
+        )
+
+        # === 缩略图清单：原图已不在索引里的行一并清掉 ===
+        thumbs_table = models.Thumbnail.__table__
+        stmt = delete(thumbs_table).where(
+            ~exists().where(images_table.c.file_rel_path == thumbs_table.c.file_rel_path)
+        )
+        if self.scope is not None:
+            stmt = stmt.where(
+                thumbs_table.c.file_rel_path.startswith(self.scope + "/", autoescape=True)
+            )
+        db.execute(stmt)
+        db.commit()
+
+        return dict(self.counts)
+
+
+# ========== 整库流式扫盘（配合目录清单） ==========
+
+class _StreamingScan:
+    """
+    sync_from_fs 用的流式目录探测，作为 _walk_projects 的 open_dir / close_dir：
+
+    - 进入一个目录时，用一条 IN 查询取出它所有子目录的清单行，并把子目录的探测
+      （stat / listdir，见 _probe_dir）提前派发到有界线程池里；
+      同时在途的探测只有“当前路径上各目录的子目录”，不会随库的大小增长；
+    - 清单的增量规则与 collect_dir_info 相同（_merge_probe）；
+    - 目录的子树处理完后，它的清单行进入待保存队列，由调用方在本批索引写库之后 save_manifest，
+      不会出现“清单已记为没变、索引却没更新”的情况；
+    - 重新列出的目录少了子目录时，删掉那些子目录（含子树）的清单行；
+      full=True 时所有目录都会重写，最后再删掉这次没访问到的旧行。
+
+    use_manifest=False 时完全不读写目录清单（单目录同步用）：每个目录都直接 listdir，
+    meta_changed 恒为 True，dir_listed 恒为 True。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        root: Path,
+        full: bool,
+        stats: dict,
+        progress: SyncProgress,
+        now: datetime,
+        workers: Optional[int] = None,
+        use_manifest: bool = True,
+    ) -> None:
+        self.db = db
+        self.root = root.resolve()
+        self.full = full
+        self.use_manifest = use_manifest
+        self.stats = stats
+        self.progress = progress
+        self.now = now
+        self.root_listed = False
+
+        stats.setdefault("dirs_listed", 0)
+        stats.setdefault("dirs_cached", 0)
+
+        if workers is None:
+            workers = INDEXER_SCAN_WORKERS
+        workers = max(1, int(workers))
+        self._pool = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="caselib-scan")
+            if workers > 1
+            else None
+        )
+        self._futures: dict[Path, Future] = {}
+        # 已取出清单行、但子树还没处理完的目录（不用清单时值为 None）
+        self._rows: dict[Path, Optional[dict]] = {}
+        # 子树已处理完、等待落库的清单行 / 已消失的子目录
+        self._ready_rows: dict[Path, dict] = {}
+        self._removed_dirs: list[str] = []
+
+    @property
+    def manifest_full(self) -> bool:
+        return len(self._ready_rows) >= INDEXER_WRITE_CHUNK_SIZE
+
+    def close(self) -> None:
+        """取消还没开始的探测（取消 / 出错时别让线程池把剩下的目录都列完）。"""
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def _probe_args(self, path: Path, row: Optional[dict]) -> tuple:
+        if row is None:
+            return (path, False, None, False)
+        if self.full or row["id"] is None:
+            return (path, True, None, False)
+        return (path, True, row["dir_mtime_ns"], bool(row["has_project_json"]))
+
+    def _prefetch(self, paths: list[Path]) -> None:
+        if not self.use_manifest:
+            for path in paths:
+                self._rows[path] = None
+                if self._pool is not None:
+                    self._futures[path] = self._pool.submit(_probe_dir, *self._probe_args(path, None))
+            return
+
+        table = models.FsDirManifest.__table__
+        rels = [path.relative_to(MEDIA_ROOT).as_posix() for path in paths]
+
+        found: dict[str, dict] = {}
+        for chunk in _iter_chunks(rels, INDEXER_WRITE_CHUNK_SIZE):
+            for row in self.db.execute(
+                select(table).where(table.c.rel_path.in_(chunk))
+            ).mappings():
+                found[row["rel_path"]] = dict(row)
+
+        for path, rel in zip(paths, rels):
+            row = found.get(rel) or _new_manifest_row(rel)
+            self._rows[path] = row
+            if self._pool is not None:
+                self._futures[path] = self._pool.submit(_probe_dir, *self._probe_args(path, row))
+
+    def open_dir(self, path: Path) -> Optional[dict]:
+        if path == self.root:
+            self._prefetch([path])
+
+        self.progress.check_cancelled()
+        self.progress.dirs_scanned += 1
+
+        row = self._rows[path]
+        future = self._futures.pop(path, None)
+        result = future.result() if future is not None else _probe_dir(*self._probe_args(path, row))
+
+        if result["error"] is not None:
+            logger.warning("无法访问目录，跳过 (%s): %s", path, result["error"])
+            del self._rows[path]
+            return None
+
+        old_subdirs = row.get("subdirs") if row is not None and row["id"] is not None else None
+        subdirs, image_names, has_project_json, meta_changed = _merge_probe(
+            result, row, self.full, self.now, self.stats
+        )
+
+        if old_subdirs is not None and result["listing"] is not None:
+            rel = row["rel_path"]
+            for name in set(json.loads(old_subdirs or "[]")) - set(subdirs):
+                self._removed_dirs.append(name if rel == "." else f"{rel}/{name}")
+
+        children = [path / d for d in subdirs]
+        if children:
+            self._prefetch(children)
+
+        if path == self.root:
+            self.root_listed = True
+
+        return {
+            "has_project_json": has_project_json,
+            "has_image_here": bool(image_names),
+            "image_names": image_names,
+            "children": children,
+            "meta_changed": meta_changed,
+        }
+
+    def close_dir(self, path: Path) -> None:
+        row = self._rows.pop(path)
+        if row is not None and row.get("_dirty"):
+            self._ready_rows[path] = row
+
+    def dir_listed(self, path: Path) -> bool:
+        """
+        本次是否重新列出过该目录（目录 mtime 变了，里面的文件可能被替换）。
+        只对还没 save_manifest 的目录有效，正好覆盖当前写库批次里项目的所有目录。
+        """
+        if not self.use_manifest:
+            return True
+        row = self._rows.get(path) or self._ready_rows.get(path)
+        return bool(row and row.get("_listed"))
+
+    def save_manifest(self, final: bool = False) -> None:
+        """
+        把子树已处理完的目录清单行写回数据库（分块 executemany，逐块提交）。
+        必须在这些目录里的项目写完索引之后调用；final=True 时（整次扫描完成）顺带清理旧行。
+        """
+        if not self.use_manifest:
+            return
+        db = self.db
+        progress = self.progress
+        table = models.FsDirManifest.__table__
+        columns = [c.name for c in table.columns if c.name != "id"]
+
+        inserts = []
+        updates = []
+        for entry in self._ready_rows.values():
+            values = {c: entry.get(c) for c in columns}
+            if entry.get("id") is None:
+                inserts.append(values)
+            else:
+                values["b_id"] = entry["id"]
+                updates.append(values)
+        self._ready_rows = {}
+
+        _bulk_execute(db, insert(table), inserts, progress)
+        _bulk_execute(
+            db,
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values({c: bindparam(c) for c in columns}),
+            updates,
+            progress,
+        )
+
+        # 已经消失的目录：连同子树的清单行一起删
+        for rel in self._removed_dirs:
+            db.execute(
+                delete(table).where(
+                    (table.c.rel_path == rel)
+                    | table.c.rel_path.startswith(rel + "/", autoescape=True)
+                )
+            )
+        self._removed_dirs = []
+
+        if final and self.full:
+            # 全量模式下访问到的目录都已重写（scanned_at = 本次开始时间），剩下的都是旧行
+            db.execute(delete(table).where(table.c.scanned_at < self.now))
+        db.commit()
 
 
 # ========== 主同步逻辑（扫盘 + 更新数据库 + 清理幽灵项目） ==========
-def sync_from_fs(db: Session) -> None:
+def sync_from_fs(
+    db: Session,
+    full: bool = False,
+    progress: Optional[SyncProgress] = None,
+    on_images_changed: Optional[ImagesChangedCallback] = None,
+) -> Optional[dict]:
     """
     从 MEDIA_ROOT（配置的案例库根目录）下扫描文件系统，同步到数据库。
+    返回各项计数（created_projects / deleted_images 等，同 sync_folder）；
+    案例库根目录不存在或列不出来、因而放弃同步时返回 None。
+
+    默认是增量模式（目录清单 fs_dir_manifest，规则同 collect_dir_info）：
+    - mtime 未变的目录直接复用清单中缓存的列表，不再 listdir；
+    - project.json 的 mtime / 大小未变时不重新解析，已有项目的 meta 保持数据库中的值；
+    - 已索引的图片逐个 stat（线程池并发），大小 / mtime 变了才读文件头，
+      原地覆盖同名文件（目录 mtime 不变）也能发现；restat_images=false 时只检查重新列出的目录。
+    full=True 时忽略目录清单，完整重扫并重新解析所有 project.json（用于修复索引）。
+
+    progress（可选）用于向后台任务汇报阶段 / 计数，并支持取消：
+    取消时抛出 SyncCancelled，已提交的写库块保留，尚未落库的目录清单下次会重新列出，自然补齐。
+
+    on_images_changed（可选）每批写完后收到新增 / 原图有变化的图片（见 _IndexWriter），
+    用于把它们交给后台缩略图预生成。
 
     关键规则：
 
-    - 以 PROJECTS_ROOT 为根目录，递归查找“项目目录”（见 iter_project_dirs）：
+    - 以 PROJECTS_ROOT 为根目录，单次遍历查找“项目目录”并收集其图片（见 scan_projects）：
       · 有 project.json 的目录 → 必然是一个项目；
       · 否则，仅“叶子图片目录”作为项目；
       · 名为 `_thumbs` 的目录及其子目录被完全跳过。
@@ -282,6 +1617,14 @@ def sync_from_fs(db: Session) -> None:
         （按扫描顺序第一张），写入 Project.cover_rel_path；
       · 若项目已锁定，则保留原有 cover_rel_path，不被索引器覆盖。
 
+    - 流式处理，内存与库的大小无关（百万张图片的库也一样）：
+      · 边扫边产出项目（_walk_projects），目录清单按需逐目录读取（_StreamingScan），
+        内存里只有当前路径上的目录和正在拼装的项目；
+      · 项目攒够约 write_chunk_size 张图片就比对写入一批（_IndexWriter），
+        只查询这一批对应的行，用 Core 的 executemany 与 DELETE ... WHERE id IN (...) 写入，
+        每块单独提交，不会长时间占住 SQLite 写锁、卡住点击 / 收藏等请求；
+      · 峰值内存大致取决于最大的单个项目，外加本次见到的项目 id 集合。
+
     注意：本函数 **不生成缩略图**。
           缩略图统一通过 /thumbs 路由等“按需生成”，避免在全库同步时给文件服务器造成压力。
     """
@@ -289,230 +1632,264 @@ def sync_from_fs(db: Session) -> None:
         logger.warning("PROJECTS_ROOT 不存在: %s", PROJECTS_ROOT)
         return
 
+    if progress is None:
+        progress = SyncProgress()
+
     now = datetime.utcnow()
 
-    # 先把已有项目按 folder_path 建索引，避免重复插入
-    existing_projects: dict[str, models.Project] = {
-        p.folder_path: p for p in db.query(models.Project).all()
-    }
+    # 扫盘与写库交替进行：每攒够一批就写入，写完这批再保存对应目录的清单
+    progress.phase = "scanning"
+    scan_stats: dict = {}
+    scan = _StreamingScan(db, PROJECTS_ROOT, full, scan_stats, progress, now)
+    writer = _IndexWriter(
+        db,
+        now,
+        progress,
+        # restat_images：已索引的图片每次都 stat 一遍，原地覆盖的文件也能发现
+        dir_listed=None if INDEXER_RESTAT_IMAGES else scan.dir_listed,
+        on_images_changed=on_images_changed,
+    )
+    try:
+        for project_dir, image_paths, meta_changed in _walk_projects(
+            scan.root, scan.open_dir, scan.close_dir
+        ):
+            progress.images_seen += len(image_paths)
+            writer.add(project_dir, image_paths, meta_changed)
+            if writer.batch_full or scan.manifest_full:
+                writer.flush()
+                scan.save_manifest()
+
+        if not scan.root_listed:
+            # 根目录都列不出来（共享盘断开等），不能据此把整个索引当成“已删除”
+            logger.warning("无法列出 PROJECTS_ROOT，放弃本次同步: %s", PROJECTS_ROOT)
+            return
+
+        counts = writer.finish()
+    finally:
+        scan.close()
+        writer.close()
+
+    # 目录清单最后落库：中途失败时清单保持旧值，下次会重新列这些目录
+    scan.save_manifest(final=True)
+    progress.phase = "done"
 
-    # ❗ 新增：把已有图片按 file_rel_path 建一个“全局索引”，一库只允许一条
-    existing_images_by_path: dict[str, models.Image] = {
-        img.file_rel_path: img for img in db.query(models.Image).all()
-    }
+    logger.info(
+        "sync_from_fs 完成（%s）: 列目录 %d, 复用清单 %d; "
+        "新增项目 %d, 更新项目 %d, 删除项目 %d; 新增图片 %d, 删除图片 %d",
+        "全量" if full else "增量",
+        scan_stats.get("dirs_listed", 0),
+        scan_stats.get("dirs_cached", 0),
+        counts["created_projects"],
+        counts["updated_projects"],
+        counts["deleted_projects"],
+        counts["created_images"],
+        counts["deleted_images"],
+    )
+    return counts
 
-    # 统计信息，方便排查问题
-    created_projects = 0
-    updated_projects = 0
-    deleted_projects = 0
-    created_images = 0
-    deleted_images = 0
 
-    # 记录这次扫描到的“实际存在的项目目录”（相对 MEDIA_ROOT 的 folder_path）
-    seen_folders: set[str] = set()
+# ========== 单目录局部同步（导入 / 拖拽上传后调用） ==========
 
-    # ❗ 新增：记录这次扫描到的所有图片 file_rel_path，用于后面全局清理“幽灵图片”
-    seen_image_paths: set[str] = set()
+def normalize_folder_path(folder_path: str) -> str:
+    """
+    把前端 / 导入任务传来的目录规范成相对 MEDIA_ROOT 的 posix 路径（根目录为 "."）。
+    路径越出 MEDIA_ROOT 时抛 ValueError。
+    """
+    raw = (folder_path or "").replace("\\", "/").strip().strip("/")
+    abs_path = (MEDIA_ROOT / raw).resolve() if raw else MEDIA_ROOT
+    try:
+        return abs_path.relative_to(MEDIA_ROOT).as_posix()
+    except ValueError:
+        raise ValueError(f"目录不在案例库根目录下: {folder_path}")
+
+
+def _nearest_db_ancestor_project(db: Session, rel: str) -> Optional[str]:
+    """数据库里离 rel 最近的“上层项目”（不含 rel 自身）的 folder_path。"""
+    parts = rel.split("/")
+    candidates = ["/".join(parts[:i]) for i in range(len(parts) - 1, 0, -1)]
+    if not candidates:
+        return None
+    projects_table = models.Project.__table__
+    found = set(
+        db.execute(
+            select(projects_table.c.folder_path).where(
+                projects_table.c.folder_path.in_(candidates)
+            )
+        ).scalars()
+    )
+    for candidate in candidates:
+        if candidate in found:
+            return candidate
+    return None
+
+
+def _has_db_projects_under(db: Session, rel: str) -> bool:
+    projects_table = models.Project.__table__
+    rows = db.execute(
+        select(projects_table.c.folder_path).where(
+            (projects_table.c.folder_path == rel)
+            | projects_table.c.folder_path.startswith(rel + "/", autoescape=True)
+        )
+    ).scalars()
+    return any(_in_scope(row, rel) for row in rows)
+
+
+def _first_project_under(
+    db: Session,
+    root: Path,
+    progress: SyncProgress,
+    now: datetime,
+) -> Optional[Path]:
+    """
+    流式遍历 root，返回最先产出的项目目录（子项目先于上层产出），没有项目时返回 None。
+    找到一个就停；root 不存在时返回 None，存在却列不出来时抛 OSError。
+    root 自身不带 project.json 时，返回值等于 root 当且仅当 root 是项目（叶子图片目录）。
+    """
+    if not root.is_dir():
+        return None
+    scan = _StreamingScan(db, root, True, {}, progress, now, use_manifest=False)
+    try:
+        for project_dir, _, _ in _walk_projects(scan.root, scan.open_dir, scan.close_dir):
+            return project_dir
+        if not scan.root_listed:
+            raise OSError(f"无法列出目录: {root}")
+        return None
+    finally:
+        scan.close()
+
+
+def sync_folder(
+    db: Session,
+    folder_path: str,
+    progress: Optional[SyncProgress] = None,
+    on_images_changed: Optional[ImagesChangedCallback] = None,
+) -> dict:
+    """
+    只重新同步某个目录（相对 MEDIA_ROOT）的子树：项目识别、图片、封面、project.json 元数据
+    与 sync_from_fs 规则完全一致，但只读写该目录之下的项目 / 图片行，
+    用于 Web 导入、拖拽上传或手动往某个项目里拷图之后，让新图片立刻可见。
+
+    项目识别只取决于目录自身的子树，但图片归属、上层目录是否算项目会受到上层影响，
+    所以同步范围会按需向上扩大，直到局部结果与整库同步一致：
+    - 子树里一个项目都没有（例如只是往项目的子目录里加图）→ 扩大到最近的上层项目；
+      没有上层项目、数据库里该目录下也没有项目时什么都不用改，直接返回；
+      否则扩大到父目录（父目录可能因此重新成为“叶子图片目录”项目）；
+    - 目录自身不是项目、但上面有项目 → 扩大到那个上层项目（图片归它）；
+    - 目录是项目、而上层项目没有 project.json → 扩大到上层项目（它可能因此不再是叶子项目）。
+
+    判断范围（resolve_folder_scope）和写库（sync_folder_scope）都走与 sync_from_fs 相同的流式路径
+    （_walk_projects + _IndexWriter），范围扩大到很大的上层目录甚至整个库时，内存也与子树大小无关。
+    不更新 fs_dir_manifest：变过的目录 mtime 已经变了，下次增量同步会自然重新列出。
+
+    返回各项计数，以及实际同步的范围 folder_path（"." 表示整个库）。
+    """
+    if progress is None:
+        progress = SyncProgress()
+
+    scope = resolve_folder_scope(db, folder_path, progress)
+    if scope is None:
+        progress.phase = "done"
+        return {
+            "folder_path": normalize_folder_path(folder_path),
+            "created_projects": 0,
+            "updated_projects": 0,
+            "deleted_projects": 0,
+            "created_images": 0,
+            "deleted_images": 0,
+        }
+    return sync_folder_scope(db, scope, progress, on_images_changed)
 
-    # 先算出所有项目目录列表，供后续图片扫描时用来排除子项目目录
-    project_dirs = list(iter_project_dirs(PROJECTS_ROOT))
 
-    # 遍历所有项目目录（支持多级目录，遵从“叶子图片目录”规则）
-    for project_dir in project_dirs:
-        if not project_dir.is_dir():
+def resolve_folder_scope(
+    db: Session, folder_path: str, progress: Optional[SyncProgress] = None
+) -> Optional[str]:
+    """
+    sync_folder 实际要同步的范围（相对 MEDIA_ROOT，"." 表示整个库，规则见 sync_folder）；
+    什么都不用改时返回 None。folder_path 越出案例库根目录时抛 ValueError。
+    """
+    if progress is None:
+        progress = SyncProgress()
+
+    scope = normalize_folder_path(folder_path)
+    now = datetime.utcnow()
+
+    # 只需要知道“子树里有没有项目”“目录自身是不是项目”，
+    # 都用流式遍历、找到第一个项目就停，不把子树读进内存
+    progress.phase = "scanning"
+    while scope != ".":
+        scope_abs = MEDIA_ROOT / scope
+        ancestor = _nearest_db_ancestor_project(db, scope)
+
+        if ancestor is not None:
+            if (MEDIA_ROOT / ancestor / PROJECT_META_NAME).is_file() and (
+                (scope_abs / PROJECT_META_NAME).is_file()
+                or _first_project_under(db, scope_abs, progress, now) == scope_abs.resolve()
+            ):
+                break
+            scope = ancestor
             continue
 
-        # 相对 MEDIA_ROOT 的文件夹路径，例如：
-        #   "Beal Blanckaert Architectes"
-        #   "体育建筑/某项目"
-        #   "文化建筑/子类/某项目"
-        rel_folder = project_dir.relative_to(MEDIA_ROOT).as_posix()
-        seen_folders.add(rel_folder)
-
-        # === 从 project.json 读取项目信息（如果有） ===
-        meta = load_project_meta(str(project_dir))
-
-        meta_name = project_dir.name
-        meta_architect = None
-        meta_location = None
-        meta_category = None
-        meta_year = None
-        meta_description = None
-        meta_order = None
-
-        if isinstance(meta, dict):
-            # 优先使用 meta 节点，没有则退回旧版平铺结构
-            src = meta.get("meta")
-            if not isinstance(src, dict):
-                src = meta
-
-            name_val = src.get("name")
-            arch_val = src.get("architect")
-            loc_val = src.get("location")
-            cat_val = src.get("category")
-            year_val = src.get("year")
-            desc_val = src.get("description")
-
-            if isinstance(name_val, str) and name_val.strip():
-                meta_name = name_val.strip()
-            if isinstance(arch_val, str) and arch_val.strip():
-                meta_architect = arch_val.strip()
-            if isinstance(loc_val, str) and loc_val.strip():
-                meta_location = loc_val.strip()
-            if isinstance(cat_val, str) and cat_val.strip():
-                meta_category = cat_val.strip()
-            if isinstance(desc_val, str) and desc_val.strip():
-                meta_description = desc_val.strip()
-            if year_val is not None:
-                try:
-                    meta_year = int(year_val)
-                except (TypeError, ValueError):
-                    meta_year = None
-
-            display = meta.get("display")
-            if isinstance(display, dict):
-                order_val = display.get("order")
-                if isinstance(order_val, int):
-                    meta_order = order_val
-
-        effective_name = meta_name
-        effective_architect = meta_architect
-
-        # === 新建或更新 Project ===
-        project = existing_projects.get(rel_folder)
-        is_new_project = project is None
-
-        if is_new_project:
-            # 新项目：用 project.json 的信息初始化（没有 json 则用默认值）
-            project = models.Project(
-                name=effective_name,
-                folder_path=rel_folder,
-                architect=effective_architect,
-                location=meta_location,
-                category=meta_category,
-                year=meta_year,
-                description=meta_description,
-                display_order=meta_order,
-                created_at=now,
-                updated_at=now,
-            )
-            db.add(project)
-            db.flush()  # 立刻拿到 project.id
-            existing_projects[rel_folder] = project
-            created_projects += 1
-        else:
-            # 已有项目：仅在 is_meta_locked=False 时允许被 JSON 覆盖
-            changed = False
-            if not getattr(project, "is_meta_locked", False):
-                if project.name != effective_name:
-                    project.name = effective_name
-                    changed = True
-
-                if getattr(project, "architect", None) != effective_architect:
-                    project.architect = effective_architect
-                    changed = True
-
-                if getattr(project, "location", None) != meta_location:
-                    project.location = meta_location
-                    changed = True
-
-                if getattr(project, "category", None) != meta_category:
-                    project.category = meta_category
-                    changed = True
-
-                if getattr(project, "year", None) != meta_year:
-                    project.year = meta_year
-                    changed = True
-
-                if getattr(project, "description", None) != meta_description:
-                    project.description = meta_description
-                    changed = True
-
-                if getattr(project, "display_order", None) != meta_order:
-                    project.display_order = meta_order
-                    changed = True
-
-            if changed:
-                project.updated_at = now
-                updated_projects += 1
-
-        # === 同步图片（⚠ 这里开始是关键修改） ===
-        # 不再按项目单独查 Image，而是用上面构建好的 existing_images_by_path 做“全局去重”
-        first_image_rel_path: Optional[str] = None
-
-        # 遍历这个项目目录下的所有图片（递归，跳过 _thumbs，并跳过子项目目录）
-        for file_path in iter_image_files(project_dir, project_dirs):
-            # 相对 MEDIA_ROOT 的路径，例如：
-            #   "Beal Blanckaert Architectes/xxx.jpg"
-            #   "体育建筑/某项目/图1.png"
-            rel_path = file_path.relative_to(MEDIA_ROOT).as_posix()
-            file_name = file_path.name
-
-            # 记录这次全局扫描里确实存在的图片路径
-            seen_image_paths.add(rel_path)
-
-            if first_image_rel_path is None:
-                first_image_rel_path = rel_path
-
-            img = existing_images_by_path.get(rel_path)
-            if img is None:
-                # 这个 file_rel_path 之前从未出现过 → 新建一条 Image
-                img = models.Image(
-                    project_id=project.id,
-                    file_name=file_name,
-                    file_rel_path=rel_path,
-                    created_at=now,
-                    updated_at=now,
-                )
-                db.add(img)
-                existing_images_by_path[rel_path] = img
-                created_images += 1
-            else:
-                # 已经有这个路径的记录 → 更新归属项目、文件名与更新时间
-                changed_img = False
-                if img.project_id != project.id:
-                    img.project_id = project.id
-                    changed_img = True
-                if img.file_name != file_name:
-                    img.file_name = file_name
-                    changed_img = True
-                if changed_img:
-                    img.updated_at = now
-
-        # === 自动封面逻辑（仅未锁定项目） ===
-        if not getattr(project, "is_meta_locked", False):
-            # 仅在未锁定时才允许自动调整封面
-            old_cover = getattr(project, "cover_rel_path", None)
-            new_cover = first_image_rel_path  # 若 None，则表示该项目目前没有图片
-
-            if old_cover != new_cover:
-                project.cover_rel_path = new_cover
-                project.updated_at = now
-
-    # === 全局清理“数据库里有，但这次扫盘没找到”的图片 ===
-    # 这里按 file_rel_path 维度统一清理，防止“幽灵图片”残留
-    for rel_path, img in list(existing_images_by_path.items()):
-        if rel_path not in seen_image_paths:
-            db.delete(img)
-            deleted_images += 1
-
-    # === 清理“数据库里有，但磁盘没有目录或已不再被视为项目目录”的项目 ===
-    for folder_path, project in list(existing_projects.items()):
-        # folder_path 是相对 MEDIA_ROOT 的路径，例如 "体育建筑/某项目"
-        project_dir = (MEDIA_ROOT / folder_path).resolve()
-        # 1）磁盘上目录已经不存在
-        # 2）目录还在，但这次扫描没有把它识别为项目目录（旧版本遗留的“幽灵项目”）
-        if (not project_dir.exists()) or (folder_path not in seen_folders):
-            db.delete(project)
-            deleted_projects += 1
+        if _first_project_under(db, scope_abs, progress, now) is not None:
+            break
+        if not _has_db_projects_under(db, scope):
+            return None
+        scope = scope.rpartition("/")[0] or "."
+    return scope
+
+
+def sync_folder_scope(
+    db: Session,
+    scope: str,
+    progress: Optional[SyncProgress] = None,
+    on_images_changed: Optional[ImagesChangedCallback] = None,
+) -> dict:
+    """按 resolve_folder_scope 确定的范围同步（见 sync_folder），返回值同 sync_folder。"""
+    if progress is None:
+        progress = SyncProgress()
+    now = datetime.utcnow()
 
+    # 再按整库同步的方式边扫边写（_walk_projects + _IndexWriter），只是不读写目录清单
+    scope_abs = MEDIA_ROOT if scope == "." else MEDIA_ROOT / scope
+    # 目录已被删除时不扫描：子树里的项目 / 图片都应清掉
+    scan = (
+        _StreamingScan(db, scope_abs, True, {}, progress, now, use_manifest=False)
+        if scope_abs.is_dir()
+        else None
+    )
+    writer = _IndexWriter(
+        db,
+        now,
+        progress,
+        scope=None if scope == "." else scope,
+        on_images_changed=on_images_changed,
+    )
+    try:
+        if scan is not None:
+            for project_dir, image_paths, meta_changed in _walk_projects(
+                scan.root, scan.open_dir, scan.close_dir
+            ):
+                progress.images_seen += len(image_paths)
+                writer.add(project_dir, image_paths, meta_changed)
+                if writer.batch_full:
+                    writer.flush()
+            if not scan.root_listed:
+                # 目录存在却列不出来（共享盘断开等），不能据此删除它下面的索引
+                raise OSError(f"无法列出目录: {scope_abs}")
+        counts = writer.finish()
+    finally:
+        if scan is not None:
+            scan.close()
+        writer.close()
     db.commit()
+    progress.phase = "done"
 
     logger.info(
-        "sync_from_fs 完成: 新增项目 %d, 更新项目 %d, 删除项目 %d; 新增图片 %d, 删除图片 %d",
-        created_projects,
-        updated_projects,
-        deleted_projects,
-        created_images,
-        deleted_images,
+        "sync_folder 完成（%s）: 新增项目 %d, 更新项目 %d, 删除项目 %d; 新增图片 %d, 删除图片 %d",
+        scope,
+        counts["created_projects"],
+        counts["updated_projects"],
+        counts["deleted_projects"],
+        counts["created_images"],
+        counts["deleted_images"],
     )
+    return {"folder_path": scope, **counts}
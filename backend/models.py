@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Table
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Boolean, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -103,10 +103,21 @@ class Image(Base):
     #   "体育建筑/项目名/xxx.jpg"
     file_rel_path = Column(String, unique=True, nullable=False)
 
+    # 图片尺寸（像素，已按 EXIF 方向转正，即浏览器显示时的宽高），
+    # 索引时只读文件头得到；读不出来时为 None
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
     tags = Column(String, nullable=True)
 
+    # 读取尺寸时原图的大小 / mtime（纳秒）：两者都没变就不再重新读文件头
+    file_size = Column(BigInteger, nullable=True)
+    file_mtime_ns = Column(BigInteger, nullable=True)
+
+    # 加载占位（见 thumb_placeholders）：十几像素的小预览（data: URI）和主色调（#rrggbb），
+    # 生成缩略图时顺带算出；原图变化时清空，还没算出来时为 None
+    placeholder = Column(String, nullable=True)
+    dominant_color = Column(String, nullable=True)
+
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(
         DateTime,
@@ -176,3 +187,89 @@ class Tag(Base):
         secondary="project_tags",
         back_populates="tags",
     )
+
+
+class FsDirManifest(Base):
+    """
+    增量扫盘用的目录清单（每个被扫描过的目录一行）：
+
+    - dir_mtime_ns / entry_count：上次列目录时该目录的 mtime 与条目数；
+      mtime 没变就直接复用下面缓存的列表，不再对共享盘发起 listdir；
+    - subdirs / image_files：上次列出的子目录名、图片文件名（JSON 数组，已排除 `_thumbs`）；
+    - meta_mtime_ns / meta_size：目录下 project.json 的 mtime 与大小，
+      两者都没变时 sync 不再重新解析 project.json。
+    """
+
+    __tablename__ = "fs_dir_manifest"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    # 相对 MEDIA_ROOT 的目录路径（posix 风格），根目录为 "."
+    rel_path = Column(String, unique=True, index=True, nullable=False)
+
+    dir_mtime_ns = Column(BigInteger, nullable=True)
+    entry_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    subdirs = Column(Text, nullable=False, default="[]", server_default="[]")
+    image_files = Column(Text, nullable=False, default="[]", server_default="[]")
+
+    has_project_json = Column(Boolean, nullable=False, default=False)
+    meta_mtime_ns = Column(BigInteger, nullable=True)
+    meta_size = Column(BigInteger, nullable=True)
+
+    scanned_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Thumbnail(Base):
+    """
+    缩略图清单：生成缩略图时记一行，/thumbs 命中清单时直接发送文件，
+    不再每次请求都 resolve / is_file / Pillow verify。
+
+    - 记下生成时原图的版本（大小 / mtime）：和索引里的现值对不上就是原图被替换过，
+      查清单时当作没有、删掉旧缩略图重新生成（比对数字，不用解码文件，见 thumb_inventory）；
+    - 同步时清理：原图已被删除的行（见 indexer._IndexWriter）；
+    - 完整性检查（Pillow verify）挪到后台定期进行，verified_at 记录最近一次检查时间。
+
+    一张原图可以有多个版本（尺寸档位 / 格式，见 thumb_renditions），每个版本一行。
+    """
+
+    __tablename__ = "thumbnails"
+    __table_args__ = (UniqueConstraint("file_rel_path", "variant"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    # 原图相对 MEDIA_ROOT 的路径（即 Image.file_rel_path）
+    file_rel_path = Column(String, index=True, nullable=False)
+
+    # 版本名："" 为默认档位的原格式缩略图，其余如 "w400.webp"
+    variant = Column(String, nullable=False, default="", server_default="")
+
+    # 缩略图相对 MEDIA_ROOT 的路径，例如 "体育建筑/某项目/_thumbs/图片/01.jpg.w400.webp"
+    thumb_rel_path = Column(String, nullable=False)
+
+    # 生成时缩略图文件的大小（字节），完整性检查时用来发现被截断 / 替换的文件
+    thumb_size = Column(BigInteger, nullable=True)
+
+    # 生成时原图的版本：当时索引里的 Image.file_size / file_mtime_ns（升级前生成的为 NULL，不做比对）
+    source_size = Column(BigInteger, nullable=True)
+    source_mtime_ns = Column(BigInteger, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    verified_at = Column(DateTime, nullable=True, index=True)
+
+
+class MaintenanceRun(Base):
+    """
+    后台维护任务（孤立缩略图清理等）最近一次完成的时间与结果，每个任务一行。
+    记在数据库里而不是内存里：服务重启之后仍按上次的时间判断是否到期，不会每次启动都跑一遍。
+    """
+
+    __tablename__ = "maintenance_runs"
+
+    # 任务名，例如 "thumb_gc"
+    name = Column(String, primary_key=True)
+
+    finished_at = Column(DateTime, nullable=False)
+
+    # 结果报告（JSON），没有时为 NULL
+    report = Column(Text, nullable=True)
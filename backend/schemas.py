@@ -11,9 +11,22 @@ class ProjectOut(BaseModel):
     folder_path: str
     description: Optional[str] = None
 
-    # 封面图片 URL（缩略图，可能为 None），形如 /thumbs/xxx/yyy.jpg
+    # 封面图片 URL（缩略图，可能为 None），形如 /thumbs/xxx/yyy.jpg?v=版本号
     cover_url: Optional[str] = None
 
+    # 封面原图尺寸（按 EXIF 方向校正后的显示尺寸），用于前端提前占位、避免布局跳动；
+    # 未知（旧数据还没同步 / 读取失败）时为 None
+    cover_width: Optional[int] = None
+    cover_height: Optional[int] = None
+    cover_aspect_ratio: Optional[float] = None
+
+    # 封面各尺寸档位的 srcset，例如 "/thumbs/a.jpg?w=200 200w, /thumbs/a.jpg?w=400 400w"
+    cover_srcset: Optional[str] = None
+
+    # 封面的加载占位：模糊小预览（data: URI）和主色调（#rrggbb），缩略图到达前先铺底；还没算出来时为 None
+    cover_placeholder: Optional[str] = None
+    cover_color: Optional[str] = None
+
     architect: Optional[str] = None
     location: Optional[str] = None
     category: Optional[str] = None
@@ -53,10 +66,33 @@ class ImageOut(BaseModel):
     project_id: int
     project_name: str
 
-    # 原图 URL，用于放大查看
+    # 相对 MEDIA_ROOT 的路径（批量缩略图接口 /api/thumbs/batch 按它对应每张图）
+    file_rel_path: Optional[str] = None
+
+    # 原图 URL（/media/...），用于下载原图
     url: str
 
-    # 缩略图 URL（用于列表 / 网格展示），例如 /thumbs/xxx/yyy.jpg
+    # 大图查看用的显示尺寸版本（/display/...，长边 2048 左右的网页格式）；
+    # 原图本身不大于显示尺寸、浏览器能直接显示时就是原图 URL
+    display_url: Optional[str] = None
+
+    # 超大图的 Deep Zoom 描述地址（/tiles/....dzi，见 thumb_tiles），放大查看时按视野加载分块；
+    # 不够大的图片为 None
+    dzi_url: Optional[str] = None
+
+    # 缩略图 URL（用于列表 / 网格展示），例如 /thumbs/xxx/yyy.jpg?v=版本号
     thumb_url: Optional[str] = None
 
+    # 各尺寸档位的缩略图 srcset（给 <img srcset>，浏览器按显示尺寸挑最小够用的一张）
+    thumb_srcset: Optional[str] = None
+
+    # 原图尺寸（按 EXIF 方向校正后的显示尺寸）及宽高比 width / height，未知时为 None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    aspect_ratio: Optional[float] = None
+
+    # 加载占位：模糊小预览（data: URI）和主色调（#rrggbb），见 thumb_placeholders；还没算出来时为 None
+    placeholder: Optional[str] = None
+    dominant_color: Optional[str] = None
+
     model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,410 @@
+# backend/sync_jobs.py
+"""
+案例库同步任务：把 sync_from_fs 放到后台线程里跑，并提供进度查询 / 取消。
+
+- 同一时间只会有一个同步任务在跑：重复发起时直接“加入”正在运行的任务，返回同一个 job_id；
+- 状态里带阶段、已扫描目录数、扫描到的图片数、已写入行数和耗时；
+- 取消是协作式的：同步在目录之间、写库块之间检查取消标记；
+- 单目录局部同步（导入 / 拖拽上传之后）与整库同步互斥：整库同步在跑时先排队，
+  等它结束后由同步线程接着处理；范围向上扩大到整个库时不在请求线程里做，改为启动一次后台增量同步；
+- 同步发现的新图片 / 原图变化的图片交给 thumb_worker 在后台预生成缩略图；
+  整库同步完成后在后台做一次缩略图完整性检查（thumb_inventory）；
+- 同步改动了图片归属 / 删除了图片时，作废 /thumbs 的内存路径缓存（thumb_path_cache）。
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+
+from database import SessionLocal
+from indexer import (
+    SyncCancelled,
+    SyncProgress,
+    normalize_folder_path,
+    resolve_folder_scope,
+    sync_folder_scope,
+    sync_from_fs,
+)
+from thumb_gc import start_gc_pass_if_due
+from thumb_inventory import start_integrity_pass
+from thumb_placeholders import start_placeholder_pass
+from thumb_path_cache import thumb_paths
+from thumb_worker import enqueue_thumbnails
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/resync", tags=["admin"])
+
+# 内存里最多保留多少个历史任务的状态
+_MAX_FINISHED_JOBS = 20
+
+# 等别的线程同步同一目录时，每隔多久检查一次是否改由整库同步接手（秒）
+_FOLDER_WAIT_POLL_S = 0.5
+
+
+class SyncJobStatus(BaseModel):
+    job_id: str
+    status: Literal["running", "done", "error", "cancelled"]
+    full: bool = False
+    source: str = "manual"
+
+    # scanning / writing / cleanup / done
+    phase: str = "pending"
+    dirs_scanned: int = 0
+    images_seen: int = 0
+    rows_written: int = 0
+
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    elapsed_seconds: float = 0.0
+
+    cancel_requested: bool = False
+    message: str = ""
+
+
+class StartSyncResponse(SyncJobStatus):
+    # True 表示已有同步在跑，本次请求加入了那个任务
+    joined: bool = False
+
+
+class FolderSyncRequest(BaseModel):
+    # 相对案例库根目录的目录，例如 "体育建筑/某项目"
+    folder_path: str
+
+
+class FolderSyncResult(BaseModel):
+    # done：已同步完；queued：整库同步正在进行，结束后会接着同步该目录，
+    # 或范围扩大到了整个库、已转为后台增量同步（见 job_id）；error：同步失败
+    status: Literal["done", "queued", "error"]
+    folder_path: str
+    # 实际同步的范围（可能因项目归属向上扩大到上层项目，"." 表示整个库）
+    scope: Optional[str] = None
+    # 转为后台增量同步时的任务 id
+    job_id: Optional[str] = None
+    created_projects: int = 0
+    updated_projects: int = 0
+    deleted_projects: int = 0
+    created_images: int = 0
+    deleted_images: int = 0
+    message: str = ""
+
+
+class _SyncJob:
+    def __init__(self, full: bool, source: str) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.full = full
+        self.source = source
+        self.progress = SyncProgress()
+        self.status = "running"
+        self.message = ""
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self._t0 = time.monotonic()
+        self._t1: Optional[float] = None
+
+    def finish(self, status: str, message: str = "") -> None:
+        self.status = status
+        self.message = message
+        self.finished_at = datetime.utcnow()
+        self._t1 = time.monotonic()
+
+    def to_status(self) -> SyncJobStatus:
+        end = self._t1 if self._t1 is not None else time.monotonic()
+        p = self.progress
+        return SyncJobStatus(
+            job_id=self.job_id,
+            status=self.status,
+            full=self.full,
+            source=self.source,
+            phase=p.phase,
+            dirs_scanned=p.dirs_scanned,
+            images_seen=p.images_seen,
+            rows_written=p.rows_written,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            elapsed_seconds=round(end - self._t0, 3),
+            cancel_requested=p.cancel_requested,
+            message=self.message,
+        )
+
+
+_jobs: "OrderedDict[str, _SyncJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_current_job: Optional[_SyncJob] = None
+
+# 写索引的互斥锁：整库同步和单目录同步不能同时改同一批行
+_index_lock = threading.Lock()
+
+
+class _FolderWaiter:
+    """一个排队中的单目录同步：同一目录的请求共用，处理完后填入结果、唤醒等待的请求线程。"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[FolderSyncResult] = None
+
+    def finish(self, result: FolderSyncResult) -> None:
+        self.result = result
+        self.done.set()
+
+
+# 还没开始处理的单目录同步请求：{目录（相对 MEDIA_ROOT）: 等待者}，受 _jobs_lock 保护；
+# 处理时整批取走，之后再来的同一目录请求会重新排队（不会拿到开始得比它早的结果）
+_pending_folders: dict[str, _FolderWaiter] = {}
+
+
+def _on_images_changed(images: list[tuple[str, str, bool, int]]) -> None:
+    """同步发现的新图片 / 原图变化的图片：路径缓存里的旧缩略图作废，交给后台预生成。"""
+    thumb_paths.remember_changed_images(images)
+    enqueue_thumbnails(images)
+
+
+def _invalidate_thumb_paths(scope: str, counts: Optional[dict]) -> None:
+    """
+    同步删除了图片 / 项目，或新增了项目（已有图片可能被新的子项目认领、换了项目目录）时，
+    作废该范围（"." 为整个库）内的路径缓存。
+    """
+    if counts is None:
+        return
+    if counts["deleted_images"] or counts["deleted_projects"] or counts["created_projects"]:
+        thumb_paths.invalidate_prefix(scope)
+
+
+def _run_job(job: _SyncJob) -> None:
+    global _current_job
+
+    db = SessionLocal()
+    try:
+        with _index_lock:
+            try:
+                counts = sync_from_fs(
+                    db, full=job.full, progress=job.progress, on_images_changed=_on_images_changed
+                )
+            except BaseException:
+                # 中途失败 / 取消时已提交的块里可能有删除，不知道删了哪些：整个缓存作废
+                thumb_paths.clear()
+                raise
+            _invalidate_thumb_paths(".", counts)
+        job.finish("done", "同步完成")
+        # 索引刚核对过一遍，顺带在后台检查到期的缩略图（不在 /thumbs 请求里做）
+        start_integrity_pass()
+        # 已有缩略图、还没有加载占位的图片顺带补上
+        start_placeholder_pass()
+        # 原图删掉 / 挪走之后留下的孤立缩略图，到期（gc_interval_days）时清理
+        start_gc_pass_if_due()
+    except SyncCancelled:
+        db.rollback()
+        logger.info("同步任务已取消: %s", job.job_id)
+        job.finish("cancelled", "同步已取消（已提交的部分保留，下次同步会自动补齐）")
+    except Exception as e:
+        db.rollback()
+        logger.exception("同步任务失败: %s", job.job_id)
+        job.finish("error", f"同步失败: {e}")
+    finally:
+        db.close()
+        with _jobs_lock:
+            if _current_job is job:
+                _current_job = None
+
+    # 处理同步期间排队的单目录请求
+    _drain_pending_folders()
+
+
+def _sync_pending_folder(rel: str) -> FolderSyncResult:
+    """持有索引锁时同步一个排队的目录；范围扩大到整个库时改为启动后台增量同步。"""
+    db = SessionLocal()
+    try:
+        scope = resolve_folder_scope(db, rel)
+        if scope == ".":
+            # 整库范围不在请求线程里扫；同步线程要等当前的索引锁释放后才开始
+            db.rollback()
+            status, _ = start_sync_job(full=False, source="folder")
+            return FolderSyncResult(
+                status="queued",
+                folder_path=rel,
+                scope=scope,
+                job_id=status.job_id,
+                message="同步范围扩大到整个案例库，已转为后台增量同步",
+            )
+        if scope is None:
+            return FolderSyncResult(status="done", folder_path=rel, scope=rel, message="目录同步完成")
+        counts = sync_folder_scope(db, scope, on_images_changed=_on_images_changed)
+        _invalidate_thumb_paths(counts["folder_path"], counts)
+        return FolderSyncResult(
+            status="done",
+            folder_path=rel,
+            scope=counts.pop("folder_path"),
+            message="目录同步完成",
+            **counts,
+        )
+    except Exception as e:
+        db.rollback()
+        thumb_paths.clear()
+        logger.exception("目录同步失败: %s", rel)
+        return FolderSyncResult(status="error", folder_path=rel, message=f"目录同步失败: {e}")
+    finally:
+        db.close()
+
+
+def _drain_pending_folders() -> None:
+    """
+    在当前线程里处理排队的单目录同步，结果交给各自的等待者；
+    索引锁被占用（整库同步或别的目录同步在跑）时直接返回，由持锁的一方释放锁后再来处理。
+    """
+    while True:
+        with _jobs_lock:
+            # 检查队列和抢锁放在同一个临界区里，持锁方释放后一定会再检查一次队列，不会漏掉请求
+            if not _pending_folders or not _index_lock.acquire(blocking=False):
+                return
+            batch = sorted(_pending_folders.items())
+            _pending_folders.clear()
+
+        try:
+            for rel, waiter in batch:
+                waiter.finish(_sync_pending_folder(rel))
+        finally:
+            _index_lock.release()
+
+
+def request_folder_sync(folder_path: str) -> FolderSyncResult:
+    """
+    同步单个目录（见 indexer.sync_folder）。索引空闲时在当前线程里直接同步完再返回；
+    别的请求正在同步目录时等它处理完（包括本目录）；
+    整库同步正在进行时排队（status=queued），整库同步结束后由同步线程接着处理；
+    范围扩大到整个库时启动一次后台增量同步（status=queued，带 job_id）。
+
+    folder_path 越出案例库根目录时抛 ValueError。
+    """
+    rel = normalize_folder_path(folder_path)
+    with _jobs_lock:
+        waiter = _pending_folders.get(rel)
+        if waiter is None:
+            waiter = _pending_folders[rel] = _FolderWaiter()
+
+    while True:
+        _drain_pending_folders()
+        if waiter.done.is_set():
+            return waiter.result
+        with _jobs_lock:
+            full_sync_running = _current_job is not None
+        if full_sync_running:
+            return FolderSyncResult(
+                status="queued",
+                folder_path=rel,
+                message="案例库正在同步，完成后会自动同步该目录",
+            )
+        # 索引锁在别的目录同步手里：它释放锁后会接着处理队列，等结果
+        if waiter.done.wait(_FOLDER_WAIT_POLL_S):
+            return waiter.result
+
+
+def start_sync_job(full: bool = False, source: str = "manual") -> tuple[SyncJobStatus, bool]:
+    """
+    启动一次后台同步；如果已有同步在跑，则直接返回那个任务（single-flight）。
+    返回 (任务状态, 是否加入了已有任务)。
+    """
+    global _current_job
+
+    with _jobs_lock:
+        if _current_job is not None:
+            return _current_job.to_status(), True
+
+        job = _SyncJob(full=full, source=source)
+        _current_job = job
+        _jobs[job.job_id] = job
+
+        # 只保留最近的若干个任务
+        while len(_jobs) > _MAX_FINISHED_JOBS:
+            oldest_id, oldest = next(iter(_jobs.items()))
+            if oldest is _current_job:
+                break
+            _jobs.pop(oldest_id)
+
+    threading.Thread(
+        target=_run_job,
+        args=(job,),
+        name=f"caselib-sync-{job.job_id[:8]}",
+        daemon=True,
+    ).start()
+
+    return job.to_status(), False
+
+
+def get_sync_job(job_id: str) -> Optional[SyncJobStatus]:
+    job = _jobs.get(job_id)
+    return job.to_status() if job is not None else None
+
+
+def get_latest_sync_job() -> Optional[SyncJobStatus]:
+    with _jobs_lock:
+        if _current_job is not None:
+            return _current_job.to_status()
+        if not _jobs:
+            return None
+        return next(reversed(_jobs.values())).to_status()
+
+
+def cancel_sync_job(job_id: str) -> Optional[SyncJobStatus]:
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if job.status == "running":
+        job.progress.cancel()
+    return job.to_status()
+
+
+# ========= 路由 =========
+
+
+@router.post("", response_model=StartSyncResponse)
+def api_start_resync(
+    full: bool = Query(False, description="忽略目录清单，完整重扫（用于修复索引）"),
+) -> StartSyncResponse:
+    """
+    手动触发一次后台同步（前端“刷新案例库”按钮调用），立即返回 job_id。
+
+    默认增量同步（只重新列出 mtime 变化过的目录）；?full=true 时完整重扫并重新解析所有 project.json。
+    已有同步在跑时不会再启动第二个，而是返回正在运行的任务（joined=true）。
+    """
+    status, joined = start_sync_job(full=full, source="manual")
+    return StartSyncResponse(**status.dict(), joined=joined)
+
+
+@router.post("/folder", response_model=FolderSyncResult)
+def api_resync_folder(payload: FolderSyncRequest) -> FolderSyncResult:
+    """
+    只重新同步某个目录（相对案例库根目录）的子树，通常几十毫秒内完成。
+    整库同步正在进行时返回 status=queued，整库同步结束后会自动处理。
+    """
+    try:
+        return request_folder_sync(payload.folder_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("", response_model=Optional[SyncJobStatus])
+def api_latest_resync() -> Optional[SyncJobStatus]:
+    """返回正在运行的同步任务；没有的话返回最近一次任务（从未同步过则为 null）。"""
+    return get_latest_sync_job()
+
+
+@router.get("/{job_id}", response_model=SyncJobStatus)
+def api_get_resync(job_id: str) -> SyncJobStatus:
+    status = get_sync_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="未找到该同步任务")
+    return status
+
+
+@router.post("/{job_id}/cancel", response_model=SyncJobStatus)
+def api_cancel_resync(job_id: str) -> SyncJobStatus:
+    status = cancel_sync_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="未找到该同步任务")
+    return status
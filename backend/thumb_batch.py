@@ -0,0 +1,217 @@
+# backend/thumb_batch.py
+"""
+批量缩略图：一个请求拿回项目相册一页（或任意一组图片）的缩略图。
+
+一页 100 张卡片原来是 100 个 /thumbs 请求，HTTP/1.1 下浏览器每个域名只开 6 个连接，
+请求排队的往返时间比缩略图本身还长。批量接口把它们打包成一个响应：
+
+- GET  /api/thumbs/batch?project_id=&offset=&limit=&w=   项目相册的一页（顺序与 /api/images 相同）
+- POST /api/thumbs/batch   {"paths": [...], "w": 400}      指定的一组图片（file_rel_path）
+
+尺寸档位 / 格式与 /thumbs 相同（?w= 归到档位，格式按 Accept 协商）。
+已有的缩略图查一次路径缓存 / 清单，缺的在按需生成线程池里并行生成（见 thumb_ondemand）。
+
+响应体（Content-Type: application/vnd.caselib.thumbs）：
+    [4 字节大端无符号整数：索引长度 N][N 字节 UTF-8 JSON 索引][各缩略图文件内容依次拼接]
+索引：
+    {"variant": "w400.webp",
+     "items": [{"path": ..., "offset": ..., "length": ..., "content_type": ...}, ...],
+     "missing": [...]}
+offset 相对于数据区（索引之后）的起点。missing 是索引里没有或生成失败的图片，
+前端对这些图片退回逐张的 /thumbs 地址。响应带 ETag，内容没变时回 304。
+"""
+import asyncio
+import hashlib
+import json
+import struct
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+import models
+from config import THUMB_BATCH_MAX_ITEMS
+from database import SessionLocal
+from http_cache import REVALIDATE_CACHE_CONTROL, is_not_modified
+from thumb_ondemand import (
+    find_known_thumbnails,
+    generate_rendition,
+    locate_images,
+    record_generated,
+)
+from thumb_renditions import negotiate_format, snap_width, variant_name
+from thumb_store import get_thumb_store
+
+router = APIRouter(prefix="/api/thumbs", tags=["thumbs"])
+
+BATCH_MEDIA_TYPE = "application/vnd.caselib.thumbs"
+
+_INDEX_LENGTH = struct.Struct(">I")
+
+_CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+}
+
+
+class ThumbBatchRequest(BaseModel):
+    paths: List[str] = Field(..., description="Image.file_rel_path 列表（相对 MEDIA_ROOT）")
+    w: Optional[int] = Field(None, ge=1, description="期望的长边像素，取不小于它的最小档位")
+
+
+# ========== 依赖：数据库 Session ==========
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# ========== 收集 / 打包 ==========
+
+def _project_image_paths(db: Session, project_id: int, offset: int, limit: int) -> list[str]:
+    """项目相册的一页图片，顺序与 /api/images 相同（id 倒序）。"""
+    rows = (
+        db.query(models.Image.file_rel_path)
+        .filter(models.Image.project_id == project_id)
+        .order_by(models.Image.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return [rel for (rel,) in rows]
+
+
+def _lookup(db: Session, paths: list[str], variant: str):
+    """已有的缩略图 + 需要生成的图片的位置；结束前释放读事务（见 locate_images）。"""
+    known = find_known_thumbnails(db, paths, variant)
+    located = locate_images(db, [rel for rel in paths if rel not in known])
+    return known, located
+
+
+def _etag(variant: str, found: dict, missing: list[str]) -> str:
+    parts = [variant]
+    for rel, thumb in found.items():
+        parts.append(f"{rel}\0{thumb.size}\0{thumb.mtime_ns}")
+    parts.append("\0".join(missing))
+    digest = hashlib.blake2s("\n".join(parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _pack(variant: str, found: dict, missing: list[str]) -> bytes:
+    """按模块说明的格式打包；读不到的（刚被删掉 / 被 packed 存储淘汰）挪到 missing。"""
+    store = get_thumb_store()
+    items = []
+    blobs = []
+    offset = 0
+    missing = list(missing)
+    for rel, thumb in found.items():
+        try:
+            data = store.read(thumb)
+        except OSError:
+            missing.append(rel)
+            continue
+        items.append({
+            "path": rel,
+            "offset": offset,
+            "length": len(data),
+            "content_type": _CONTENT_TYPES.get(thumb.key.suffix.lower(), "image/jpeg"),
+        })
+        blobs.append(data)
+        offset += len(data)
+
+    index = json.dumps(
+        {"variant": variant, "items": items, "missing": missing},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return b"".join([_INDEX_LENGTH.pack(len(index)), index, *blobs])
+
+
+async def _batch_response(
+    db: Session,
+    request: Request,
+    paths: list[str],
+    w: Optional[int],
+) -> Response:
+    # 去重但保持顺序
+    paths = list(dict.fromkeys(paths))
+    if len(paths) > THUMB_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多请求 {THUMB_BATCH_MAX_ITEMS} 张缩略图",
+        )
+
+    width = snap_width(w)
+    fmt = negotiate_format(request.headers.get("accept", ""))
+    variant = variant_name(width, fmt)
+
+    known, located = await run_in_threadpool(_lookup, db, paths, variant)
+
+    # 缺的缩略图并行生成（同一版本的并发请求只生成一次）
+    generated = await asyncio.gather(*(
+        generate_rendition(abs_image_path, project_dir, width, fmt)
+        for project_dir, abs_image_path in located.values()
+    ))
+    written = await run_in_threadpool(
+        record_generated, db, [(rel, variant, p) for rel, p in zip(located, generated)]
+    )
+
+    found = {}
+    missing = []
+    for rel in paths:
+        entry = known.get(rel) or written.get(rel)
+        if entry is None:
+            missing.append(rel)
+        else:
+            found[rel] = entry
+
+    headers = {
+        "ETag": _etag(variant, found, missing),
+        "Cache-Control": REVALIDATE_CACHE_CONTROL,
+        "Vary": "Accept",
+    }
+    if is_not_modified(Headers(headers), request.headers):
+        return NotModifiedResponse(Headers(headers))
+
+    body = await run_in_threadpool(_pack, variant, found, missing)
+    return Response(content=body, media_type=BATCH_MEDIA_TYPE, headers=headers)
+
+
+# ========== API ==========
+
+@router.get("/batch")
+async def api_thumb_batch_for_project(
+    request: Request,
+    project_id: int = Query(..., description="项目 id"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1),
+    w: Optional[int] = Query(None, ge=1, description="期望的长边像素，取不小于它的最小档位"),
+    db: Session = Depends(get_db),
+):
+    """项目相册一页的缩略图（顺序与 /api/images?project_id= 相同），打包格式见模块说明。"""
+    if limit > THUMB_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多请求 {THUMB_BATCH_MAX_ITEMS} 张缩略图",
+        )
+    paths = await run_in_threadpool(_project_image_paths, db, project_id, offset, limit)
+    return await _batch_response(db, request, paths, w)
+
+
+@router.post("/batch")
+async def api_thumb_batch_for_paths(
+    payload: ThumbBatchRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    """指定一组图片（file_rel_path）的缩略图，打包格式见模块说明；不在索引里的图片列在 missing。"""
+    return await _batch_response(db, request, payload.paths, payload.w)
@@ -0,0 +1,409 @@
+# backend/thumb_gc.py
+"""
+孤立缩略图清理：原图被删除 / 改名 / 挪到别的项目之后，同步会删掉 Image 行和清单行，
+但缩略图本身（_thumbs 下的文件，或 packed 存储里的记录）还留着，越攒越多，
+既占共享盘空间，又拖慢目录列表。
+
+- 以索引为准：某个缩略图键（默认缩略图、各档位版本、Deep Zoom 分块）对应的原图不在 images 表里、
+  或已归了别的项目，就是孤立的；扫到的键攒够一块就用一条 IN 查询核对，不打开任何图片，
+  内存只有一块的大小，与库的大小无关；
+- folder 存储只走一遍索引里各项目的 _thumbs 目录（按项目 id 分页读出），不遍历整个共享盘，
+  顺带清理写了一半留下的 .*.tmp 临时文件（超过 1 小时的，正在写的不动），删空的目录一并删掉；
+  已不再是项目的目录下残留的 _thumbs 不在范围内；
+  packed 存储只看内存索引，删完整理稀疏的 pack 文件；
+- 清理开始之后才写入的缩略图不动（同步 / 预生成和清理同时进行时，新图片的缩略图不会被误删）；
+- 按块删除：每攒一块删一次文件、删一次对应的清单行并提交；
+- dry_run 只统计、不删除，报告里是“会清理多少”。
+整库同步之后按 gc_interval_days 自动在后台运行（见 sync_jobs），上次完成的时间记在 maintenance_runs 表里，
+重启服务不会重新计时；也可以通过 /api/admin/thumbs/gc 手动触发。
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from fastapi import APIRouter, Query
+from pydantic import BaseModel
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from config import INDEXER_WRITE_CHUNK_SIZE, MEDIA_ROOT, THUMB_GC_INTERVAL_DAYS
+from database import SessionLocal
+from indexer import THUMB_DIR_NAME
+from thumb_store import FolderThumbStore, StoredThumb, get_thumb_store
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/thumbs", tags=["admin"])
+
+_thumbs_table = models.Thumbnail.__table__
+
+# folder 存储写缩略图时的临时文件：.<文件名>.<12 位十六进制>.tmp（见 FolderThumbStore.put）
+_TEMP_NAME = re.compile(r"^\..+\.[0-9a-f]{12}\.tmp$")
+# 比这更早的临时文件才算残留（正在写的不动）
+_TEMP_MAX_AGE_NS = 3600 * 1_000_000_000
+
+# 由某个缩略图键派生出的其他键：档位 / 格式版本（见 thumb_renditions）和 Deep Zoom 分块（见 thumb_tiles）
+_DERIVED_SUFFIXES = (
+    re.compile(r"\.w\d+\.(?:jpg|webp|avif)$"),
+    re.compile(r"\.tiles/\d+/\d+_\d+\.jpg$"),
+)
+
+# 报告里最多列出多少个清理掉的键
+_SAMPLE_LIMIT = 20
+
+
+# ========== 判断 ==========
+
+def thumb_owner(key: str) -> Optional[tuple[str, list[str]]]:
+    """
+    缩略图键（相对 MEDIA_ROOT 的 posix 路径，见 indexer.thumb_path_for_image）对应的
+    (项目 folder_path, [可能的原图 file_rel_path, ...])；不在某个 _thumbs 目录下的返回 None。
+    派生的键（档位版本、Deep Zoom 分块）去掉后缀之后才是原图，但原图名本身也可能长得像派生键，两个都试。
+    """
+    parts = key.split("/")
+    try:
+        i = parts.index(THUMB_DIR_NAME)
+    except ValueError:
+        return None
+    folder = "/".join(parts[:i]) or "."
+    sub = "/".join(parts[i + 1:])
+    if not sub:
+        return None
+
+    names = [sub]
+    for suffix in _DERIVED_SUFFIXES:
+        base = suffix.sub("", sub)
+        if base != sub and base:
+            names.append(base)
+    rels = names if folder == "." else [f"{folder}/{name}" for name in names]
+    return folder, rels
+
+
+def _find_orphans(db: Session, pending: list[tuple[StoredThumb, str, list[str]]]) -> list[StoredThumb]:
+    """一块待核对的缩略图 (缩略图, 项目 folder_path, 候选原图) 里孤立的那些（一条 IN 查询）。"""
+    rels = sorted({rel for _, _, candidates in pending for rel in candidates})
+    owners: dict[str, str] = {}
+    try:
+        for rel, folder in db.execute(
+            select(models.Image.file_rel_path, models.Project.folder_path)
+            .join(models.Project, models.Image.project_id == models.Project.id)
+            .where(models.Image.file_rel_path.in_(rels))
+        ):
+            owners[rel] = folder or "."
+    finally:
+        # 不占着读事务（dry_run 时整个过程都不会提交）
+        db.rollback()
+    return [
+        thumb
+        for thumb, folder, candidates in pending
+        if not any(owners.get(rel) == folder for rel in candidates)
+    ]
+
+
+def _project_thumb_dirs(db: Session) -> Iterator[Path]:
+    """索引里各项目的 _thumbs 目录，按项目 id 分页读出（每页一块，读完就结束读事务）。"""
+    projects_table = models.Project.__table__
+    last_id = 0
+    while True:
+        try:
+            rows = db.execute(
+                select(projects_table.c.id, projects_table.c.folder_path)
+                .where(projects_table.c.id > last_id)
+                .order_by(projects_table.c.id)
+                .limit(INDEXER_WRITE_CHUNK_SIZE)
+            ).all()
+        finally:
+            db.rollback()
+        if not rows:
+            return
+        for _, folder in rows:
+            yield MEDIA_ROOT / folder / THUMB_DIR_NAME
+        last_id = rows[-1][0]
+
+
+# ========== 清理 ==========
+
+class ThumbGcReport(BaseModel):
+    dry_run: bool = True
+    # 检查过的缩略图（含临时文件）数
+    scanned: int = 0
+    # 孤立的缩略图 / 残留的临时文件数，以及它们占的字节数（dry_run 时为“会清理的”）
+    orphans: int = 0
+    temp_files: int = 0
+    reclaimed_bytes: int = 0
+    # 删掉的清单行数 / 空目录数
+    inventory_rows: int = 0
+    removed_dirs: int = 0
+    # 整理 pack 文件腾出的磁盘空间（packed 存储）
+    compacted_bytes: int = 0
+    sample: List[str] = []
+
+
+def _remove_empty_dirs(dirs: set[str]) -> int:
+    """从删过文件的目录往上删空目录，删到 _thumbs 为止（含 _thumbs 本身）。"""
+    removed = 0
+    for path in sorted(dirs, key=len, reverse=True):
+        while True:
+            try:
+                os.rmdir(path)
+            except OSError:
+                # 不空 / 已经删掉了
+                break
+            removed += 1
+            if os.path.basename(path) == THUMB_DIR_NAME:
+                break
+            path = os.path.dirname(path)
+    return removed
+
+
+def _flush(db: Session, batch: list[StoredThumb], report: ThumbGcReport) -> None:
+    """删除一块孤立的缩略图和对应的清单行。"""
+    if report.dry_run or not batch:
+        return
+    store = get_thumb_store()
+    removed_keys: list[str] = []
+    dirs: set[str] = set()
+    for thumb in batch:
+        try:
+            store.delete(thumb.key)
+        except OSError as e:
+            logger.warning("删除孤立缩略图失败: %s (%s)", thumb.key, e)
+            continue
+        dirs.add(str(thumb.key.parent))
+        try:
+            removed_keys.append(thumb.key.relative_to(MEDIA_ROOT).as_posix())
+        except ValueError:
+            pass
+
+    if removed_keys:
+        result = db.execute(
+            delete(_thumbs_table).where(_thumbs_table.c.thumb_rel_path.in_(removed_keys))
+        )
+        db.commit()
+        report.inventory_rows += result.rowcount or 0
+    if isinstance(store, FolderThumbStore):
+        report.removed_dirs += _remove_empty_dirs(dirs)
+
+
+def _take(thumb: StoredThumb, batch: list[StoredThumb], report: ThumbGcReport) -> None:
+    report.reclaimed_bytes += thumb.size
+    if len(report.sample) < _SAMPLE_LIMIT:
+        report.sample.append(str(thumb.key))
+    batch.append(thumb)
+
+
+def collect_orphan_thumbnails(
+    db: Session,
+    dry_run: bool = True,
+    stop: Optional[threading.Event] = None,
+) -> ThumbGcReport:
+    """找出（dry_run=False 时删除）孤立的缩略图和残留的临时文件，返回报告。"""
+    report = ThumbGcReport(dry_run=dry_run)
+    started_ns = time.time_ns()
+    try:
+        indexed = db.execute(select(models.Image.id).limit(1)).first() is not None
+    finally:
+        db.rollback()
+    if not indexed:
+        # 索引是空的（还没同步过 / 同步失败）：这时什么都算孤立，宁可不清理
+        logger.warning("索引里没有图片，跳过孤立缩略图清理")
+        return report
+
+    store = get_thumb_store()
+    if isinstance(store, FolderThumbStore):
+        thumbs = store.scan_dirs(_project_thumb_dirs(db))
+    else:
+        thumbs = store.scan()
+
+    batch: list[StoredThumb] = []
+    pending: list[tuple[StoredThumb, str, list[str]]] = []
+    for thumb in thumbs:
+        if stop is not None and stop.is_set():
+            break
+        report.scanned += 1
+
+        if _TEMP_NAME.match(thumb.key.name):
+            if thumb.mtime_ns > started_ns - _TEMP_MAX_AGE_NS:
+                continue
+            report.temp_files += 1
+            _take(thumb, batch, report)
+        else:
+            if thumb.mtime_ns >= started_ns:
+                continue
+            try:
+                key = thumb.key.relative_to(MEDIA_ROOT).as_posix()
+            except ValueError:
+                # 不在库里的（项目目录是指向库外的链接等）不归这里管
+                continue
+            owner = thumb_owner(key)
+            if owner is None:
+                report.orphans += 1
+                _take(thumb, batch, report)
+            else:
+                pending.append((thumb, *owner))
+                if len(pending) >= INDEXER_WRITE_CHUNK_SIZE:
+                    for orphan in _find_orphans(db, pending):
+                        report.orphans += 1
+                        _take(orphan, batch, report)
+                    pending = []
+
+        if len(batch) >= INDEXER_WRITE_CHUNK_SIZE:
+            _flush(db, batch, report)
+            batch = []
+
+    if pending and not (stop is not None and stop.is_set()):
+        for orphan in _find_orphans(db, pending):
+            report.orphans += 1
+            _take(orphan, batch, report)
+    _flush(db, batch, report)
+
+    if not dry_run:
+        report.compacted_bytes = store.compact()
+    return report
+
+
+# ========== 后台运行 ==========
+
+class ThumbGcStatus(BaseModel):
+    running: bool
+    # 本次请求是否启动了新的清理（已有清理在跑时为 False）
+    started: bool = False
+    last_finished_at: Optional[datetime] = None
+    last_report: Optional[ThumbGcReport] = None
+
+
+_gc_lock = threading.Lock()
+_gc_stop = threading.Event()
+
+# maintenance_runs 里的任务名：真正删除的清理（决定下次何时到期）/ 试运行
+_RUN_NAME = "thumb_gc"
+_DRY_RUN_NAME = "thumb_gc.dry_run"
+
+_runs_table = models.MaintenanceRun.__table__
+
+
+def _save_run(db: Session, name: str, finished_at: datetime, report: Optional[ThumbGcReport]) -> None:
+    stmt = sqlite_insert(_runs_table).values(
+        name=name,
+        finished_at=finished_at,
+        report=report.model_dump_json() if report is not None else None,
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[_runs_table.c.name],
+            set_={"finished_at": stmt.excluded.finished_at, "report": stmt.excluded.report},
+        )
+    )
+    db.commit()
+
+
+def _load_runs(db: Session) -> dict[str, tuple[datetime, Optional[ThumbGcReport]]]:
+    """{任务名: (完成时间, 报告)}"""
+    try:
+        rows = db.execute(
+            select(_runs_table.c.name, _runs_table.c.finished_at, _runs_table.c.report)
+            .where(_runs_table.c.name.in_([_RUN_NAME, _DRY_RUN_NAME]))
+        ).all()
+    finally:
+        db.rollback()
+    return {
+        name: (finished_at, ThumbGcReport.model_validate_json(report) if report else None)
+        for name, finished_at, report in rows
+    }
+
+
+def _run_gc(dry_run: bool) -> None:
+    db = SessionLocal()
+    try:
+        report = collect_orphan_thumbnails(db, dry_run=dry_run, stop=_gc_stop)
+        if _gc_stop.is_set():
+            # 中途停下（服务关闭）：不算完成一次，下次照常到期
+            logger.info("孤立缩略图清理已中止: 检查 %d 个", report.scanned)
+            return
+        _save_run(db, _DRY_RUN_NAME if dry_run else _RUN_NAME, datetime.utcnow(), report)
+        logger.info(
+            "孤立缩略图清理%s: 检查 %d 个，孤立 %d 个，临时文件 %d 个，%s %.1f MB",
+            "（试运行）" if dry_run else "完成",
+            report.scanned, report.orphans, report.temp_files,
+            "可回收" if dry_run else "回收",
+            report.reclaimed_bytes / 1024 / 1024,
+        )
+    except Exception:
+        db.rollback()
+        logger.exception("孤立缩略图清理失败")
+    finally:
+        db.close()
+        _gc_lock.release()
+
+
+def start_gc_pass(dry_run: bool = False) -> bool:
+    """在后台线程里清理一次；已有清理在跑时什么都不做。返回是否启动了新的清理。"""
+    if not _gc_lock.acquire(blocking=False):
+        return False
+    _gc_stop.clear()
+    threading.Thread(
+        target=_run_gc, args=(dry_run,), name="caselib-thumb-gc", daemon=True
+    ).start()
+    return True
+
+
+def start_gc_pass_if_due() -> bool:
+    """
+    整库同步之后调用：距上次（真正删除的）清理超过 gc_interval_days 天时启动一次。
+    从没清理过（新装 / 刚升级）时只记下当前时间作为起点，过一个周期再清理，
+    不在第一次启动时就删东西。
+    """
+    if THUMB_GC_INTERVAL_DAYS <= 0:
+        return False
+    db = SessionLocal()
+    try:
+        last = _load_runs(db).get(_RUN_NAME)
+        now = datetime.utcnow()
+        if last is None:
+            _save_run(db, _RUN_NAME, now, None)
+            return False
+        if last[0] > now - timedelta(days=THUMB_GC_INTERVAL_DAYS):
+            return False
+    finally:
+        db.close()
+    return start_gc_pass()
+
+
+def stop_gc_pass() -> None:
+    _gc_stop.set()
+
+
+def get_gc_status(started: bool = False) -> ThumbGcStatus:
+    """最近一次完成的清理（真正删除的或试运行，取较新的那次）。"""
+    db = SessionLocal()
+    try:
+        runs = _load_runs(db)
+    finally:
+        db.close()
+    last = max(runs.values(), key=lambda run: run[0], default=(None, None))
+    return ThumbGcStatus(
+        running=_gc_lock.locked(),
+        started=started,
+        last_finished_at=last[0],
+        last_report=last[1],
+    )
+
+
+@router.post("/gc", response_model=ThumbGcStatus)
+def api_start_thumb_gc(
+    dry_run: bool = Query(True, description="只统计不删除；确认报告后再用 dry_run=false 真正清理"),
+) -> ThumbGcStatus:
+    """手动触发一次孤立缩略图清理（后台进行），立即返回；结果用 GET 查看。"""
+    return get_gc_status(started=start_gc_pass(dry_run))
+
+
+@router.get("/gc", response_model=ThumbGcStatus)
+def api_thumb_gc_status() -> ThumbGcStatus:
+    return get_gc_status()
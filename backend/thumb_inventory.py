@@ -0,0 +1,384 @@
+# backend/thumb_inventory.py
+"""
+缩略图清单（thumbnails 表）：记录“哪张原图的缩略图已经生成好、放在哪里”。
+
+- /thumbs 的热路径：查一次清单 → stat 一次 → 直接发送文件，
+  不再每次都 resolve / is_file / 用 Pillow 打开校验（共享盘上每一步都是网络往返）；
+- thumb_rel_path 是缩略图在存储里的键（_thumbs 布局下的路径，见 thumb_store）；
+- 生成缩略图时写入清单（/thumbs 按需生成、后台预生成），同时记下当时索引里原图的大小 / mtime；
+- 原图被替换后，同步更新了索引里的大小 / mtime，和清单里记下的对不上：查清单时当作没有，
+  旧缩略图删掉后按需 / 由后台预生成重新生成（只比对数字，不解码文件；
+  带着原来修改时间复制过来的文件，单看“缩略图比原图新”是发现不了的）；
+- 同步时清理清单：原图已被删除的行（见 indexer._IndexWriter）；
+- 完整性检查（Pillow verify）挪到后台：每次整库同步之后检查到期（verify_interval_days）的缩略图，
+  损坏 / 被改动的文件连同清单行一起删除，下次请求时按需重建。
+"""
+import io
+import logging
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+from sqlalchemy import bindparam, delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from config import INDEXER_WRITE_CHUNK_SIZE, MEDIA_ROOT, THUMB_VERIFY_INTERVAL_DAYS
+from database import SessionLocal
+from thumb_store import get_thumb_store, set_eviction_listener
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/thumbs", tags=["admin"])
+
+_thumbs_table = models.Thumbnail.__table__
+_images_table = models.Image.__table__
+
+
+# ========== 查询 / 写入 ==========
+
+def source_changed(
+    source_size: Optional[int],
+    source_mtime_ns: Optional[int],
+    file_size: Optional[int],
+    file_mtime_ns: Optional[int],
+) -> bool:
+    """缩略图生成时记下的原图版本和索引里的现值对不上（任何一边不知道时不算）。"""
+    return any(
+        recorded is not None and current is not None and recorded != current
+        for recorded, current in ((source_size, file_size), (source_mtime_ns, file_mtime_ns))
+    )
+
+
+def _inventory_rows(db: Session, file_rel_paths: list[str], *where):
+    """清单行连同索引里原图的当前版本：(file_rel_path, variant, thumb_rel_path, 是否过期)。"""
+    for start in range(0, len(file_rel_paths), INDEXER_WRITE_CHUNK_SIZE):
+        chunk = file_rel_paths[start:start + INDEXER_WRITE_CHUNK_SIZE]
+        rows = db.execute(
+            select(
+                _thumbs_table.c.file_rel_path,
+                _thumbs_table.c.variant,
+                _thumbs_table.c.thumb_rel_path,
+                _thumbs_table.c.source_size,
+                _thumbs_table.c.source_mtime_ns,
+                _images_table.c.file_size,
+                _images_table.c.file_mtime_ns,
+            )
+            .outerjoin(_images_table, _images_table.c.file_rel_path == _thumbs_table.c.file_rel_path)
+            .where(_thumbs_table.c.file_rel_path.in_(chunk), *where)
+        ).all()
+        for rel, variant, thumb_rel_path, *versions in rows:
+            yield rel, variant, thumb_rel_path, source_changed(*versions)
+
+
+def lookup_thumbnails(
+    db: Session,
+    file_rel_paths: list[str],
+    variant: str = "",
+    stale: Optional[list[tuple[str, str, str]]] = None,
+) -> dict[str, str]:
+    """
+    一批原图某个版本的缩略图路径：{file_rel_path: thumb_rel_path}。
+    清单里没有的、原图已被替换（记录过期）的不出现；
+    传入 stale 列表时，过期的记录 (file_rel_path, variant, thumb_rel_path) 追加进去
+    （同一次查询里判定，交给 discard_thumbnails 删除，不用再查一遍）。
+    """
+    found: dict[str, str] = {}
+    for rel, row_variant, thumb_rel_path, is_stale in _inventory_rows(
+        db, file_rel_paths, _thumbs_table.c.variant == variant
+    ):
+        if not is_stale:
+            found[rel] = thumb_rel_path
+        elif stale is not None:
+            stale.append((rel, row_variant, thumb_rel_path))
+    return found
+
+
+def discard_thumbnails(db: Session, entries: list[tuple[str, str, str]]) -> int:
+    """
+    删掉这些缩略图（存储里的文件和清单行）并提交，返回删掉的条数。
+    entries：[(原图 file_rel_path, 版本名, 缩略图 thumb_rel_path), ...]。
+    生成缩略图时按“比原图新就不重新生成”判断，过期的旧文件要先删掉，才会按新的原图重新生成。
+    """
+    if not entries:
+        return 0
+
+    store = get_thumb_store()
+    for _, _, thumb_rel_path in entries:
+        try:
+            store.delete(MEDIA_ROOT / thumb_rel_path)
+        except OSError as e:
+            logger.warning("删除过期缩略图失败: %s (%s)", thumb_rel_path, e)
+    for rel, variant, _ in entries:
+        db.execute(
+            delete(_thumbs_table).where(
+                _thumbs_table.c.file_rel_path == rel,
+                _thumbs_table.c.variant == variant,
+            )
+        )
+    db.commit()
+    return len(entries)
+
+
+def discard_stale_thumbnails(db: Session, file_rel_paths: list[str]) -> int:
+    """删掉这批原图所有版本里过期的缩略图（见 discard_thumbnails），返回删掉的条数。"""
+    return discard_thumbnails(
+        db,
+        [
+            (rel, variant, thumb_rel_path)
+            for rel, variant, thumb_rel_path, is_stale in _inventory_rows(db, file_rel_paths)
+            if is_stale
+        ],
+    )
+
+
+def _image_version(column):
+    """写清单时取索引里原图的当前版本（同一条语句里的子查询，不用先查一遍）。"""
+    return (
+        select(column)
+        .where(_images_table.c.file_rel_path == bindparam("b_file_rel_path"))
+        .scalar_subquery()
+    )
+
+
+def record_thumbnails(
+    db: Session,
+    entries: Iterable[tuple[str, str, str, Optional[int]]],
+) -> None:
+    """
+    写入 / 更新清单并提交。
+    entries：[(原图 file_rel_path, 版本名, 缩略图 thumb_rel_path, 缩略图字节数), ...]。
+    刚生成的文件视为已检查过（verified_at = now）；原图版本取索引里的当前值
+    （生成之后、同步之前原图又被替换的，下次同步后对不上，再重新生成一次）。
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "b_file_rel_path": file_rel_path,
+            "b_variant": variant,
+            "b_thumb_rel_path": thumb_rel_path,
+            "b_thumb_size": thumb_size,
+            "b_now": now,
+        }
+        for file_rel_path, variant, thumb_rel_path, thumb_size in entries
+    ]
+    if not rows:
+        return
+
+    stmt = sqlite_insert(_thumbs_table).values(
+        file_rel_path=bindparam("b_file_rel_path"),
+        variant=bindparam("b_variant"),
+        thumb_rel_path=bindparam("b_thumb_rel_path"),
+        thumb_size=bindparam("b_thumb_size"),
+        source_size=_image_version(_images_table.c.file_size),
+        source_mtime_ns=_image_version(_images_table.c.file_mtime_ns),
+        created_at=bindparam("b_now"),
+        verified_at=bindparam("b_now"),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[_thumbs_table.c.file_rel_path, _thumbs_table.c.variant],
+        set_={
+            "thumb_rel_path": stmt.excluded.thumb_rel_path,
+            "thumb_size": stmt.excluded.thumb_size,
+            "source_size": stmt.excluded.source_size,
+            "source_mtime_ns": stmt.excluded.source_mtime_ns,
+            "created_at": stmt.excluded.created_at,
+            "verified_at": stmt.excluded.verified_at,
+        },
+    )
+    for start in range(0, len(rows), INDEXER_WRITE_CHUNK_SIZE):
+        db.execute(stmt, rows[start:start + INDEXER_WRITE_CHUNK_SIZE])
+        db.commit()
+
+
+def forget_thumbnail(db: Session, file_rel_path: str, variant: str = "") -> None:
+    """清单里的缩略图已经不在了：删掉这一行并提交（下次请求走按需生成）。"""
+    db.execute(
+        delete(_thumbs_table).where(
+            _thumbs_table.c.file_rel_path == file_rel_path,
+            _thumbs_table.c.variant == variant,
+        )
+    )
+    db.commit()
+
+
+def forget_evicted_thumbnails(thumb_rel_paths: list[str]) -> None:
+    """
+    packed 存储淘汰了这些缩略图：删掉对应的清单行（分块提交）。
+    在存储的后台整理线程里调用，自己开一个会话，不占用写入缩略图的请求线程。
+    """
+    db = SessionLocal()
+    try:
+        for start in range(0, len(thumb_rel_paths), INDEXER_WRITE_CHUNK_SIZE):
+            db.execute(
+                delete(_thumbs_table).where(
+                    _thumbs_table.c.thumb_rel_path.in_(
+                        thumb_rel_paths[start:start + INDEXER_WRITE_CHUNK_SIZE]
+                    )
+                )
+            )
+            db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("删除已淘汰缩略图的清单行失败")
+    finally:
+        db.close()
+
+
+set_eviction_listener(forget_evicted_thumbnails)
+
+
+# ========== 后台完整性检查 ==========
+
+def _thumb_file_ok(thumb_path: Path, expected_size: Optional[int]) -> bool:
+    """缩略图还在存储里、大小和生成时一致、Pillow 能通过 verify。损坏的顺手从存储里删掉。"""
+    store = get_thumb_store()
+    stored = store.stat(thumb_path)
+    if stored is None:
+        return False
+
+    try:
+        if expected_size is not None and stored.size != expected_size:
+            raise ValueError(f"大小不一致（{stored.size} != {expected_size}）")
+
+        from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
+
+        with PILImage.open(io.BytesIO(store.read(stored))) as im:
+            im.verify()  # 不解码整图，只校验文件结构
+        return True
+    except Exception as e:
+        logger.warning("检测到损坏的缩略图，删除后按需重建 (%s): %s", thumb_path, e)
+        try:
+            store.delete(thumb_path)
+        except OSError as del_err:
+            logger.warning("删除损坏缩略图失败: %s (%s)", thumb_path, del_err)
+        return False
+
+
+def verify_thumbnails(
+    db: Session,
+    interval_days: float = THUMB_VERIFY_INTERVAL_DAYS,
+    stop: Optional[threading.Event] = None,
+) -> dict:
+    """
+    检查所有到期（从未检查过，或上次检查早于 interval_days 天前）的缩略图：
+    正常的更新 verified_at，缺失 / 损坏的删除清单行（损坏的文件一并删除）。
+    按 id 分块进行，每块单独提交。返回 {"checked": n, "removed": n}。
+    """
+    now = datetime.utcnow()
+    due_before = now - timedelta(days=interval_days)
+    counts = {"checked": 0, "removed": 0}
+
+    last_id = 0
+    while stop is None or not stop.is_set():
+        rows = db.execute(
+            select(
+                _thumbs_table.c.id,
+                _thumbs_table.c.thumb_rel_path,
+                _thumbs_table.c.thumb_size,
+            )
+            .where(_thumbs_table.c.id > last_id)
+            .where(
+                or_(
+                    _thumbs_table.c.verified_at.is_(None),
+                    _thumbs_table.c.verified_at < due_before,
+                )
+            )
+            .order_by(_thumbs_table.c.id)
+            .limit(INDEXER_WRITE_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        ok_ids: list[int] = []
+        bad_ids: list[int] = []
+        for thumb_id, thumb_rel_path, thumb_size in rows:
+            if _thumb_file_ok(MEDIA_ROOT / thumb_rel_path, thumb_size):
+                ok_ids.append(thumb_id)
+            else:
+                bad_ids.append(thumb_id)
+
+        if ok_ids:
+            db.execute(
+                update(_thumbs_table)
+                .where(_thumbs_table.c.id.in_(ok_ids))
+                .values(verified_at=now)
+            )
+        if bad_ids:
+            db.execute(delete(_thumbs_table).where(_thumbs_table.c.id.in_(bad_ids)))
+        db.commit()
+
+        counts["checked"] += len(rows)
+        counts["removed"] += len(bad_ids)
+
+    return counts
+
+
+class ThumbVerifyStatus(BaseModel):
+    running: bool
+    # 本次请求是否启动了新的检查（已有检查在跑时为 False）
+    started: bool = False
+    last_finished_at: Optional[datetime] = None
+    last_checked: int = 0
+    last_removed: int = 0
+
+
+_verify_lock = threading.Lock()
+_verify_stop = threading.Event()
+_last_verify: dict = {}
+
+
+def _run_verify() -> None:
+    db = SessionLocal()
+    try:
+        counts = verify_thumbnails(db, stop=_verify_stop)
+        _last_verify.update(counts, finished_at=datetime.utcnow())
+        if counts["checked"]:
+            logger.info(
+                "缩略图完整性检查完成: 检查 %d 张，删除 %d 张", counts["checked"], counts["removed"]
+            )
+    except Exception:
+        db.rollback()
+        logger.exception("缩略图完整性检查失败")
+    finally:
+        db.close()
+        _verify_lock.release()
+
+
+def start_integrity_pass() -> bool:
+    """在后台线程里做一次完整性检查；已有检查在跑时什么都不做。返回是否启动了新的检查。"""
+    if not _verify_lock.acquire(blocking=False):
+        return False
+    _verify_stop.clear()
+    threading.Thread(target=_run_verify, name="caselib-thumb-verify", daemon=True).start()
+    return True
+
+
+def stop_integrity_pass() -> None:
+    _verify_stop.set()
+
+
+def get_verify_status(started: bool = False) -> ThumbVerifyStatus:
+    return ThumbVerifyStatus(
+        running=_verify_lock.locked(),
+        started=started,
+        last_finished_at=_last_verify.get("finished_at"),
+        last_checked=_last_verify.get("checked", 0),
+        last_removed=_last_verify.get("removed", 0),
+    )
+
+
+@router.post("/verify", response_model=ThumbVerifyStatus)
+def api_start_thumb_verify() -> ThumbVerifyStatus:
+    """手动触发一次缩略图完整性检查（只检查到期的缩略图），立即返回。"""
+    return get_verify_status(started=start_integrity_pass())
+
+
+@router.get("/verify", response_model=ThumbVerifyStatus)
+def api_thumb_verify_status() -> ThumbVerifyStatus:
+    return get_verify_status()
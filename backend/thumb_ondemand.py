@@ -0,0 +1,188 @@
+# backend/thumb_ondemand.py
+"""
+/thumbs 按需生成缩略图：专用的有界线程池 + 同一版本的并发请求合并（single-flight），
+以及 /thumbs 与批量接口（thumb_batch）共用的查找 / 记录函数。
+
+- 生成在自己的线程池里做（线程数见 config.ini [thumbnails] ondemand_workers），
+  /thumbs 路由 await 结果，等待期间不占 FastAPI / anyio 的公共线程池，其他接口不会被拖住；
+- 同一张原图的同一版本正在生成时，后来的请求直接等那一次的结果，不会重复解码、抢着写同一个文件；
+- 写入由缩略图存储负责（见 thumb_store）：folder 存储是“临时文件 + 改名”，
+  与后台预生成进程同时写同一个缩略图也不会读到半截文件；packed 存储只在本进程里加锁追加。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from config import INDEXER_WRITE_CHUNK_SIZE, MEDIA_ROOT, THUMB_ONDEMAND_WORKERS
+from thumb_inventory import (
+    discard_thumbnails,
+    forget_thumbnail,
+    lookup_thumbnails,
+    record_thumbnails,
+)
+from thumb_path_cache import thumb_paths
+from thumb_renditions import ensure_rendition
+from thumb_store import StoredThumb, get_thumb_store
+
+_executor = ThreadPoolExecutor(
+    max_workers=THUMB_ONDEMAND_WORKERS, thread_name_prefix="caselib-thumb-ondemand"
+)
+
+# (原图绝对路径, 档位, 格式) -> 正在进行的生成
+_in_flight: dict[tuple[str, int, Optional[str]], Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _forget(key: tuple, future: Future) -> None:
+    with _in_flight_lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+def submit_rendition(
+    abs_image_path: Path,
+    project_dir: Path,
+    width: int,
+    fmt: Optional[str],
+) -> Future:
+    """提交一次生成（见 thumb_renditions.ensure_rendition）；同一版本已在生成时返回同一个 Future。"""
+    key = (str(abs_image_path), width, fmt)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        future = _executor.submit(ensure_rendition, abs_image_path, project_dir, width, fmt)
+        _in_flight[key] = future
+    # 在锁外注册：已经完成的 Future 会在当前线程里立即回调
+    future.add_done_callback(lambda f: _forget(key, f))
+    return future
+
+
+async def generate_rendition(
+    abs_image_path: Path,
+    project_dir: Path,
+    width: int,
+    fmt: Optional[str],
+) -> Optional[Path]:
+    """
+    在事件循环里等待生成结果（缩略图路径，失败为 None）。
+    用 shield 包一层：某个请求被取消（浏览器关掉页面）时不会连带取消其他请求也在等的那次生成。
+    """
+    future = submit_rendition(abs_image_path, project_dir, width, fmt)
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+def stop_ondemand_generation() -> None:
+    """关闭服务时调用：不再接新任务，丢掉还没开始的任务。"""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ========== 查找 / 记录（同步函数，路由里放到线程池执行；同一个会话不要并发调用） ==========
+
+def find_known_thumbnails(
+    db: Session,
+    file_rel_paths: list[str],
+    variant: str,
+) -> dict[str, StoredThumb]:
+    """
+    已经生成好的缩略图：{file_rel_path: 存储里的缩略图}。
+    先查内存路径缓存（命中时不查数据库），没命中的一次性查缩略图清单，然后逐个到存储里 stat；
+    取不到（文件被删掉了 / 被 packed 存储淘汰了）的从缓存和清单里去掉，调用方按需生成。
+    清单里的记录已过期（原图被替换过）的，旧缩略图在这里删掉，调用方按新的原图重新生成。
+    """
+    store = get_thumb_store()
+    candidates: dict[str, Path] = {}
+    pending: list[str] = []
+    for rel in file_rel_paths:
+        thumb_file = thumb_paths.thumb_path(rel, variant)
+        if thumb_file is None:
+            pending.append(rel)
+        else:
+            candidates[rel] = thumb_file
+
+    from_inventory: set[str] = set()
+    if pending:
+        stale: list[tuple[str, str, str]] = []
+        for rel, thumb_rel_path in lookup_thumbnails(db, pending, variant, stale).items():
+            candidates[rel] = MEDIA_ROOT / thumb_rel_path
+            from_inventory.add(rel)
+        discard_thumbnails(db, stale)
+
+    found: dict[str, StoredThumb] = {}
+    for rel, thumb_file in candidates.items():
+        stored = store.stat(thumb_file)
+        if stored is None:
+            thumb_paths.forget_thumb(rel, variant)
+            forget_thumbnail(db, rel, variant)
+            continue
+        if rel in from_inventory:
+            thumb_paths.remember_thumb(rel, variant, thumb_file)
+        found[rel] = stored
+    return found
+
+
+def locate_images(db: Session, file_rel_paths: list[str]) -> dict[str, tuple[Path, Path]]:
+    """
+    {file_rel_path: (项目目录, 原图绝对路径)}：先查内存路径缓存，没有的再一次性查 Image + Project；
+    索引里没有的图片不出现在结果中。
+    返回前结束读事务：接下来要等缩略图生成，一直占着 SQLite 的共享锁会让别的请求写不了库，
+    排队的写请求又会挡住新的读请求。
+    """
+    try:
+        located: dict[str, tuple[Path, Path]] = {}
+        pending: list[str] = []
+        for rel in file_rel_paths:
+            location = thumb_paths.location(rel)
+            if location is None:
+                pending.append(rel)
+            else:
+                located[rel] = location
+
+        for start in range(0, len(pending), INDEXER_WRITE_CHUNK_SIZE):
+            rows = db.execute(
+                select(models.Image.file_rel_path, models.Project.folder_path)
+                .join(models.Project, models.Image.project_id == models.Project.id)
+                .where(models.Image.file_rel_path.in_(pending[start:start + INDEXER_WRITE_CHUNK_SIZE]))
+            ).all()
+            for rel, folder_path in rows:
+                project_dir = (MEDIA_ROOT / folder_path).resolve()
+                abs_image_path = (MEDIA_ROOT / rel).resolve()
+                thumb_paths.remember_location(rel, project_dir, abs_image_path)
+                located[rel] = (project_dir, abs_image_path)
+        return located
+    finally:
+        db.rollback()
+
+
+def record_generated(
+    db: Session,
+    generated: Iterable[tuple[str, str, Optional[Path]]],
+) -> dict[str, StoredThumb]:
+    """
+    把刚生成好的缩略图 [(file_rel_path, 版本名, 缩略图路径或 None), ...] 记入清单和内存路径缓存，
+    返回其中确实生成出来的 {file_rel_path: 存储里的缩略图}。
+    不在 MEDIA_ROOT 之下的（项目目录是指向库外的链接等）不记清单，下次仍走按需生成。
+    """
+    store = get_thumb_store()
+    entries = []
+    written: dict[str, StoredThumb] = {}
+    for rel, variant, thumb_path in generated:
+        if thumb_path is None:
+            continue
+        stored = store.stat(thumb_path)
+        if stored is None:
+            continue
+        written[rel] = stored
+        try:
+            entries.append((rel, variant, thumb_path.relative_to(MEDIA_ROOT).as_posix(), stored.size))
+        except ValueError:
+            continue
+        thumb_paths.remember_thumb(rel, variant, thumb_path)
+    record_thumbnails(db, entries)
+    return written
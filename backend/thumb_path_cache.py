@@ -0,0 +1,142 @@
+# backend/thumb_path_cache.py
+"""
+/thumbs 路由用的内存路径缓存：file_rel_path → (项目目录, 原图绝对路径, 各版本缩略图路径)。
+
+一页 100 张卡片就是 100 次 /thumbs 请求，每次都查缩略图清单、再查 Image 和懒加载 Project，
+数据库往返占了大头。缓存命中时 /thumbs 不碰数据库，只 stat 一次缩略图文件。
+
+- 写入：/thumbs 按需生成 / 查清单之后、后台预生成写清单时、同步发现新图片 / 原图变化时（只记项目目录）；
+- 失效：
+  · 同步发现原图变化：整条作废（缩略图要重新生成）；
+  · 单目录同步：该目录下的条目作废；整库同步删除了图片 / 项目或新增了项目（图片可能换了归属）：全部清空；
+  · 合并项目：被合并项目的图片作废（项目目录变了）；
+  · 缓存里的缩略图 stat 不到：该版本作废，走清单 / 按需生成；
+- 容量见 config.ini [thumbnails] path_cache_size，超出后按最近最少使用淘汰。
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional
+
+from config import MEDIA_ROOT, THUMB_PATH_CACHE_SIZE
+
+
+class CachedImagePaths:
+    __slots__ = ("project_dir", "abs_path", "thumbs")
+
+    def __init__(self) -> None:
+        # 项目目录 / 原图绝对路径：只查到过缩略图、还没走过按需生成时为 None
+        self.project_dir: Optional[Path] = None
+        self.abs_path: Optional[Path] = None
+        # 版本名（见 thumb_renditions.variant_name）→ 缩略图绝对路径
+        self.thumbs: dict[str, Path] = {}
+
+
+class ThumbPathCache:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedImagePaths]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, file_rel_path: str) -> CachedImagePaths:
+        """取出（没有则新建）一条并标记为最近使用；调用方持锁。"""
+        entry = self._entries.get(file_rel_path)
+        if entry is None:
+            entry = self._entries[file_rel_path] = CachedImagePaths()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(file_rel_path)
+        return entry
+
+    # ---------- 查询 ----------
+
+    def thumb_path(self, file_rel_path: str, variant: str) -> Optional[Path]:
+        with self._lock:
+            entry = self._entries.get(file_rel_path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(file_rel_path)
+            return entry.thumbs.get(variant)
+
+    def location(self, file_rel_path: str) -> Optional[tuple[Path, Path]]:
+        """(项目目录, 原图绝对路径)；没缓存时返回 None。"""
+        with self._lock:
+            entry = self._entries.get(file_rel_path)
+            if entry is None or entry.project_dir is None:
+                return None
+            self._entries.move_to_end(file_rel_path)
+            return entry.project_dir, entry.abs_path
+
+    # ---------- 写入 ----------
+
+    def remember_location(self, file_rel_path: str, project_dir: Path, abs_path: Path) -> None:
+        with self._lock:
+            entry = self._entry(file_rel_path)
+            if entry.project_dir != project_dir:
+                # 换了项目：旧项目 _thumbs 下的缩略图不再算数
+                entry.thumbs.clear()
+            entry.project_dir = project_dir
+            entry.abs_path = abs_path
+
+    def remember_thumb(self, file_rel_path: str, variant: str, thumb_path: Path) -> None:
+        with self._lock:
+            self._entry(file_rel_path).thumbs[variant] = thumb_path
+
+    def remember_changed_images(self, images: Iterable[tuple]) -> None:
+        """
+        同步发现的新图片 / 原图变化的图片（indexer.ImagesChangedCallback 的参数）：
+        旧的缩略图路径作废，只记下项目目录和原图路径。
+        路径和 /thumbs、/tiles 查库后记下的一样是 resolve() 过的（同一项目的目录只 resolve 一次），
+        否则 remember_location 会把同一个项目目录当成换了项目。
+        """
+        project_dirs: dict[str, Path] = {}
+        located = []
+        for file_rel_path, folder_path, *_ in images:
+            project_dir = project_dirs.get(folder_path)
+            if project_dir is None:
+                project_dir = project_dirs[folder_path] = (MEDIA_ROOT / folder_path).resolve()
+            located.append((file_rel_path, project_dir, (MEDIA_ROOT / file_rel_path).resolve()))
+
+        with self._lock:
+            for file_rel_path, project_dir, abs_path in located:
+                entry = self._entries.pop(file_rel_path, None)
+                if entry is None and len(self._entries) >= self.max_entries:
+                    # 缓存已满时不为还没人看过的图片挤掉正在用的条目
+                    continue
+                entry = self._entry(file_rel_path)
+                entry.project_dir = project_dir
+                entry.abs_path = abs_path
+
+    # ---------- 失效 ----------
+
+    def forget_thumb(self, file_rel_path: str, variant: str) -> None:
+        with self._lock:
+            entry = self._entries.get(file_rel_path)
+            if entry is not None:
+                entry.thumbs.pop(variant, None)
+
+    def invalidate(self, file_rel_paths: Iterable[str]) -> None:
+        with self._lock:
+            for file_rel_path in file_rel_paths:
+                self._entries.pop(file_rel_path, None)
+
+    def invalidate_prefix(self, folder_path: str) -> None:
+        """folder_path 目录（相对 MEDIA_ROOT，"." 表示整个库）下的条目全部作废。"""
+        if folder_path in ("", "."):
+            self.clear()
+            return
+        prefix = folder_path.rstrip("/") + "/"
+        with self._lock:
+            for file_rel_path in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[file_rel_path]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+thumb_paths = ThumbPathCache(THUMB_PATH_CACHE_SIZE)
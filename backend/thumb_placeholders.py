@@ -0,0 +1,199 @@
+# backend/thumb_placeholders.py
+"""
+加载占位（LQIP）：每张图一个十几像素的模糊小预览（WebP data: URI，几百字节）和主色调（#rrggbb），
+存在 images 表里，随 /api/projects（封面）和 /api/images 一起返回，
+前端先用它们铺底，真正的缩略图到了再盖上去，首屏不用等缩略图、也不多发请求。
+
+- 后台预生成缩略图时顺带计算（用刚编码好的最小那一档，不再解码原图，见 thumb_worker）；
+- 原图变化时清空（见 indexer._IndexWriter），跟着重新生成的缩略图一起更新；
+- 已有缩略图、但还没有占位的（按需生成的、升级前生成的），整库同步之后在后台补齐：
+  读清单里最小的一档缩略图来算，不碰共享盘上的原图。
+"""
+import io
+import logging
+import threading
+from base64 import b64encode
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+import models
+from config import INDEXER_WRITE_CHUNK_SIZE, MEDIA_ROOT, THUMB_PLACEHOLDER_SIZE
+from database import SessionLocal
+from thumb_inventory import source_changed
+from thumb_store import get_thumb_store
+
+logger = logging.getLogger(__name__)
+
+_images_table = models.Image.__table__
+_thumbs_table = models.Thumbnail.__table__
+
+
+# ========== 计算 ==========
+
+def make_placeholder(data: bytes) -> Optional[tuple[str, str]]:
+    """
+    从一张（缩略）图的文件内容算出 (小预览 data: URI, 主色调 #rrggbb)；解码失败返回 None。
+    主色调取缩成 4 色后像素最多的那一种，比直接求平均更接近人眼看到的底色。
+    """
+    from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
+
+    try:
+        with PILImage.open(io.BytesIO(data)) as im:
+            im.draft("RGB", (THUMB_PLACEHOLDER_SIZE * 4, THUMB_PLACEHOLDER_SIZE * 4))
+            small = im.convert("RGB")
+        small.thumbnail((THUMB_PLACEHOLDER_SIZE, THUMB_PLACEHOLDER_SIZE), PILImage.Resampling.BOX)
+
+        palette_image = small.quantize(colors=4)
+        palette = palette_image.getpalette()
+        counts = Counter(palette_image.getdata())
+        index = counts.most_common(1)[0][0]
+        r, g, b = palette[index * 3:index * 3 + 3]
+        color = f"#{r:02x}{g:02x}{b:02x}"
+
+        buf = io.BytesIO()
+        try:
+            small.save(buf, format="WEBP", quality=40)
+            mime = "image/webp"
+        except (KeyError, OSError):
+            # Pillow 没有 WebP 编码器时退回 JPEG
+            buf = io.BytesIO()
+            small.save(buf, format="JPEG", quality=50)
+            mime = "image/jpeg"
+    except Exception as e:
+        logger.warning("计算加载占位失败: %s", e)
+        return None
+
+    return f"data:{mime};base64,{b64encode(buf.getvalue()).decode('ascii')}", color
+
+
+# ========== 写入 ==========
+
+def record_placeholders(
+    db: Session,
+    entries: Iterable[tuple[str, str, str]],
+) -> None:
+    """写入占位并提交。entries：[(file_rel_path, 小预览 data: URI, 主色调), ...]。"""
+    rows = [
+        {"b_file_rel_path": rel, "b_placeholder": placeholder, "b_dominant_color": color}
+        for rel, placeholder, color in entries
+    ]
+    if not rows:
+        return
+
+    stmt = (
+        update(_images_table)
+        .where(_images_table.c.file_rel_path == bindparam("b_file_rel_path"))
+        .values(
+            placeholder=bindparam("b_placeholder"),
+            dominant_color=bindparam("b_dominant_color"),
+        )
+    )
+    for start in range(0, len(rows), INDEXER_WRITE_CHUNK_SIZE):
+        db.execute(stmt, rows[start:start + INDEXER_WRITE_CHUNK_SIZE])
+        db.commit()
+
+
+# ========== 后台补齐 ==========
+
+def fill_missing_placeholders(db: Session, stop: Optional[threading.Event] = None) -> dict:
+    """
+    给还没有占位、但清单里已有缩略图的图片补上占位（用最小的一档缩略图计算）。
+    按 id 分块进行，每块单独提交。返回 {"filled": n, "skipped": n}（skipped：没有缩略图或读不出来）。
+    """
+    store = get_thumb_store()
+    counts = {"filled": 0, "skipped": 0}
+
+    last_id = 0
+    while stop is None or not stop.is_set():
+        rows = db.execute(
+            select(
+                _images_table.c.id,
+                _images_table.c.file_rel_path,
+                _images_table.c.file_size,
+                _images_table.c.file_mtime_ns,
+            )
+            .where(_images_table.c.id > last_id)
+            .where(_images_table.c.placeholder.is_(None))
+            .order_by(_images_table.c.id)
+            .limit(INDEXER_WRITE_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        rels = [rel for _, rel, _, _ in rows]
+        versions = {rel: (file_size, mtime_ns) for _, rel, file_size, mtime_ns in rows}
+
+        # 每张图最小的一档缩略图（解码最快，信息量也足够）；原图被替换过的旧缩略图不算
+        smallest: dict[str, tuple[int, str]] = {}
+        for rel, thumb_rel_path, thumb_size, source_size, source_mtime_ns in db.execute(
+            select(
+                _thumbs_table.c.file_rel_path,
+                _thumbs_table.c.thumb_rel_path,
+                _thumbs_table.c.thumb_size,
+                _thumbs_table.c.source_size,
+                _thumbs_table.c.source_mtime_ns,
+            ).where(_thumbs_table.c.file_rel_path.in_(rels))
+        ).all():
+            if source_changed(source_size, source_mtime_ns, *versions[rel]):
+                continue
+            size = thumb_size if thumb_size is not None else float("inf")
+            if rel not in smallest or size < smallest[rel][0]:
+                smallest[rel] = (size, thumb_rel_path)
+        # 读存储、解码期间不占着 SQLite 的读事务
+        db.rollback()
+
+        entries = []
+        for rel in rels:
+            if rel not in smallest:
+                counts["skipped"] += 1
+                continue
+            result = None
+            stored = store.stat(MEDIA_ROOT / smallest[rel][1])
+            if stored is not None:
+                try:
+                    result = make_placeholder(store.read(stored))
+                except OSError:
+                    result = None
+            if result is None:
+                counts["skipped"] += 1
+                continue
+            entries.append((rel, *result))
+
+        record_placeholders(db, entries)
+        counts["filled"] += len(entries)
+
+    return counts
+
+
+_fill_lock = threading.Lock()
+_fill_stop = threading.Event()
+
+
+def _run_fill() -> None:
+    db = SessionLocal()
+    try:
+        counts = fill_missing_placeholders(db, stop=_fill_stop)
+        if counts["filled"]:
+            logger.info("加载占位补齐完成: 补上 %d 张，跳过 %d 张", counts["filled"], counts["skipped"])
+    except Exception:
+        db.rollback()
+        logger.exception("加载占位补齐失败")
+    finally:
+        db.close()
+        _fill_lock.release()
+
+
+def start_placeholder_pass() -> bool:
+    """在后台线程里补齐一次占位；已有补齐在跑时什么都不做。返回是否启动了新的补齐。"""
+    if not _fill_lock.acquire(blocking=False):
+        return False
+    _fill_stop.clear()
+    threading.Thread(target=_run_fill, name="caselib-thumb-placeholders", daemon=True).start()
+    return True
+
+
+def stop_placeholder_pass() -> None:
+    _fill_stop.set()
@@ -0,0 +1,200 @@
+# backend/thumb_renditions.py
+"""
+缩略图的多尺寸 / 多格式版本（rendition）：
+
+- 尺寸档位来自 config.ini [thumbnails] widths（长边像素），默认档位即原来的 THUMB_LONG_EDGE；
+- 格式按浏览器的 Accept 协商：AVIF / WebP（按 formats 的顺序，且 Pillow 有对应编码器），
+  都不接受时用 JPEG；
+- 路径都在原来的缩略图旁边（packed 存储以它为键，见 thumb_store）：
+    默认档位 + JPEG 回退   <project>/_thumbs/<子路径>/01.jpg          （即原来的缩略图）
+    其他档位 / 格式        <project>/_thumbs/<子路径>/01.jpg.w400.webp
+- 列表接口用 rendition_srcset 给出 srcset，浏览器按显示尺寸挑最小够用的一张；
+- 大图查看用的显示尺寸版本（display_long_edge）也是一个版本，由 /display 按需生成，
+  列表接口用 display_url 给出地址（原图本身就够小、浏览器能直接显示时就用原图）。
+"""
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from config import (
+    DISPLAY_LONG_EDGE,
+    THUMB_FORMATS,
+    THUMB_PREGENERATE_DISPLAY,
+    THUMB_PREGENERATE_WIDTHS,
+    THUMB_WIDTHS,
+)
+from http_cache import VERSION_PARAM
+from indexer import (
+    THUMB_LONG_EDGE,
+    _render_thumbnails,
+    ensure_thumb_for_image,
+    thumb_path_for_image,
+)
+from thumb_store import get_thumb_store
+
+try:
+    import pillow_avif  # noqa: F401  可选：给不带 AVIF 的 Pillow 注册 AVIF 编码器
+except ImportError:  # pragma: no cover - 取决于部署环境
+    pillow_avif = None
+
+# 所有档位（默认档位一定在内）
+RENDITION_WIDTHS: list[int] = sorted(set(THUMB_WIDTHS) | {THUMB_LONG_EDGE})
+
+# 格式 -> (Pillow 格式名, MIME, 文件扩展名)
+_FORMATS = {
+    "avif": ("AVIF", "image/avif", "avif"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+# 浏览器能直接显示的原图格式（不大于显示尺寸时不必另外生成显示版本）
+_WEB_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+@lru_cache(maxsize=None)
+def modern_formats() -> tuple[str, ...]:
+    """配置里启用、且当前 Pillow 能编码的新格式（按优先顺序）。"""
+    from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
+
+    PILImage.init()
+    return tuple(f for f in THUMB_FORMATS if _FORMATS[f][0] in PILImage.SAVE)
+
+
+def snap_width(w: Optional[int]) -> int:
+    """把请求的宽度归到档位上：不小于 w 的最小档位（超过最大档位时取最大档位）；不传时为默认档位。"""
+    if not w:
+        return THUMB_LONG_EDGE
+    for width in RENDITION_WIDTHS:
+        if width >= w:
+            return width
+    return RENDITION_WIDTHS[-1]
+
+
+def negotiate_format(accept: str) -> Optional[str]:
+    """
+    按 Accept 头挑格式："avif" / "webp"，都不接受时返回 None（JPEG 回退）。
+    只看是否列出了对应 MIME（浏览器不会给图片类型写 q=0）。
+    """
+    accept = (accept or "").lower()
+    for fmt in modern_formats():
+        if _FORMATS[fmt][1] in accept:
+            return fmt
+    return None
+
+
+def variant_name(width: int, fmt: Optional[str]) -> str:
+    """缩略图清单里的版本名：默认档位的 JPEG 回退为 ""（原来的缩略图），其余如 "w400.webp"。"""
+    if fmt is None and width == THUMB_LONG_EDGE:
+        return ""
+    return f"w{width}.{_FORMATS[fmt or 'jpeg'][2]}"
+
+
+def rendition_path(default_thumb: Path, width: int, fmt: Optional[str]) -> Path:
+    """由原来的缩略图路径得到某个版本的路径。"""
+    variant = variant_name(width, fmt)
+    if not variant:
+        return default_thumb
+    return default_thumb.with_name(f"{default_thumb.name}.{variant}")
+
+
+def rendition_targets(
+    default_thumb: Path,
+    widths: list[int],
+    fmt: Optional[str],
+) -> list[tuple[int, Path, Optional[str]]]:
+    """给 indexer._render_thumbnails 的 (长边, 路径, Pillow 格式名) 列表。"""
+    targets = []
+    for width in widths:
+        variant = variant_name(width, fmt)
+        pil_format = None if not variant else _FORMATS[fmt or "jpeg"][0]
+        targets.append((width, rendition_path(default_thumb, width, fmt), pil_format))
+    return targets
+
+
+def pregenerate_plan() -> tuple[list[int], Optional[str]]:
+    """后台预生成的档位与格式（第一个可用的新格式；没有时用 JPEG），按配置带上显示尺寸。"""
+    formats = modern_formats()
+    widths = list(THUMB_PREGENERATE_WIDTHS)
+    if THUMB_PREGENERATE_DISPLAY and DISPLAY_LONG_EDGE not in widths:
+        widths.append(DISPLAY_LONG_EDGE)
+    return widths, (formats[0] if formats else None)
+
+
+def _is_fresh(path: Path, src_mtime_ns: int) -> bool:
+    stored = get_thumb_store().stat(path)
+    return stored is not None and stored.mtime_ns >= src_mtime_ns
+
+
+def ensure_rendition(
+    abs_image_path: Path,
+    project_dir: Path,
+    width: int,
+    fmt: Optional[str],
+) -> Optional[Path]:
+    """
+    确保某个版本的缩略图存在（不存在或比原图旧时生成），返回其路径；失败时返回 None。
+    默认档位的 JPEG 回退就是原来的缩略图，交给 ensure_thumb_for_image。
+    """
+    if not variant_name(width, fmt):
+        return ensure_thumb_for_image(abs_image_path, project_dir)
+
+    default_thumb = thumb_path_for_image(abs_image_path, project_dir)
+    if default_thumb is None:
+        return None
+    dst = rendition_path(default_thumb, width, fmt)
+
+    try:
+        src_mtime_ns = os.stat(abs_image_path).st_mtime_ns
+    except OSError:
+        return None
+    if _is_fresh(dst, src_mtime_ns):
+        return dst
+
+    written = _render_thumbnails(abs_image_path, rendition_targets(default_thumb, [width], fmt))
+    return dst if written else None
+
+
+def rendition_srcset(
+    file_rel_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    version: Optional[str] = None,
+) -> str:
+    """
+    形如 "/thumbs/a.jpg?w=200 200w, /thumbs/a.jpg?w=400 400w, ..." 的 srcset。
+    原图尺寸已知时，w 描述符用实际缩出来的宽度，并且不列出比原图还大的档位（缩略图不放大）。
+    version 为缩略图版本号（见 http_cache.thumb_version），给出时每个 URL 都带上 &v=。
+    """
+    url = "/thumbs/" + quote(file_rel_path)
+    suffix = f"&{VERSION_PARAM}={version}" if version else ""
+    long_edge = max(width, height) if width and height else 0
+
+    parts = []
+    for edge in RENDITION_WIDTHS:
+        if long_edge and edge >= long_edge:
+            # 这一档及以上都等于原图尺寸：只列一次
+            parts.append(f"{url}?w={edge}{suffix} {width}w")
+            break
+        shown = round(width * edge / long_edge) if long_edge else edge
+        parts.append(f"{url}?w={edge}{suffix} {max(1, shown)}w")
+    return ", ".join(parts)
+
+
+def display_url(
+    file_rel_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    original_url: str,
+    version: Optional[str] = None,
+) -> str:
+    """
+    大图查看用的地址：原图尺寸已知、不大于显示尺寸且浏览器能直接显示时用原图地址 original_url，
+    否则为 /display/...（带 ?v=缩略图版本号）。
+    """
+    long_edge = max(width, height) if width and height else 0
+    if long_edge and long_edge <= DISPLAY_LONG_EDGE and Path(file_rel_path).suffix.lower() in _WEB_SUFFIXES:
+        return original_url
+    url = "/display/" + quote(file_rel_path)
+    return f"{url}?{VERSION_PARAM}={version}" if version else url
@@ -0,0 +1,557 @@
+# backend/thumb_store.py
+"""
+缩略图存储后端（config.ini [thumbnails] store）。
+
+缩略图按“键”存取：键就是原来 _thumbs 布局下的缩略图路径
+（<project>/_thumbs/<子路径>/01.jpg.w400.webp，见 indexer.thumb_path_for_image / thumb_renditions.rendition_path）。
+缩略图清单（thumb_rel_path）和 /thumbs 的路径缓存记的都是这个键，换后端不用改它们。
+
+- folder（默认）：键就是文件本身，写在项目目录的 _thumbs 下（共享盘上），先写临时文件再改名；
+- packed：服务器本地的打包存储（store_dir）：
+  · 缩略图依次追加到 pack-000001.pack 这样的大文件里，每条记录自带键、长度和写入时间，
+    启动时顺序扫一遍记录头重建内存索引（写了一半的尾部记录截掉），不需要另外的索引文件；
+  · 读取走 mmap，/thumbs 不再访问共享盘，共享盘上也不再堆几万个小文件；
+  · 总大小超过 store_max_mb 时，写入的线程只按最近最少使用淘汰（改内存索引、给每个淘汰的键追加一条墓碑，
+    重启后不会复活）；整理 pack 文件和删除对应的清单行都交给存储自己的后台整理线程：
+    只整理有效内容不到一半的 pack（从旧到新，每个 pack 单独持锁），所以磁盘占用是软上限，
+    最坏约为 store_max_mb 的 1.6 倍；被淘汰的缩略图下次请求时按需重新生成；
+  · 只在 Web 进程里写：后台预生成的子进程只负责编码，内容带回主进程写入（见 thumb_worker）。
+"""
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+
+from config import (
+    MEDIA_ROOT,
+    THUMB_STORE,
+    THUMB_STORE_DIR,
+    THUMB_STORE_MAX_BYTES,
+    THUMB_STORE_PACK_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StoredThumb(NamedTuple):
+    """存储里的一张缩略图：内容在 path 文件的 [offset, offset + size) 范围内。"""
+
+    key: Path
+    path: Path
+    offset: int
+    size: int
+    # 写入时间：比原图 mtime 旧就要重新生成
+    mtime_ns: int
+
+
+class ThumbStore(ABC):
+    """存储后端的接口（缺了哪个抽象方法，构造时就会报错）；所有方法都可以在多个线程里同时调用。"""
+
+    name = ""
+    # 后台预生成的子进程能否直接读写（否则子进程只编码，由 Web 进程写入）
+    shared_between_processes = False
+
+    @abstractmethod
+    def stat(self, key: Path) -> Optional[StoredThumb]:
+        """存储里的缩略图；没有时返回 None。"""
+
+    @abstractmethod
+    def read(self, thumb: StoredThumb) -> bytes:
+        """读取内容；缩略图已被删除 / 淘汰时抛 OSError。"""
+
+    @abstractmethod
+    def put(self, key: Path, data: bytes) -> StoredThumb:
+        """写入（覆盖同一个键的旧内容），返回写好的缩略图。"""
+
+    @abstractmethod
+    def delete(self, key: Path) -> None:
+        """删除；不存在时什么都不做。"""
+
+    @abstractmethod
+    def scan(self) -> Iterator[StoredThumb]:
+        """列出存储里的所有内容（清理孤立缩略图用，见 thumb_gc）。"""
+
+    def compact(self) -> int:
+        """大量删除之后整理存储，返回腾出的磁盘字节数（直接删文件的后端不需要整理）。"""
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+# ========== folder：项目目录下的 _thumbs ==========
+
+# 同 indexer.THUMB_DIR_NAME（indexer 依赖本模块，不能反过来导入）
+_THUMB_DIR_NAME = "_thumbs"
+
+
+class FolderThumbStore(ThumbStore):
+    name = "folder"
+    shared_between_processes = True
+
+    def stat(self, key: Path) -> Optional[StoredThumb]:
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        return StoredThumb(key, key, 0, st.st_size, st.st_mtime_ns)
+
+    def read(self, thumb: StoredThumb) -> bytes:
+        with open(thumb.path, "rb") as f:
+            return f.read()
+
+    def put(self, key: Path, data: bytes) -> StoredThumb:
+        """
+        写到同目录下的临时文件（以 . 开头、.tmp 结尾），写完再 os.replace 成 key；失败时删掉临时文件。
+        并发写同一张缩略图时谁后写完谁生效，读的一方不会看到写了一半的文件。
+        """
+        key.parent.mkdir(parents=True, exist_ok=True)
+        tmp = key.with_name(f".{key.name}.{uuid.uuid4().hex[:12]}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, key)
+        except BaseException:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            raise
+        st = os.stat(key)
+        return StoredThumb(key, key, 0, st.st_size, st.st_mtime_ns)
+
+    def delete(self, key: Path) -> None:
+        try:
+            key.unlink()
+        except FileNotFoundError:
+            pass
+
+    def scan(self) -> Iterator[StoredThumb]:
+        """
+        遍历 MEDIA_ROOT 下所有 _thumbs 目录里的文件（含写了一半留下的 .*.tmp 临时文件），
+        不跟随符号链接。要把整个共享盘的目录走一遍，开销很大；清理孤立缩略图用的是 scan_dirs。
+        """
+        return self._walk(str(MEDIA_ROOT), False)
+
+    def scan_dirs(self, thumb_dirs: Iterable[Path]) -> Iterator[StoredThumb]:
+        """只遍历给定的这些 _thumbs 目录（不存在的跳过），不碰共享盘上的其他目录。"""
+        for thumb_dir in thumb_dirs:
+            yield from self._walk(str(thumb_dir), True, missing_ok=True)
+
+    @staticmethod
+    def _walk(top: str, in_thumbs: bool, missing_ok: bool = False) -> Iterator[StoredThumb]:
+        stack: list[tuple[str, bool]] = [(top, in_thumbs)]
+        while stack:
+            path, in_thumbs = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except FileNotFoundError:
+                if not missing_ok:
+                    logger.warning("列目录失败: %s (不存在)", path)
+                continue
+            except OSError as e:
+                logger.warning("列目录失败: %s (%s)", path, e)
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, in_thumbs or entry.name == _THUMB_DIR_NAME))
+                        continue
+                    if not in_thumbs or not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                key = Path(entry.path)
+                yield StoredThumb(key, key, 0, st.st_size, st.st_mtime_ns)
+
+
+# ========== packed：服务器本地的打包存储 ==========
+
+# 记录：[魔数 4 字节][键长度 2 字节][内容长度 4 字节][写入时间 ns 8 字节][键 UTF-8][内容]
+# 内容长度为 0 的记录表示删除（墓碑），重建索引时把前面同一个键的记录作废
+_RECORD_MAGIC = b"CLT1"
+_RECORD_HEADER = struct.Struct(">4sHIq")
+
+_PACK_NAME = re.compile(r"^pack-(\d{6})\.pack$")
+
+# 超出容量时一次清到容量的这个比例以下，避免每写一张就整理一次
+_LOW_WATER = 0.8
+# compact() 整理有效内容不到这个比例的 pack 文件
+_SPARSE_RATIO = 0.5
+
+
+class _PackEntry:
+    __slots__ = ("pack", "offset", "size", "mtime_ns", "record_size")
+
+    def __init__(self, pack: int, offset: int, size: int, mtime_ns: int, record_size: int) -> None:
+        self.pack = pack
+        self.offset = offset
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.record_size = record_size
+
+
+def _key_str(key: Path) -> str:
+    """索引里的键：相对 MEDIA_ROOT 的 posix 路径（不在库里时用绝对路径）。"""
+    try:
+        return key.relative_to(MEDIA_ROOT).as_posix()
+    except ValueError:
+        return key.as_posix()
+
+
+class PackedThumbStore(ThumbStore):
+    name = "packed"
+
+    def __init__(self, root: Path, max_bytes: int, pack_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pack_bytes = pack_bytes
+
+        self._lock = threading.Lock()
+        # 键 -> 记录位置，按最近使用排序（最久没用的在最前）
+        self._entries: "OrderedDict[str, _PackEntry]" = OrderedDict()
+        # pack 编号 -> 文件大小 / 其中有效记录的字节数
+        self._pack_sizes: dict[int, int] = {}
+        self._pack_live: dict[int, int] = {}
+        # 被删除的键 -> 墓碑所在的 pack（整理 pack 时墓碑要跟着搬，见 _compact）
+        self._tombstones: dict[str, int] = {}
+        self._maps: dict[int, mmap.mmap] = {}
+        self._active: Optional[int] = None
+        self._active_file = None
+        # 淘汰了、还没通知清单的键；后台整理线程是否在跑 / 存储是否已关闭
+        self._evicted: list[str] = []
+        self._maintaining = False
+        self._closed = False
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _pack_path(self, pack: int) -> Path:
+        return self.root / f"pack-{pack:06d}.pack"
+
+    # ---------- 启动时重建索引 ----------
+
+    def _load(self) -> None:
+        packs = sorted(
+            int(m.group(1))
+            for m in (_PACK_NAME.match(p.name) for p in self.root.iterdir())
+            if m is not None
+        )
+        for pack in packs:
+            self._pack_sizes[pack] = self._scan_pack(pack)
+            self._pack_live.setdefault(pack, 0)
+        if packs:
+            self._active = packs[-1]
+        logger.info(
+            "缩略图打包存储：%d 个 pack 文件，%d 张缩略图，共 %.1f MB",
+            len(packs), len(self._entries), self._disk_bytes() / 1024 / 1024,
+        )
+
+    def _scan_pack(self, pack: int) -> int:
+        """读一遍 pack 文件的记录头，登记到索引；返回有效长度（截掉写了一半的尾部）。"""
+        path = self._pack_path(pack)
+        with open(path, "r+b") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + _RECORD_HEADER.size <= file_size:
+                f.seek(offset)
+                magic, key_len, data_len, mtime_ns = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                end = offset + _RECORD_HEADER.size + key_len + data_len
+                if magic != _RECORD_MAGIC or end > file_size:
+                    break
+                key = f.read(key_len).decode("utf-8", errors="replace")
+                if data_len:
+                    data_offset = offset + _RECORD_HEADER.size + key_len
+                    self._set(key, _PackEntry(pack, data_offset, data_len, mtime_ns, end - offset))
+                else:
+                    self._drop(key)
+                    self._tombstones[key] = pack
+                offset = end
+            if offset < file_size:
+                logger.warning("缩略图 pack 文件尾部不完整，截掉 %d 字节: %s", file_size - offset, path)
+                f.truncate(offset)
+        return offset
+
+    # ---------- 索引（调用方持锁） ----------
+
+    def _set(self, key: str, entry: _PackEntry) -> None:
+        self._drop(key)
+        # 有了更新的记录，旧墓碑就不再需要了
+        self._tombstones.pop(key, None)
+        self._entries[key] = entry
+        self._pack_live[entry.pack] = self._pack_live.get(entry.pack, 0) + entry.record_size
+
+    def _drop(self, key: str) -> Optional[_PackEntry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._pack_live[entry.pack] -= entry.record_size
+        return entry
+
+    def _disk_bytes(self) -> int:
+        return sum(self._pack_sizes.values())
+
+    def _live_bytes(self) -> int:
+        return sum(self._pack_live.values())
+
+    def _thumb(self, key: Path, entry: _PackEntry) -> StoredThumb:
+        return StoredThumb(key, self._pack_path(entry.pack), entry.offset, entry.size, entry.mtime_ns)
+
+    # ---------- 读写文件（调用方持锁） ----------
+
+    def _append(self, key: str, data: bytes, mtime_ns: int) -> _PackEntry:
+        """把一条记录追加到当前 pack（写满时换新文件），返回它的位置。"""
+        if self._active is None or self._pack_sizes[self._active] >= self.pack_bytes:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            self._active = (max(self._pack_sizes) + 1) if self._pack_sizes else 1
+            self._pack_sizes[self._active] = 0
+            self._pack_live[self._active] = 0
+        if self._active_file is None:
+            self._active_file = open(self._pack_path(self._active), "ab")
+
+        key_bytes = key.encode("utf-8")
+        offset = self._pack_sizes[self._active]
+        self._active_file.write(
+            _RECORD_HEADER.pack(_RECORD_MAGIC, len(key_bytes), len(data), mtime_ns) + key_bytes
+        )
+        self._active_file.write(data)
+        self._active_file.flush()
+
+        record_size = _RECORD_HEADER.size + len(key_bytes) + len(data)
+        self._pack_sizes[self._active] = offset + record_size
+        return _PackEntry(
+            self._active, offset + _RECORD_HEADER.size + len(key_bytes), len(data), mtime_ns, record_size
+        )
+
+    def _read(self, pack: int, offset: int, size: int) -> bytes:
+        """用 mmap 读一段内容；当前 pack 还在追加，映射不够长时重新映射。"""
+        m = self._maps.get(pack)
+        if m is None or len(m) < offset + size:
+            if m is not None:
+                m.close()
+                del self._maps[pack]
+            with open(self._pack_path(pack), "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[pack] = m
+            if len(m) < offset + size:
+                raise OSError(f"超出 pack 文件范围: {self._pack_path(pack)}")
+        return m[offset:offset + size]
+
+    def _remove_pack(self, pack: int) -> None:
+        m = self._maps.pop(pack, None)
+        if m is not None:
+            # Windows 上映射着的文件删不掉
+            m.close()
+        try:
+            self._pack_path(pack).unlink()
+        except OSError as e:
+            logger.warning("删除缩略图 pack 文件失败: %s (%s)", self._pack_path(pack), e)
+        self._pack_sizes.pop(pack, None)
+        self._pack_live.pop(pack, None)
+
+    def _compact(self, pack: int) -> None:
+        """
+        把 pack 里的有效记录搬到当前 pack（保持最近使用顺序），然后删掉这个文件。
+        其中的墓碑：还有更旧的 pack 时一起搬过去（被删的记录可能还在旧 pack 里，重启后不能复活），
+        这已经是最旧的 pack 时直接丢掉。
+        """
+        for key, entry in [(k, e) for k, e in self._entries.items() if e.pack == pack]:
+            data = self._read(pack, entry.offset, entry.size)
+            moved = self._append(key, data, entry.mtime_ns)
+            # 直接替换值，OrderedDict 里的位置不变
+            self._entries[key] = moved
+            self._pack_live[moved.pack] += moved.record_size
+        has_older = min(self._pack_sizes) < pack
+        for key in [k for k, p in self._tombstones.items() if p == pack]:
+            if has_older:
+                self._tombstones[key] = self._append(key, b"", 0).pack
+            else:
+                del self._tombstones[key]
+        self._remove_pack(pack)
+
+    def _enforce_budget(self) -> None:
+        """
+        超出容量时淘汰最近最少使用的缩略图，直到有效内容降到低水位以下。
+        只改内存索引、追加墓碑（写入的请求线程里做，代价很小）；
+        腾出磁盘空间（整理 pack）和删清单行交给后台整理线程（见 _maintain）。
+        """
+        if self._disk_bytes() <= self.max_bytes:
+            return
+        low_water = int(self.max_bytes * _LOW_WATER)
+
+        evicted = []
+        while self._entries and self._live_bytes() > low_water:
+            key, entry = self._entries.popitem(last=False)
+            self._pack_live[entry.pack] -= entry.record_size
+            # 旧记录还在 pack 里，写一条墓碑，重启后不会复活
+            self._tombstones[key] = self._append(key, b"", 0).pack
+            evicted.append(key)
+        if not evicted:
+            return
+
+        logger.info(
+            "缩略图打包存储超出容量：淘汰 %d 张，有效内容 %.1f MB，磁盘占用 %.1f MB",
+            len(evicted), self._live_bytes() / 1024 / 1024, self._disk_bytes() / 1024 / 1024,
+        )
+        self._evicted.extend(evicted)
+        if not self._maintaining and not self._closed:
+            self._maintaining = True
+            threading.Thread(
+                target=self._maintain, name="caselib-thumb-pack-compact", daemon=True
+            ).start()
+
+    def _maintain(self) -> None:
+        """后台整理线程：通知清单删掉淘汰的行，整理稀疏的 pack；期间又有淘汰时再来一轮。"""
+        while True:
+            with self._lock:
+                evicted, self._evicted = self._evicted, []
+                if not evicted or self._closed:
+                    self._maintaining = False
+                    return
+            if _eviction_listener is not None:
+                try:
+                    _eviction_listener(evicted)
+                except Exception:
+                    logger.exception("通知缩略图淘汰失败")
+            freed = self.compact()
+            if freed:
+                logger.info("缩略图打包存储整理完成：腾出 %.1f MB", freed / 1024 / 1024)
+
+    # ---------- 接口 ----------
+
+    def stat(self, key: Path) -> Optional[StoredThumb]:
+        with self._lock:
+            k = _key_str(key)
+            entry = self._entries.get(k)
+            if entry is None:
+                return None
+            self._entries.move_to_end(k)
+            return self._thumb(key, entry)
+
+    def read(self, thumb: StoredThumb) -> bytes:
+        match = _PACK_NAME.match(thumb.path.name)
+        if match is None:
+            raise OSError(f"不是缩略图 pack 文件: {thumb.path}")
+        with self._lock:
+            pack = int(match.group(1))
+            if pack not in self._pack_sizes:
+                raise FileNotFoundError(f"缩略图已被淘汰: {thumb.key}")
+            return self._read(pack, thumb.offset, thumb.size)
+
+    def put(self, key: Path, data: bytes) -> StoredThumb:
+        if not data:
+            raise ValueError("缩略图内容为空")
+        with self._lock:
+            k = _key_str(key)
+            entry = self._append(k, data, time.time_ns())
+            self._set(k, entry)
+            self._enforce_budget()
+            return self._thumb(key, entry)
+
+    def delete(self, key: Path) -> None:
+        with self._lock:
+            k = _key_str(key)
+            if self._drop(k) is not None:
+                # 写一条墓碑，重启后这条缩略图不会复活
+                self._tombstones[k] = self._append(k, b"", 0).pack
+
+    def scan(self) -> Iterator[StoredThumb]:
+        """索引里的所有缩略图（取一份快照，不影响最近使用顺序）。"""
+        with self._lock:
+            snapshot = [
+                self._thumb(Path(k) if os.path.isabs(k) else MEDIA_ROOT / k, entry)
+                for k, entry in self._entries.items()
+            ]
+        yield from snapshot
+
+    def compact(self) -> int:
+        """
+        把有效内容不到一半的已写满 pack 整理掉（从旧到新），返回腾出的磁盘字节数。
+        每个 pack 单独持锁：整理期间别的读写最多等一个 pack 的搬运。
+        """
+        freed = 0
+        done: set[int] = set()
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                pack = next(
+                    (
+                        p for p in sorted(self._pack_sizes)
+                        if p != self._active
+                        and p not in done
+                        and self._pack_live[p] < self._pack_sizes[p] * _SPARSE_RATIO
+                    ),
+                    None,
+                )
+                if pack is None:
+                    break
+                done.add(pack)
+                before = self._disk_bytes()
+                self._compact(pack)
+                freed += before - self._disk_bytes()
+        return freed
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for m in self._maps.values():
+                m.close()
+            self._maps.clear()
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+
+
+# ========== 全局实例 ==========
+
+_store: Optional[ThumbStore] = None
+_store_lock = threading.Lock()
+
+# packed 存储淘汰缩略图之后的通知（参数为淘汰的键，相对 MEDIA_ROOT 的 posix 路径），
+# 由缩略图清单注册（见 thumb_inventory），在存储的后台整理线程里调用
+_eviction_listener: Optional[Callable[[list[str]], None]] = None
+
+
+def set_eviction_listener(listener: Optional[Callable[[list[str]], None]]) -> None:
+    global _eviction_listener
+    _eviction_listener = listener
+
+
+def get_thumb_store() -> ThumbStore:
+    """按 config.ini 创建的存储后端（第一次用到时才创建：packed 要扫一遍 pack 文件）。"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if THUMB_STORE == "packed":
+                _store = PackedThumbStore(THUMB_STORE_DIR, THUMB_STORE_MAX_BYTES, THUMB_STORE_PACK_BYTES)
+            else:
+                _store = FolderThumbStore()
+        return _store
+
+
+def set_thumb_store(store: ThumbStore) -> None:
+    """换成指定的存储后端（基准测试等）。"""
+    global _store
+    with _store_lock:
+        if _store is not None and _store is not store:
+            _store.close()
+        _store = store
+
+
+def close_thumb_store() -> None:
+    """关闭服务时调用：释放 mmap 和打开的 pack 文件。"""
+    with _store_lock:
+        if _store is not None:
+            _store.close()
@@ -0,0 +1,332 @@
+# backend/thumb_tiles.py
+"""
+超大图的分块金字塔（Deep Zoom / DZI）：图纸、全景这类上亿像素的图片，显示尺寸版本（/display）看不清细节，
+大图查看放大以后改为只加载视野里的分块。
+
+- 像素数不小于 config.ini [thumbnails] deepzoom_min_megapixels 的图片，列表接口给出 dzi_url；
+- GET /tiles/<file_rel_path>.dzi                         DZI 描述（XML：原图尺寸、分块边长、格式）
+  GET /tiles/<file_rel_path>_files/<层>/<列>_<行>.jpg    分块（与 OpenSeadragon 等查看器的约定相同）
+- 金字塔最高一层一般就是原图尺寸；原图超过 deepzoom_max_level_megapixels 时，最高层为原图按 2 的幂缩小
+  （DZI 里声明的就是这个尺寸），生成最高层时不用把整张原图按原尺寸解码成 RGB；
+- 第 L 层的尺寸为最高层按 2^(最大层 - L) 缩小（向上取整），最大层 = ceil(log2(长边))，分块之间不重叠；
+- 分块按需生成：JPEG 原图某一层第一次被请求时，在专用线程池里按这一层的尺寸缩小解码一次原图
+  （DCT 缩放，见 indexer._decode_for_thumbnails），整层切块写进缩略图存储，
+  之后同一层的分块都直接命中；同一层的并发请求只生成一次；
+- 其他格式（PNG / TIFF 等）没法缩小解码，每次都要整张解码原图：任何一层第一次被请求时，
+  整张解码一次原图、缩成最高层，再由最高层逐层缩小生成整个金字塔，低层不再从原图生成；
+  原图超过 max_full_decode_megapixels 时不生成。每个分块线程最坏占用约为
+  最高层像素数 × 3 字节 × 2（64 百万像素约 400 MB），非 JPEG 另加整张原图（像素数 × 4 字节，默认上限约 1 GB）；
+- 分块的键在缩略图旁边：<project>/_thumbs/<子路径>/big.tif.tiles/<层>/<列>_<行>.jpg；
+  比原图旧的（按索引里的 file_mtime_ns 判断，不碰共享盘）重新生成。
+"""
+import asyncio
+import io
+import logging
+import math
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from config import (
+    DEEPZOOM_MAX_LEVEL_PIXELS,
+    DEEPZOOM_MIN_PIXELS,
+    DEEPZOOM_TILE_SIZE,
+    DEEPZOOM_TILE_WORKERS,
+    MEDIA_ROOT,
+    THUMB_JPEG_QUALITY,
+    THUMB_RESAMPLE,
+)
+from database import SessionLocal
+from http_cache import VERSION_PARAM, cache_control, cached_blob_response
+from indexer import _decode_for_thumbnails, is_scaled_decode, open_library_image, thumb_path_for_image
+from thumb_path_cache import thumb_paths
+from thumb_store import StoredThumb, get_thumb_store
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/tiles", tags=["thumbs"])
+
+_TILE_PATH = re.compile(r"^(?P<rel>.+)_files/(?P<level>\d+)/(?P<col>\d+)_(?P<row>\d+)\.jpg$")
+
+_DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+    'TileSize="{tile_size}" Overlap="0" Format="jpg">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+class TileSource(NamedTuple):
+    """生成分块需要的原图信息（来自索引）。"""
+    abs_image_path: Path
+    # 原图的缩略图键，分块的键由它派生（见 tile_key）
+    default_thumb: Path
+    # 金字塔最高一层的尺寸（见 pyramid_size），不一定是原图尺寸
+    width: int
+    height: int
+    mtime_ns: Optional[int]
+
+
+# ========== 金字塔的几何 ==========
+
+def needs_tiles(width: Optional[int], height: Optional[int]) -> bool:
+    """原图够大、值得做分块金字塔（deepzoom_min_megapixels = 0 时关闭）。"""
+    return bool(DEEPZOOM_MIN_PIXELS and width and height and width * height >= DEEPZOOM_MIN_PIXELS)
+
+
+def pyramid_size(width: int, height: int) -> tuple[int, int]:
+    """金字塔最高一层的尺寸：原图超过 deepzoom_max_level_megapixels 时逐次减半（向上取整）。"""
+    while DEEPZOOM_MAX_LEVEL_PIXELS and width * height > DEEPZOOM_MAX_LEVEL_PIXELS and max(width, height) > 1:
+        width, height = math.ceil(width / 2), math.ceil(height / 2)
+    return width, height
+
+
+def max_level(width: int, height: int) -> int:
+    return max(0, math.ceil(math.log2(max(width, height))))
+
+
+def level_size(width: int, height: int, level: int) -> tuple[int, int]:
+    scale = 2 ** (max_level(width, height) - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def tile_key(default_thumb: Path, level: int, col: int, row: int) -> Path:
+    """分块在缩略图存储里的键（在原来的缩略图旁边）。"""
+    return default_thumb.with_name(f"{default_thumb.name}.tiles") / str(level) / f"{col}_{row}.jpg"
+
+
+def dzi_url(
+    file_rel_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    version: Optional[str] = None,
+) -> Optional[str]:
+    """列表接口里的 DZI 描述地址；不需要分块的图片为 None。"""
+    if not needs_tiles(width, height):
+        return None
+    url = "/tiles/" + quote(file_rel_path) + ".dzi"
+    return f"{url}?{VERSION_PARAM}={version}" if version else url
+
+
+# ========== 生成（专用线程池 + 同一层只生成一次） ==========
+
+def render_level(source: TileSource, level: int) -> bool:
+    """
+    按第 level 层的尺寸解码一次原图，整层切块写进缩略图存储。返回是否成功。
+    不能缩小解码的格式改为生成整个金字塔（见 _render_pyramid）。
+    原图超过像素数上限时失败（见 indexer.open_library_image）。
+    """
+    from PIL import Image as PILImage  # 延迟导入，避免无 Pillow 时模块级导入失败
+
+    resample = getattr(PILImage.Resampling, THUMB_RESAMPLE.upper())
+    size = level_size(source.width, source.height, level)
+    try:
+        with open_library_image(source.abs_image_path) as im:
+            whole = not is_scaled_decode(im)
+            if whole:
+                size = (source.width, source.height)
+            base, _ = _decode_for_thumbnails(im, max(size))
+            if base.size != size:
+                base = base.resize(size, resample)
+            # 原图本身就是这一层的尺寸时 base 还没解码：在文件关闭之前解码
+            base.load()
+    except Exception as e:
+        logger.warning("生成分块失败 (%s, 第 %d 层): %s", source.abs_image_path, level, e)
+        return False
+
+    if whole:
+        return _render_pyramid(source, base, resample)
+    return _write_level(source, level, base)
+
+
+def _render_pyramid(source: TileSource, top, resample) -> bool:
+    """由最高层（已解码的 top）逐层缩小生成整个金字塔，不再读原图。"""
+    base = top
+    for level in range(max_level(source.width, source.height), -1, -1):
+        size = level_size(source.width, source.height, level)
+        if base.size != size:
+            base = base.resize(size, resample)
+        if not _write_level(source, level, base):
+            return False
+    return True
+
+
+def _write_level(source: TileSource, level: int, base) -> bool:
+    """把这一层的整图 base 切块写进缩略图存储。"""
+    store = get_thumb_store()
+    tile = DEEPZOOM_TILE_SIZE
+    width, height = base.size
+    try:
+        for row in range(math.ceil(height / tile)):
+            for col in range(math.ceil(width / tile)):
+                box = (col * tile, row * tile, min(width, (col + 1) * tile), min(height, (row + 1) * tile))
+                buf = io.BytesIO()
+                base.crop(box).save(buf, format="JPEG", quality=THUMB_JPEG_QUALITY)
+                store.put(tile_key(source.default_thumb, level, col, row), buf.getvalue())
+    except Exception as e:
+        logger.warning("写入分块失败 (%s, 第 %d 层): %s", source.abs_image_path, level, e)
+        return False
+    return True
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=DEEPZOOM_TILE_WORKERS, thread_name_prefix="caselib-thumb-tiles"
+)
+
+# (原图绝对路径, 层) -> 正在进行的生成（做法同 thumb_ondemand）；
+# 一次生成整个金字塔的原图（按后缀判断，见 _in_flight_key）层记为 -1
+_in_flight: dict[tuple[str, int], Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _forget(key: tuple, future: Future) -> None:
+    with _in_flight_lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+
+
+# 按层生成的原图后缀（JPEG，能缩小解码）；其他格式任何一层都生成整个金字塔
+_PER_LEVEL_SUFFIXES = {".jpg", ".jpeg"}
+
+
+def _in_flight_key(source: TileSource, level: int) -> tuple[str, int]:
+    if source.abs_image_path.suffix.lower() not in _PER_LEVEL_SUFFIXES:
+        level = -1
+    return str(source.abs_image_path), level
+
+
+async def generate_level(source: TileSource, level: int) -> bool:
+    key = _in_flight_key(source, level)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = _executor.submit(render_level, source, level)
+            _in_flight[key] = future
+            created = True
+        else:
+            created = False
+    if created:
+        future.add_done_callback(lambda f: _forget(key, f))
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+def stop_tile_generation() -> None:
+    """关闭服务时调用：不再接新任务，丢掉还没开始的任务。"""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ========== 路由 ==========
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _tile_source(db: Session, file_rel_path: str) -> TileSource:
+    """索引里的原图信息；不存在或不需要分块时 404。返回前结束读事务（接下来可能要等整层生成）。"""
+    try:
+        row = db.execute(
+            select(
+                models.Project.folder_path,
+                models.Image.width,
+                models.Image.height,
+                models.Image.file_mtime_ns,
+            )
+            .join(models.Project, models.Image.project_id == models.Project.id)
+            .where(models.Image.file_rel_path == file_rel_path)
+        ).first()
+    finally:
+        db.rollback()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    folder_path, width, height, mtime_ns = row
+    if not needs_tiles(width, height):
+        raise HTTPException(status_code=404, detail="Image has no tile pyramid")
+
+    # 项目目录 / 原图路径先查内存路径缓存，省掉共享盘上的 resolve
+    location = thumb_paths.location(file_rel_path)
+    if location is None:
+        location = ((MEDIA_ROOT / folder_path).resolve(), (MEDIA_ROOT / file_rel_path).resolve())
+        thumb_paths.remember_location(file_rel_path, *location)
+    project_dir, abs_image_path = location
+    default_thumb = thumb_path_for_image(abs_image_path, project_dir)
+    if default_thumb is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return TileSource(abs_image_path, default_thumb, *pyramid_size(width, height), mtime_ns)
+
+
+def _find_tile(source: TileSource, level: int, col: int, row: int) -> Optional[StoredThumb]:
+    """存储里不比原图旧的分块；没有时返回 None。"""
+    stored = get_thumb_store().stat(tile_key(source.default_thumb, level, col, row))
+    if stored is None or (source.mtime_ns is not None and stored.mtime_ns < source.mtime_ns):
+        return None
+    return stored
+
+
+@router.get("/{path:path}")
+async def get_tile(
+    path: str,
+    request: Request,
+    v: Optional[str] = Query(None, description="缩略图版本号（列表接口给出），带上时长期缓存"),
+    db: Session = Depends(get_db),
+):
+    """DZI 描述（<file_rel_path>.dzi）或分块（<file_rel_path>_files/<层>/<列>_<行>.jpg），见模块说明。"""
+    versioned = bool(v)
+    if path.endswith(".dzi"):
+        source = await run_in_threadpool(_tile_source, db, path[: -len(".dzi")])
+        body = _DZI_TEMPLATE.format(
+            tile_size=DEEPZOOM_TILE_SIZE, width=source.width, height=source.height
+        )
+        return Response(
+            content=body,
+            media_type="application/xml",
+            headers={"Cache-Control": cache_control(versioned)},
+        )
+
+    match = _TILE_PATH.match(path)
+    if match is None:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    level, col, row = int(match["level"]), int(match["col"]), int(match["row"])
+
+    source = await run_in_threadpool(_tile_source, db, match["rel"])
+    if level > max_level(source.width, source.height):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    level_w, level_h = level_size(source.width, source.height, level)
+    if col * DEEPZOOM_TILE_SIZE >= level_w or row * DEEPZOOM_TILE_SIZE >= level_h:
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    stored = await run_in_threadpool(_find_tile, source, level, col, row)
+    if stored is None:
+        if not await generate_level(source, level):
+            raise HTTPException(status_code=500, detail="Failed to render tiles")
+        stored = await run_in_threadpool(_find_tile, source, level, col, row)
+        if stored is None:
+            # 刚写完就被 packed 存储淘汰了（容量设得太小）
+            raise HTTPException(status_code=503, detail="Tile evicted, retry")
+
+    try:
+        return await run_in_threadpool(
+            cached_blob_response,
+            request.headers,
+            lambda: get_thumb_store().read(stored),
+            stored.size,
+            stored.mtime_ns,
+            "image/jpeg",
+            None,
+            versioned,
+        )
+    except OSError:
+        raise HTTPException(status_code=503, detail="Tile evicted, retry")
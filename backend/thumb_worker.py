@@ -0,0 +1,510 @@
+# backend/thumb_worker.py
+"""
+缩略图后台预生成：同步发现新图片 / 原图变化后，把它们放进一个优先队列，
+由后台进程池（Pillow 解码 / 缩放吃 CPU，进程池才能用满多核，也不占 Web 进程）提前生成缩略图，
+第一个打开大项目的人不用再等几十张原图现场解码。
+每张图生成默认缩略图和 pregenerate_widths 档位的新格式版本（见 thumb_renditions），原图只解码一次。
+
+- 优先级：封面优先，其次按项目热度从高到低，同等条件下先进先出；
+- 同一张图排队期间只保留一份（再次入队只会提高它的优先级）；
+- 限速（config.ini [thumbnails]）：工作时间段内按 busy_max_per_second 提交，
+  其余时间按 max_per_second，避免预生成把共享盘带宽占满；
+- 已有缩略图且不比原图旧的直接跳过，所以重复入队的代价只是两次 stat；
+- 缩略图存在服务器本地的 packed 存储时（见 thumb_store），子进程只编码，内容带回本进程写入；
+  子进程的结果交回分发线程处理（写存储、写清单都在分发线程里，不占进程池的管理线程）；
+- 生成缩略图时顺带用最小的一档算出列表里的加载占位（见 thumb_placeholders），和清单一起写库；
+- /thumbs 请求仍然会按需生成，预生成只是让它大多数时候命中现成的文件。
+"""
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+
+from config import (
+    INDEXER_WRITE_CHUNK_SIZE,
+    MEDIA_ROOT,
+    THUMB_BUSY_HOURS,
+    THUMB_BUSY_MAX_PER_SECOND,
+    THUMB_MAX_PER_SECOND,
+    THUMB_PREGENERATE_WORKERS,
+    THUMB_QUEUE_LIMIT,
+)
+from database import SessionLocal
+from indexer import THUMB_LONG_EDGE, _encode_thumbnails, thumb_path_for_image
+from thumb_inventory import discard_stale_thumbnails, record_thumbnails
+from thumb_path_cache import thumb_paths
+from thumb_placeholders import make_placeholder, record_placeholders
+from thumb_renditions import pregenerate_plan, rendition_targets, variant_name
+from thumb_store import FolderThumbStore, ThumbStore, get_thumb_store
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin/thumbs", tags=["admin"])
+
+
+# ========== 子进程里执行的任务 ==========
+
+def pregenerate_thumbnail(
+    image_path: str,
+    project_dir: str,
+    widths: list[int],
+    fmt: Optional[str],
+    stored: Optional[dict[str, tuple[int, int]]] = None,
+) -> tuple[str, list[tuple[str, str, int, Optional[bytes]]], Optional[tuple[str, str]]]:
+    """
+    在进程池里运行：生成默认缩略图和 widths 档位的 fmt 版本（见 thumb_renditions），
+    不存在或比原图旧的才重新生成，原图只解码一次。
+    stored 为 None 时缩略图存在 _thumbs 目录里（folder 存储），子进程自己检查、自己写；
+    否则是主进程里的存储已有的 {版本名: (写入时间 ns, 字节数)}，子进程只编码，内容随结果带回主进程写入。
+    返回 (结果, [(版本名, 缩略图键, 字节数, 待写入的内容或 None), ...], 加载占位)，
+    结果为 "generated" / "skipped" / "failed"；加载占位是重新生成了缩略图时算出的 (小预览, 主色调)，否则为 None。
+    """
+    src = Path(image_path)
+    default_thumb = thumb_path_for_image(src, Path(project_dir))
+    if default_thumb is None:
+        return "failed", [], None
+
+    try:
+        src_mtime_ns = os.stat(src).st_mtime_ns
+    except OSError:
+        # 排队期间原图被删 / 改名了
+        return "failed", [], None
+
+    variants = _plan_variants(default_thumb, widths, fmt)
+
+    if stored is None:
+        store = FolderThumbStore()
+
+        def fresh_size(variant: str) -> Optional[int]:
+            thumb = store.stat(variants[variant][1])
+            return thumb.size if thumb is not None and thumb.mtime_ns >= src_mtime_ns else None
+
+        stale = [target for variant, target in variants.items() if fresh_size(variant) is None]
+        encoded: dict[Path, bytes] = {}
+        for path, data in (_encode_thumbnails(src, stale) if stale else []):
+            try:
+                store.put(path, data)
+                encoded[path] = data
+            except Exception as e:
+                logger.warning("写入缩略图失败 (%s -> %s): %s", src, path, e)
+        # 已经写进 _thumbs 了，内容不用带回主进程
+        to_return: dict[Path, bytes] = {}
+    else:
+        def fresh_size(variant: str) -> Optional[int]:
+            mtime_ns, size = stored.get(variant, (-1, 0))
+            return size if mtime_ns >= src_mtime_ns else None
+
+        stale = [target for variant, target in variants.items() if fresh_size(variant) is None]
+        encoded = dict(_encode_thumbnails(src, stale)) if stale else {}
+        to_return = encoded
+
+    entries = []
+    for variant, (_, path, _) in variants.items():
+        data = encoded.get(path)
+        size = len(data) if data is not None else fresh_size(variant)
+        if size is not None:
+            entries.append((variant, str(path), size, to_return.get(path)))
+
+    # 加载占位：用刚编码好的最小一档，不用再解码一次原图
+    placeholder = make_placeholder(min(encoded.values(), key=len)) if encoded else None
+
+    if len(entries) < len(variants):
+        return "failed", entries, placeholder
+    return ("generated" if stale else "skipped"), entries, placeholder
+
+
+def _plan_variants(
+    default_thumb: Path,
+    widths: list[int],
+    fmt: Optional[str],
+) -> dict[str, tuple[int, Path, Optional[str]]]:
+    """{版本名: (长边, 缩略图键, Pillow 格式名)}：默认缩略图 + widths 档位的 fmt 版本。"""
+    variants = {"": (THUMB_LONG_EDGE, default_thumb, None)}
+    for target in rendition_targets(default_thumb, widths, fmt):
+        variants.setdefault(variant_name(target[0], fmt), target)
+    return variants
+
+
+# ========== 预生成队列 ==========
+
+class ThumbWorkerStatus(BaseModel):
+    enabled: bool
+    workers: int
+    queued: int = 0
+    in_flight: int = 0
+    generated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # 队列满时丢弃的非封面图片数（它们仍会在 /thumbs 请求时按需生成）
+    dropped: int = 0
+    # 当前限速（张/秒），0 表示不限速
+    rate_limit: float = 0.0
+
+
+class ThumbPregenerator:
+    """
+    优先队列 + 分发线程 + 进程池。start() / stop() 由 app 的 startup / shutdown 事件调用；
+    start() 之前入队的图片会保留，启动后按优先级处理。
+    """
+
+    def __init__(
+        self,
+        workers: int = THUMB_PREGENERATE_WORKERS,
+        max_per_second: float = THUMB_MAX_PER_SECOND,
+        busy_hours: Optional[tuple[int, int]] = THUMB_BUSY_HOURS,
+        busy_max_per_second: float = THUMB_BUSY_MAX_PER_SECOND,
+        queue_limit: int = THUMB_QUEUE_LIMIT,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_per_second = max_per_second
+        self.busy_hours = busy_hours
+        self.busy_max_per_second = busy_max_per_second
+        self.queue_limit = queue_limit
+
+        self._cond = threading.Condition()
+        # 堆里的元素：(优先级, 序号, file_rel_path, 项目 folder_path)；
+        # _queued 记录每张图当前有效的优先级，堆里优先级对不上的是被提升过的旧条目，弹出时跳过
+        self._heap: list[tuple[tuple[int, int], int, str, str]] = []
+        self._queued: dict[str, tuple[int, int]] = {}
+        self._seq = itertools.count()
+
+        # 同时提交给进程池的任务数上限（保持进程池忙碌，又不把队列整个倒进去）
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 已从堆里取出、清理过过期缩略图、等着提交的图片（一次取一批，见 _take_batch）
+        self._ready: deque[tuple[str, str]] = deque()
+        # 进程池已完成、等分发线程处理结果的 (file_rel_path, Future)（见 _on_done）
+        self._done: list[tuple[str, Future]] = []
+        self._in_flight = 0
+        self._counts = {"generated": 0, "skipped": 0, "failed": 0, "dropped": 0}
+        # 已生成好、待写入缩略图清单的 (file_rel_path, 版本名, thumb_rel_path, 字节数)，攒一批再写库
+        self._to_record: list[tuple[str, str, str, Optional[int]]] = []
+        # 待写入的加载占位 (file_rel_path, 小预览, 主色调)，和清单一起写
+        self._placeholders: list[tuple[str, str, str]] = []
+        # 预生成哪些档位 / 格式（第一次提交时确定，见 thumb_renditions.pregenerate_plan）
+        self._plan: Optional[tuple[list[int], Optional[str]]] = None
+
+    # ---------- 入队 ----------
+
+    def enqueue(self, items: Iterable[tuple[str, str, bool, int]]) -> None:
+        """items：[(file_rel_path, 项目 folder_path, 是否封面, 项目热度), ...]。"""
+        with self._cond:
+            added = False
+            for rel_path, folder_path, is_cover, heat in items:
+                priority = (0 if is_cover else 1, -(heat or 0))
+                current = self._queued.get(rel_path)
+                if current is not None and current <= priority:
+                    continue
+                if current is None and not is_cover and len(self._queued) >= self.queue_limit:
+                    self._counts["dropped"] += 1
+                    continue
+                self._queued[rel_path] = priority
+                heapq.heappush(self._heap, (priority, next(self._seq), rel_path, folder_path))
+                added = True
+            if added:
+                self._cond.notify()
+
+    def _pop_batch(self, limit: int) -> Optional[list[tuple[str, str]]]:
+        """
+        取出优先级最高的至多 limit 张；队列为空时等待，有处理完的结果要写时返回空列表，
+        stop() 之后返回 None。
+        """
+        with self._cond:
+            while not self._stop.is_set():
+                batch = []
+                while self._heap and len(batch) < limit:
+                    priority, _, rel_path, folder_path = heapq.heappop(self._heap)
+                    if self._queued.get(rel_path) == priority:
+                        del self._queued[rel_path]
+                        batch.append((rel_path, folder_path))
+                if batch or self._done:
+                    return batch
+                self._cond.wait()
+        return None
+
+    # ---------- 限速 ----------
+
+    def current_rate_limit(self, now: Optional[datetime] = None) -> float:
+        """当前时刻的限速（张/秒），0 表示不限速。"""
+        if self.busy_hours is not None:
+            now = now or datetime.now()
+            minute = now.hour * 60 + now.minute
+            start, end = self.busy_hours
+            if start <= end:
+                busy = start <= minute < end
+            else:
+                # 跨午夜的时间段，例如 22:00-06:00
+                busy = minute >= start or minute < end
+            if busy:
+                return self.busy_max_per_second
+        return self.max_per_second
+
+    # ---------- 分发 ----------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._dispatch_loop, name="caselib-thumbs", daemon=True
+        )
+        self._thread.start()
+        logger.info("缩略图预生成已启动（%d 个进程）", self.workers)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                # 分发线程已退出：把它没来得及处理的结果写掉
+                self._handle_done(flush=True)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _dispatch_loop(self) -> None:
+        next_submit_at = 0.0
+        while not self._stop.is_set():
+            # 0) 先处理进程池交回的结果（写存储、写清单）
+            self._handle_done()
+
+            # 1) 等进程池有空位
+            if not self._slots.acquire(timeout=0.5):
+                continue
+
+            # 2) 限速：两次提交之间至少间隔 1 / rate_limit 秒
+            delay = next_submit_at - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                self._slots.release()
+                return
+
+            # 3) 取优先级最高的一张（放在等待之后取，等待期间新入队的封面也能排到前面）
+            item = self._take()
+            if item is None:
+                self._slots.release()
+                if self._stop.is_set():
+                    return
+                continue
+
+            rate_limit = self.current_rate_limit()
+            next_submit_at = time.monotonic() + (1.0 / rate_limit if rate_limit > 0 else 0.0)
+
+            if not self._submit(*item):
+                self._slots.release()
+
+    def _take(self) -> Optional[tuple[str, str]]:
+        """
+        下一张要提交的图片。手上的一批用完时从堆里再取一批（至多与提交上限相同），
+        用一个会话清理这批图片的过期缩略图（见 _discard_stale）。
+        队列为空、被处理完的结果唤醒或 stop() 之后返回 None。
+        """
+        with self._cond:
+            if self._ready:
+                return self._ready.popleft()
+        batch = self._pop_batch(self.workers * 2)
+        if not batch:
+            return None
+        # 原图被替换过的（清单里记的大小 / mtime 和索引对不上）：先删掉旧缩略图，
+        # 子进程只看“缩略图是否比原图新”，保留了修改时间的覆盖它看不出来
+        self._discard_stale([rel_path for rel_path, _ in batch])
+        with self._cond:
+            self._ready.extend(batch[1:])
+        return batch[0]
+
+    def _submit(self, rel_path: str, folder_path: str) -> bool:
+        if self._plan is None:
+            self._plan = pregenerate_plan()
+        args = (str(MEDIA_ROOT / rel_path), str(MEDIA_ROOT / folder_path), *self._plan)
+        store = get_thumb_store()
+        if not store.shared_between_processes:
+            # 存储只在本进程里：把已有版本的写入时间告诉子进程，由它判断哪些要重新生成
+            args += (self._stored_versions(store, *args),)
+        for _ in range(2):
+            if self._pool is None:
+                # spawn：Web 进程里有很多线程（以及数据库连接），fork 出来的子进程可能带着锁死的状态
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            try:
+                future = self._pool.submit(pregenerate_thumbnail, *args)
+            except BrokenProcessPool:
+                # 子进程异常退出（例如解码某张坏图时崩溃）：换一个新的进程池重试一次
+                logger.warning("缩略图进程池已损坏，重新创建")
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                continue
+            except RuntimeError:
+                # stop() 之后进程池已关闭
+                return False
+
+            with self._cond:
+                self._in_flight += 1
+            future.add_done_callback(partial(self._on_done, rel_path))
+            return True
+
+        with self._cond:
+            self._counts["failed"] += 1
+        return False
+
+    @staticmethod
+    def _discard_stale(rel_paths: list[str]) -> None:
+        db = SessionLocal()
+        try:
+            discard_stale_thumbnails(db, rel_paths)
+        except Exception:
+            db.rollback()
+            logger.exception("清理过期缩略图失败: %d 张", len(rel_paths))
+        finally:
+            db.close()
+
+    @staticmethod
+    def _stored_versions(
+        store: ThumbStore,
+        image_path: str,
+        project_dir: str,
+        widths: list[int],
+        fmt: Optional[str],
+    ) -> dict[str, tuple[int, int]]:
+        default_thumb = thumb_path_for_image(Path(image_path), Path(project_dir))
+        if default_thumb is None:
+            return {}
+        stored = {}
+        for variant, (_, key, _) in _plan_variants(default_thumb, widths, fmt).items():
+            thumb = store.stat(key)
+            if thumb is not None:
+                stored[variant] = (thumb.mtime_ns, thumb.size)
+        return stored
+
+    def _on_done(self, rel_path: str, future: Future) -> None:
+        """在进程池的管理线程里调用：只把结果交给分发线程（见 _handle_done），不做 I/O。"""
+        self._slots.release()
+        with self._cond:
+            self._done.append((rel_path, future))
+            self._cond.notify_all()
+
+    def _handle_done(self, flush: bool = False) -> None:
+        """
+        在分发线程里处理进程池交回的结果：子进程只编码的（packed 存储）在这里写入存储，
+        清单和加载占位攒够一块、或者队列已经处理完时（flush=True 时总是）用一个会话写库。
+        """
+        with self._cond:
+            done, self._done = self._done, []
+
+        store = get_thumb_store()
+        for rel_path, future in done:
+            outcome, generated, placeholder = None, [], None
+            if not future.cancelled():
+                try:
+                    outcome, generated, placeholder = future.result()
+                except Exception as e:
+                    logger.warning("预生成缩略图失败: %s", e)
+                    outcome = "failed"
+
+            written = []
+            for variant, thumb_path, thumb_size, data in generated:
+                if data is not None:
+                    try:
+                        store.put(Path(thumb_path), data)
+                    except Exception as e:
+                        logger.warning("写入缩略图失败 (%s): %s", thumb_path, e)
+                        outcome = "failed"
+                        continue
+                written.append((variant, thumb_path, thumb_size))
+
+            with self._cond:
+                self._in_flight -= 1
+                if outcome is not None:
+                    self._counts[outcome] += 1
+                for variant, thumb_path, thumb_size in written:
+                    try:
+                        thumb_rel = Path(thumb_path).relative_to(MEDIA_ROOT).as_posix()
+                    except ValueError:
+                        continue
+                    self._to_record.append((rel_path, variant, thumb_rel, thumb_size))
+                    thumb_paths.remember_thumb(rel_path, variant, Path(thumb_path))
+                if placeholder is not None:
+                    self._placeholders.append((rel_path, *placeholder))
+
+        with self._cond:
+            drained = not self._queued and not self._ready and self._in_flight == 0
+            pending = max(len(self._to_record), len(self._placeholders))
+            if not pending:
+                return
+            if pending < INDEXER_WRITE_CHUNK_SIZE and not drained and not flush:
+                return
+            entries, self._to_record = self._to_record, []
+            placeholders, self._placeholders = self._placeholders, []
+
+        db = SessionLocal()
+        try:
+            record_thumbnails(db, entries)
+            record_placeholders(db, placeholders)
+        except Exception:
+            db.rollback()
+            logger.exception("写入缩略图清单失败")
+        finally:
+            db.close()
+
+    def status(self) -> ThumbWorkerStatus:
+        with self._cond:
+            return ThumbWorkerStatus(
+                enabled=True,
+                workers=self.workers,
+                queued=len(self._queued) + len(self._ready),
+                in_flight=self._in_flight,
+                rate_limit=self.current_rate_limit(),
+                **self._counts,
+            )
+
+
+# ========== 全局实例（由 app 启停） ==========
+
+# pregenerate_workers = 0 时为 None：同步照常进行，缩略图只按需生成
+_pregenerator: Optional[ThumbPregenerator] = (
+    ThumbPregenerator() if THUMB_PREGENERATE_WORKERS > 0 else None
+)
+
+
+def enqueue_thumbnails(items: list[tuple[str, str, bool, int]]) -> None:
+    """
+    同步写完一批之后调用（indexer 的 on_images_changed）：把新增 / 原图变化的图片排进预生成队列。
+    """
+    if _pregenerator is not None:
+        _pregenerator.enqueue(items)
+
+
+def start_thumb_worker() -> None:
+    if _pregenerator is not None:
+        _pregenerator.start()
+
+
+def stop_thumb_worker() -> None:
+    if _pregenerator is not None:
+        _pregenerator.stop()
+
+
+@router.get("", response_model=ThumbWorkerStatus)
+def api_thumb_worker_status() -> ThumbWorkerStatus:
+    """缩略图预生成队列的状态：排队数、进行中、已生成 / 跳过 / 失败数和当前限速。"""
+    if _pregenerator is None:
+        return ThumbWorkerStatus(enabled=False, workers=0)
+    return _pregenerator.status()
@@ -8,7 +8,8 @@ from typing import Literal
 from fastapi import APIRouter, BackgroundTasks, HTTPException
 from pydantic import BaseModel
 
-from config import PROJECTS_ROOT
+from config import MEDIA_ROOT, PROJECTS_ROOT
+from sync_jobs import request_folder_sync
 from web_import_common import (
     ParsedProject,
     safe_folder_name,
@@ -100,7 +101,7 @@ def _parse_url(url: str) -> ParsedProject:
 
 def run_import_job(task_id: str, parsed: ParsedProject, folder_name: str) -> None:
     """
-    后台导入主流程：下载图片 + 写 project.json。
+    后台导入主流程：下载图片 + 写 project.json + 同步该目录的索引。
     """
     try:
         folder_name_safe = safe_folder_name(folder_name or parsed.suggested_folder)
@@ -116,11 +117,20 @@ def run_import_job(task_id: str, parsed: ParsedProject, folder_name: str) -> Non
         download_images(parsed, dest_dir, task_id, _update_task)
         write_project_json(parsed, dest_dir)
 
+        # 只同步新导入的这个目录，不用整库重扫
+        sync_result = request_folder_sync(dest_dir.relative_to(MEDIA_ROOT).as_posix())
+        if sync_result.status == "done":
+            message = "导入完成，已加入案例库"
+        elif sync_result.status == "queued":
+            message = "导入完成（案例库正在同步，完成后可见）"
+        else:
+            message = "导入完成（文件已写入本地，但索引失败，回到案例库刷新后可见）"
+
         _update_task(
             task_id,
             status="done",
             progress=1.0,
-            message="导入完成（文件已写入本地，回到案例库刷新后可见）",
+            message=message,
         )
     except Exception as e:
         logger.exception("导入任务失败: %s", e)
@@ -98,6 +98,7 @@
     hasMore: true,
     activeQuery: "",
     activeProjectId: null,
+    thumbBlobUrls: [], // 批量缩略图生成的 blob: 地址，重置瀑布流时释放
   };
 
   // ------- 瀑布流列布局状态 -------
@@ -191,6 +192,19 @@
     };
   }
 
+  // ------- 工具：加载占位 -------
+
+  // 缩略图到达前用接口带回的模糊小预览 + 主色调铺底（缩略图加载完会盖住背景）
+  function applyPlaceholder(imgEl, placeholder, color) {
+    if (color) {
+      imgEl.style.backgroundColor = color;
+    }
+    if (placeholder) {
+      imgEl.style.backgroundImage = `url("${placeholder}")`;
+      imgEl.classList.add("has-placeholder");
+    }
+  }
+
   // ------- 搜索框 X 按钮显隐 -------
 
   function updateSearchClearVisibility() {
@@ -392,6 +406,16 @@
   let lightboxImg = null;
   let lightboxImgWrap = null;
   let lightboxSetCoverBtn = null;
+  let lightboxDownloadLink = null;
+  let lightboxTileLayer = null;
+
+  // 超大图的 Deep Zoom 分块（见后端 thumb_tiles）：放大到显示尺寸版本不够清晰时，只加载视野里的分块
+  const deepZoomState = {
+    dziUrl: null, // 当前图片的 DZI 描述地址
+    info: null, // { width, height, tileSize, maxLevel, base, query }
+    level: null, // 当前铺着的层
+    tiles: new Set(), // 已铺上的分块 "列_行"
+  };
 
   // ------- Tab 切换 -------
 
@@ -946,7 +970,13 @@
       if (p.cover_url) {
         const img = document.createElement("img");
         img.src = p.cover_url;
+        if (p.cover_srcset) {
+          // 卡片宽度约 220~400px（见 .project-grid），浏览器按实际像素密度挑档位
+          img.sizes = "(max-width: 600px) 50vw, 320px";
+          img.srcset = p.cover_srcset;
+        }
         img.alt = p.name || "";
+        applyPlaceholder(img, p.cover_placeholder, p.cover_color);
         coverWrap.appendChild(img);
       } else {
         const placeholder = document.createElement("div");
@@ -1224,6 +1254,8 @@
       imageState.hasMore = true;
       imageState.activeQuery = query || "";
       imageState.activeProjectId = projectId != null ? projectId : null;
+      imageState.thumbBlobUrls.forEach((u) => URL.revokeObjectURL(u));
+      imageState.thumbBlobUrls = [];
       resetWaterfallLayout();
     } else {
       if (!imageState.hasMore) return;
@@ -1245,6 +1277,16 @@
       const url = "/api/images?" + params.toString();
       console.log("fetchImagesPage ->", url);
 
+      // 项目相册：这一页的缩略图打包成一个请求，和列表并行取
+      const batchPromise =
+        imageState.activeProjectId != null && !imageState.activeQuery
+          ? fetchThumbBatch(
+              imageState.activeProjectId,
+              imageState.offset,
+              imageState.limit
+            )
+          : Promise.resolve(null);
+
       const res = await fetch(url);
       if (!res.ok) throw new Error("请求图片列表失败，status=" + res.status);
 
@@ -1276,7 +1318,7 @@
             '<p class="center-hint">暂无图片。</p>';
         }
       } else {
-        appendImages(pageItems, startIndex);
+        appendImages(pageItems, startIndex, await batchPromise);
       }
     } catch (err) {
       console.error("fetchImagesPage 出错：", err);
@@ -1289,9 +1331,52 @@
     }
   }
 
+  // ------- 批量缩略图（/api/thumbs/batch） -------
+
+  // 返回 { file_rel_path: blob 地址 }；失败时返回 null（退回逐张的 /thumbs 地址）
+  async function fetchThumbBatch(projectId, offset, limit) {
+    try {
+      const colCount = waterfallColCount > 0 ? waterfallColCount : 1;
+      const width = Math.ceil(
+        (window.innerWidth / colCount) * (window.devicePixelRatio || 1)
+      );
+      const params = new URLSearchParams();
+      params.set("project_id", String(projectId));
+      params.set("offset", String(offset));
+      params.set("limit", String(limit));
+      params.set("w", String(width));
+
+      const res = await fetch("/api/thumbs/batch?" + params.toString());
+      if (!res.ok) throw new Error("status=" + res.status);
+      const buf = await res.arrayBuffer();
+
+      // [4 字节大端索引长度][JSON 索引][数据区]
+      const indexLength = new DataView(buf).getUint32(0);
+      const index = JSON.parse(
+        new TextDecoder().decode(new Uint8Array(buf, 4, indexLength))
+      );
+      const dataStart = 4 + indexLength;
+
+      const urls = {};
+      (index.items || []).forEach((item) => {
+        const blob = new Blob(
+          [new Uint8Array(buf, dataStart + item.offset, item.length)],
+          { type: item.content_type }
+        );
+        const blobUrl = URL.createObjectURL(blob);
+        imageState.thumbBlobUrls.push(blobUrl);
+        urls[item.path] = blobUrl;
+      });
+      return urls;
+    } catch (e) {
+      console.warn("批量缩略图获取失败，改为逐张加载：", e);
+      return null;
+    }
+  }
+
   // ------- 只追加图片到列中（不会清空旧的） -------
 
-  function appendImages(images, startIndex) {
+  function appendImages(images, startIndex, batchUrls) {
     if (!waterfallContainer) return;
     if (!images || images.length === 0) return;
 
@@ -1307,8 +1392,24 @@
       item.dataset.index = String(globalIndex);
 
       const imgEl = document.createElement("img");
-      imgEl.src = img.thumb_url || img.url;
+      const batchUrl = batchUrls && batchUrls[img.file_rel_path];
+      if (batchUrl) {
+        // 批量接口已按列宽取好了合适的档位
+        imgEl.src = batchUrl;
+      } else {
+        imgEl.src = img.thumb_url || img.url;
+      }
+      if (!batchUrl && img.thumb_srcset) {
+        // 瀑布流每列等宽
+        imgEl.sizes = `${Math.ceil(100 / waterfallColCount)}vw`;
+        imgEl.srcset = img.thumb_srcset;
+      }
       imgEl.alt = img.file_name || "";
+      if (img.aspect_ratio) {
+        // 提前按原图比例占好位置，占位底色才看得见，图片到达时也不会跳动
+        imgEl.style.aspectRatio = String(img.aspect_ratio);
+      }
+      applyPlaceholder(imgEl, img.placeholder, img.dominant_color);
 
       item.appendChild(imgEl);
 
@@ -1356,13 +1457,148 @@
     const img = imageState.items[lightboxState.currentIndex];
     if (!img) return;
 
-    lightboxImg.src = img.url;
+    // 显示尺寸版本（/display/...），原图只在“下载原图”时加载
+    lightboxImg.src = img.display_url || img.url;
     lightboxImg.alt = img.file_name || "";
+    if (lightboxDownloadLink) {
+      lightboxDownloadLink.href = img.url;
+    }
+    if (deepZoomState.dziUrl !== (img.dzi_url || null)) {
+      resetDeepZoom(img.dzi_url || null);
+    }
     const scale = lightboxState.scale || 1;
     const tx = lightboxState.translateX || 0;
     const ty = lightboxState.translateY || 0;
     lightboxImg.style.transform =
       "translate(" + tx + "px, " + ty + "px) scale(" + scale + ")";
+    updateDeepZoomTiles();
+  }
+
+  // ------- Deep Zoom 分块 -------
+
+  function clearDeepZoomTiles() {
+    deepZoomState.level = null;
+    deepZoomState.tiles.clear();
+    if (lightboxTileLayer) {
+      lightboxTileLayer.innerHTML = "";
+    }
+  }
+
+  function resetDeepZoom(dziUrl) {
+    deepZoomState.dziUrl = dziUrl;
+    deepZoomState.info = null;
+    clearDeepZoomTiles();
+    if (!dziUrl) return;
+
+    fetch(dziUrl)
+      .then((res) => {
+        if (!res.ok) throw new Error("DZI 请求失败，status=" + res.status);
+        return res.text();
+      })
+      .then((text) => {
+        if (deepZoomState.dziUrl !== dziUrl) return; // 已经切到别的图片
+        const doc = new DOMParser().parseFromString(text, "application/xml");
+        const imageEl = doc.documentElement;
+        const sizeEl = doc.getElementsByTagName("Size")[0];
+        const width = parseInt(sizeEl.getAttribute("Width"), 10);
+        const height = parseInt(sizeEl.getAttribute("Height"), 10);
+        const qIndex = dziUrl.indexOf("?");
+        const path = qIndex >= 0 ? dziUrl.slice(0, qIndex) : dziUrl;
+        deepZoomState.info = {
+          width,
+          height,
+          tileSize: parseInt(imageEl.getAttribute("TileSize"), 10),
+          maxLevel: Math.ceil(Math.log2(Math.max(width, height))),
+          base: path.replace(/\.dzi$/, "_files"),
+          query: qIndex >= 0 ? dziUrl.slice(qIndex) : "",
+        };
+        updateDeepZoomTiles();
+      })
+      .catch((err) => {
+        console.warn("加载 Deep Zoom 描述失败：", err);
+      });
+  }
+
+  function updateDeepZoomTiles() {
+    const info = deepZoomState.info;
+    if (!lightboxTileLayer || !lightboxImg || !lightboxImgWrap) return;
+    if (!info || !lightboxState.isOpen || !lightboxImg.naturalWidth) {
+      clearDeepZoomTiles();
+      return;
+    }
+
+    // 分块层与大图占同一个位置、做同样的变换
+    const boxLeft = lightboxImg.offsetLeft;
+    const boxTop = lightboxImg.offsetTop;
+    const boxWidth = lightboxImg.offsetWidth;
+    const boxHeight = lightboxImg.offsetHeight;
+    lightboxTileLayer.style.left = boxLeft + "px";
+    lightboxTileLayer.style.top = boxTop + "px";
+    lightboxTileLayer.style.width = boxWidth + "px";
+    lightboxTileLayer.style.height = boxHeight + "px";
+    lightboxTileLayer.style.transform = lightboxImg.style.transform;
+
+    // 屏幕上的实际像素没有超过显示尺寸版本时不需要分块
+    const scale = lightboxState.scale || 1;
+    const shownWidth = boxWidth * scale * (window.devicePixelRatio || 1);
+    if (shownWidth <= lightboxImg.naturalWidth * 1.1) {
+      clearDeepZoomTiles();
+      return;
+    }
+
+    // 取宽度不小于屏幕像素的最低一层
+    const level = Math.max(
+      0,
+      Math.min(
+        info.maxLevel,
+        info.maxLevel - Math.floor(Math.log2(info.width / shownWidth))
+      )
+    );
+    if (level !== deepZoomState.level) {
+      clearDeepZoomTiles();
+      deepZoomState.level = level;
+    }
+    const levelScale = Math.pow(2, info.maxLevel - level);
+    const levelWidth = Math.ceil(info.width / levelScale);
+    const levelHeight = Math.ceil(info.height / levelScale);
+
+    // 视野在图片上的范围（0~1），按变换后的最终位置计算（不受 transition 影响）
+    const tx = lightboxState.translateX || 0;
+    const ty = lightboxState.translateY || 0;
+    const shownW = boxWidth * scale;
+    const shownH = boxHeight * scale;
+    const left = boxLeft + boxWidth / 2 + tx - shownW / 2;
+    const top = boxTop + boxHeight / 2 + ty - shownH / 2;
+    const clamp = (v) => Math.min(1, Math.max(0, v));
+    const x0 = clamp(-left / shownW);
+    const x1 = clamp((lightboxImgWrap.clientWidth - left) / shownW);
+    const y0 = clamp(-top / shownH);
+    const y1 = clamp((lightboxImgWrap.clientHeight - top) / shownH);
+
+    const ts = info.tileSize;
+    const colStart = Math.floor((x0 * levelWidth) / ts);
+    const colEnd = Math.ceil((x1 * levelWidth) / ts);
+    const rowStart = Math.floor((y0 * levelHeight) / ts);
+    const rowEnd = Math.ceil((y1 * levelHeight) / ts);
+
+    for (let row = rowStart; row < rowEnd; row++) {
+      for (let col = colStart; col < colEnd; col++) {
+        const key = col + "_" + row;
+        if (deepZoomState.tiles.has(key)) continue;
+        deepZoomState.tiles.add(key);
+
+        const tile = document.createElement("img");
+        tile.src = `${info.base}/${level}/${key}.jpg${info.query}`;
+        tile.alt = "";
+        tile.style.left = ((col * ts) / levelWidth) * 100 + "%";
+        tile.style.top = ((row * ts) / levelHeight) * 100 + "%";
+        tile.style.width =
+          (Math.min(ts, levelWidth - col * ts) / levelWidth) * 100 + "%";
+        tile.style.height =
+          (Math.min(ts, levelHeight - row * ts) / levelHeight) * 100 + "%";
+        lightboxTileLayer.appendChild(tile);
+      }
+    }
   }
 
   function showRelativeImage(delta) {
@@ -1472,7 +1708,17 @@
     const imgEl = document.createElement("img");
     imgEl.className = "lightbox-image";
 
+    // Deep Zoom 分块层（盖在大图上，见 updateDeepZoomTiles）
+    const tileLayer = document.createElement("div");
+    tileLayer.className = "lightbox-tile-layer";
+
     imgWrap.appendChild(imgEl);
+    imgWrap.appendChild(tileLayer);
+
+    // 大图加载完成后尺寸才确定，重新计算分块
+    imgEl.addEventListener("load", () => {
+      updateDeepZoomTiles();
+    });
 
     const prevBtn = document.createElement("button");
     prevBtn.type = "button";
@@ -1494,10 +1740,18 @@
     setCoverBtn.className = "lightbox-set-cover-btn";
     setCoverBtn.textContent = "设为封面";
 
-    // 底部 footer，用来居中“设为封面”按钮
+    const downloadLink = document.createElement("a");
+    downloadLink.className = "lightbox-download-link";
+    downloadLink.textContent = "下载原图";
+    downloadLink.target = "_blank";
+    downloadLink.rel = "noopener";
+    downloadLink.setAttribute("download", "");
+
+    // 底部 footer，用来居中“设为封面” / “下载原图”按钮
     const footer = document.createElement("div");
     footer.className = "lightbox-footer";
     footer.appendChild(setCoverBtn);
+    footer.appendChild(downloadLink);
 
     inner.appendChild(prevBtn);
     inner.appendChild(imgWrap);
@@ -1511,6 +1765,12 @@
     lightboxImg = imgEl;
     lightboxImgWrap = imgWrap;
     lightboxSetCoverBtn = setCoverBtn;
+    lightboxDownloadLink = downloadLink;
+    lightboxTileLayer = tileLayer;
+
+    downloadLink.addEventListener("click", (e) => {
+      e.stopPropagation();
+    });
 
     // 点击遮罩空白处关闭
     overlay.addEventListener("click", (e) => {
@@ -1755,14 +2015,28 @@
 
   // ------- 刷新案例库（手动 resync） -------
 
-  if (refreshProjectsBtn) {
-    refreshProjectsBtn.addEventListener("click", async () => {
-      try {
-        const res = await fetch("/api/admin/resync", { method: "POST" });
-        if (!res.ok) {
-          throw new Error("resync 失败，status=" + res.status);
-        }
+  // 同步在后台任务里跑：发起后轮询任务状态，结束后再刷新列表
+  let resyncPollTimer = null;
 
+  async function pollResyncJob(jobId) {
+    try {
+      const res = await fetch("/api/admin/resync/" + jobId);
+      if (!res.ok) {
+        throw new Error("获取同步状态失败，status=" + res.status);
+      }
+      const job = await res.json();
+
+      if (job.status === "running") {
+        showToast(
+          "正在刷新案例库… 已扫描 " + job.dirs_scanned + " 个目录，" +
+          "写入 " + job.rows_written + " 条"
+        );
+        resyncPollTimer = setTimeout(() => pollResyncJob(jobId), 1000);
+        return;
+      }
+
+      resyncPollTimer = null;
+      if (job.status === "done") {
         if (searchInput) {
           searchInput.value = "";
         }
@@ -1770,6 +2044,32 @@
 
         showToast("案例库已刷新");
         await fetchProjects(true);
+      } else if (job.status === "cancelled") {
+        showToast("刷新已取消");
+      } else {
+        showToast("刷新失败");
+      }
+    } catch (e) {
+      resyncPollTimer = null;
+      console.error("刷新案例库失败：", e);
+      showToast("刷新失败");
+    }
+  }
+
+  if (refreshProjectsBtn) {
+    refreshProjectsBtn.addEventListener("click", async () => {
+      if (resyncPollTimer) {
+        // 已经在等同一个同步任务了
+        return;
+      }
+      try {
+        const res = await fetch("/api/admin/resync", { method: "POST" });
+        if (!res.ok) {
+          throw new Error("resync 失败，status=" + res.status);
+        }
+        const job = await res.json();
+        showToast(job.joined ? "已有刷新在进行，正在等待完成…" : "正在刷新案例库…");
+        await pollResyncJob(job.job_id);
       } catch (e) {
         console.error("刷新案例库失败：", e);
         showToast("刷新失败");